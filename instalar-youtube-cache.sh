@@ -18,7 +18,7 @@ echo "╚═══════════════════════
 echo -e "${NC}"
 
 echo -e "${YELLOW}[1/6] Instalando dependências Python...${NC}"
-pip3 install watchdog python-magic python-magic-bin 2>&1 | grep -i 'success\|installed' || true
+pip3 install watchdog 2>&1 | grep -i 'success\|installed' || true
 echo -e "${GREEN}✓ Dependências instaladas${NC}"
 
 echo ""
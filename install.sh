@@ -232,6 +232,7 @@ User=root
 WorkingDirectory=$INSTALL_DIR
 Environment=PATH=$INSTALL_DIR/venv/bin:/usr/local/bin:/usr/bin:/bin
 ExecStart=$INSTALL_DIR/venv/bin/python $INSTALL_DIR/scripts/stream-manager.py
+Delegate=yes
 Restart=always
 RestartSec=5
 
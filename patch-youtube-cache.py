@@ -171,6 +171,6 @@ print("✅ Patch aplicado com sucesso!")
 print("Backup salvo em: stream-manager.py.before-cache-patch")
 print("")
 print("Próximos passos:")
-print("1. Instalar dependências: pip3 install watchdog python-magic")
+print("1. Instalar dependências: pip3 install watchdog")
 print("2. Reiniciar serviço: systemctl restart stream-manager")
 print("3. Testar YouTube: curl -X POST http://localhost:8080/api/streams/youtube_exemplo/start")
@@ -1,18 +1,30 @@
 #!/usr/bin/env python3
 """
 Cache Capture - Captura fragmentos de vídeo do cache do navegador
-Monitora o cache do Chrome e extrai fragmentos de vídeo em tempo real
+Monitora o cache do Chrome e alimenta um único FFmpeg persistente com os fragmentos
 """
 
 import os
 import sys
 import time
+import errno
+import queue
+import signal
 import subprocess
+import threading
 import logging
+import struct
+import re
+import mmap
+import heapq
+import hashlib
+import itertools
+import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import magic
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,175 +32,978 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+SNIFF_SIZE = 8192  # Uma leitura basta: cabeçalho do cache (com a URL) + início da mídia
+MAX_INIT_SIZE = 1024 * 1024  # Init segment (ftyp + moov) guardado em memória para relançamentos
+CAPTURED_MEMORY = 4096  # Arquivos já anexados lembrados para não anexar de novo
+HLS_TIME = 2
+HLS_LIST_SIZE = 10
+# Um arquivo só é processado depois de ficar este tempo sem mudar de tamanho
+QUIET_WINDOW = float(os.environ.get('CACHE_CAPTURE_QUIET_WINDOW', 0.5))
+CLASSIFY_WORKERS = int(os.environ.get('CACHE_CAPTURE_WORKERS', 2))
+CLASSIFY_CACHE_SIZE = 4096  # Classificações lembradas por (inode, tamanho, mtime)
+# Fragmentos esperam até esta janela para que um anterior atrasado passe na frente
+REORDER_WINDOW = float(os.environ.get('CACHE_CAPTURE_REORDER_WINDOW', 1.0))
+REORDER_MAX_PENDING = 16
+INDEX_SIZE = 256  # Fragmentos liberados lembrados (hash e tempo) para descartar repetidos
+GAP_TOLERANCE = 1.5  # Intervalo acima de 1,5x a duração típica conta como lacuna
+PTS_WRAP = 1 << 33  # PTS do MPEG-TS tem 33 bits (90 kHz): volta a zero a cada ~26,5 h
+
+
+TS_PACKET_SIZE = 188
+TS_STREAM_TYPES = {
+    0x01: 'mpeg1video', 0x02: 'mpeg2video', 0x03: 'mp3', 0x04: 'mp3', 0x0f: 'aac', 0x11: 'aac_latm',
+    0x1b: 'h264', 0x24: 'hevc', 0x81: 'ac3', 0x87: 'eac3'
+}
+# Caixas ISO BMFF aceitas no nível superior de um init segment ou fragmento
+BMFF_TOP_LEVEL = {b'ftyp', b'styp', b'moov', b'moof', b'mdat', b'sidx', b'ssix', b'emsg', b'prft',
+                  b'free', b'skip', b'uuid', b'mfra'}
+BMFF_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'moof', b'traf'}
+EBML_MAGIC = b'\x1A\x45\xDF\xA3'
+EBML_CLUSTER = b'\x1F\x43\xB6\x75'
+# Cache "simple" do Chrome: cabeçalho de 24 bytes seguido da chave (URL) e do corpo
+SIMPLE_INITIAL_MAGIC = 0xfcfb6d1ba7725c30
+SIMPLE_HEADER = struct.Struct('<QIII4x')
+# Arquivo _0: cabeçalho | chave | stream 1 (corpo) | EOF1 | stream 0 (cabeçalhos HTTP) | [SHA-256] | EOF0
+SIMPLE_FINAL_MAGIC = 0xf4fa6f45970d41d8
+SIMPLE_EOF = struct.Struct('<QIII4x')  # magic, flags, crc32, tamanho do stream
+SIMPLE_EOF_HAS_KEY_SHA256 = 2
+# Arquivo _s (entradas esparsas, usadas em pedidos com Range): faixas precedidas de cabeçalho
+SIMPLE_SPARSE_MAGIC = 0xeb97bf016553676b
+SIMPLE_SPARSE_RANGE = struct.Struct('<QqqI4x')  # magic, offset no recurso, tamanho, crc32
+# Cache blockfile: index + data_N (blocos) + f_XXXXXX (corpos grandes, sem envelope)
+BLOCK_MAGIC = 0xC104CAC3
+BLOCK_HEADER_SIZE = 8192
+BLOCK_SIZES = {1: 36, 2: 256, 3: 1024, 4: 4096, 5: 8, 6: 104, 7: 48}  # Por tipo de arquivo
+BLOCK_ENTRY = struct.Struct('<IIIiiiQiI4i4II')  # EntryStore até flags; a chave começa em 96
+BLOCK_ENTRY_KEY_OFFSET = 96
+BLOCKFILE_EXTERNAL = re.compile(r'f_[0-9a-f]{6}')
+BLOCKFILE_RESCAN = 2  # Segundos mínimos entre releituras do data_1
+HTTP_RAW_HEADERS = re.compile(rb'HTTP/[\d.]+ (\d{3})[^\x00]*\x00((?:[^\x00]+\x00)*)')
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+SEQUENCE_PARAMS = ('sq', 'seq', 'sequence', 'segment', 'frag', 'fragment')
+SEGMENT_NUMBER = re.compile(r'(\d+)\.(?:ts|m4s|m4v|m4a|mp4|webm|aac|cmfv|cmfa)$')
+# Codecs de vídeo como o sniffer os nomeia (PMT do TS, sample entry do MP4, CodecID do WebM)
+VIDEO_CODECS = {'h264', 'hevc', 'mpeg1video', 'mpeg2video', 'avc1', 'avc3', 'hvc1', 'hev1', 'vp08', 'vp09',
+                'av01', 'V_VP8', 'V_VP9', 'V_AV1', 'V_MPEG4/ISO/AVC'}
+
+
+def sniff_media(buf):
+    """Identifica o contêiner pelo início da mídia (já sem envelope de cache); None se não for utilizável
+
+    Retorna {'container', 'kind' (init/media), 'offset', 'codecs', 'timing'}.
+    """
+    return sniff_ts(buf) or sniff_bmff(buf) or sniff_ebml(buf)
+
+
+def sniff_ts(buf):
+    """MPEG-TS: sync byte a cada 188 bytes; PAT/PMT dão os codecs e o PES dá o PTS"""
+    packets = len(buf) // TS_PACKET_SIZE
+    if packets < 2 or any(buf[i * TS_PACKET_SIZE] != 0x47 for i in range(packets)):
+        return None
+    pmt_pids = set()
+    codecs = []
+    pts = None
+    for i in range(packets):
+        packet = buf[i * TS_PACKET_SIZE:(i + 1) * TS_PACKET_SIZE]
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        unit_start = packet[1] & 0x40
+        payload = 4
+        if packet[3] & 0x20:  # Adaptation field
+            payload += 1 + packet[4]
+        if not packet[3] & 0x10 or payload >= TS_PACKET_SIZE:
+            continue
+        data = packet[payload:]
+        if unit_start and (pid == 0 or pid in pmt_pids):
+            section = data[1 + data[0]:]  # pointer_field
+            if len(section) < 12:
+                continue
+            length = min(((section[1] & 0x0f) << 8) | section[2], len(section) - 3)
+            if pid == 0 and section[0] == 0x00:
+                for pos in range(8, 3 + length - 4, 4):
+                    if int.from_bytes(section[pos:pos + 2], 'big'):  # program_number 0 é a NIT
+                        pmt_pids.add(int.from_bytes(section[pos + 2:pos + 4], 'big') & 0x1fff)
+            elif section[0] == 0x02:
+                pos = 12 + (((section[10] & 0x0f) << 8) | section[11])
+                while pos + 5 <= 3 + length - 4:
+                    stream_type = section[pos]
+                    codecs.append(TS_STREAM_TYPES.get(stream_type, f'0x{stream_type:02x}'))
+                    pos += 5 + (((section[pos + 3] & 0x0f) << 8) | section[pos + 4])
+        elif unit_start and pts is None and data[:3] == b'\x00\x00\x01' and len(data) >= 14 \
+                and data[7] & 0x80:
+            pts = (((data[9] >> 1) & 0x07) << 30 | data[10] << 22 | (data[11] >> 1) << 15 |
+                   data[12] << 7 | data[13] >> 1)
+    return {
+        'container': 'mpegts',
+        'kind': 'media',
+        'offset': 0,
+        'codecs': codecs,
+        'timing': {'pts': pts, 'timescale': 90000} if pts is not None else {}
+    }
+
+
+def _boxes(buf, start, end):
+    """Percorre caixas ISO BMFF em buf[start:end]: (tipo, início do conteúdo, fim)"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos  # Até o fim do arquivo
+        if size < header or not box_type.isalnum() and box_type != b'uuid':
+            raise ValueError(f"caixa inválida em {pos}")
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def sniff_bmff(buf):
+    """ISO BMFF: caminha pelas caixas; init (ftyp+moov) ou fragmento (styp/moof+mdat)"""
+    if len(buf) < 8 or buf[4:8] not in BMFF_TOP_LEVEL:
+        return None
+    found = {}
+    codecs = []
+    timing = {}
+
+    def walk(start, end, depth):
+        for box_type, body, box_end in _boxes(buf, start, end):
+            found.setdefault(box_type, body)
+            if depth == 0 and box_type not in BMFF_TOP_LEVEL:
+                raise ValueError(f"caixa {box_type!r} fora do lugar")
+            if box_end > len(buf):
+                continue  # Conteúdo além do buffer lido: só o cabeçalho conta
+            if box_type in BMFF_CONTAINERS:
+                walk(body, box_end, depth + 1)
+            elif box_type == b'stsd' and body + 16 <= box_end:
+                codecs.append(buf[body + 12:body + 16].decode('ascii', 'replace'))
+            elif box_type == b'mdhd' and 'timescale' not in timing and body + 24 <= box_end:
+                version = buf[body]
+                timing['timescale'] = struct.unpack_from('>I', buf, body + (20 if version else 12))[0]
+            elif box_type == b'tfdt' and 'tfdt' not in timing and body + 8 <= box_end:
+                version = buf[body]
+                timing['tfdt'] = struct.unpack_from('>Q' if version else '>I', buf, body + 4)[0]
+            elif box_type == b'mfhd' and body + 8 <= box_end:
+                timing['sequence'] = struct.unpack_from('>I', buf, body + 4)[0]
+
+    try:
+        walk(0, len(buf), 0)
+    except (ValueError, struct.error):
+        return None
+    if b'moov' in found and b'ftyp' in found:
+        kind = 'init'
+    elif b'moof' in found:
+        kind = 'media'
+    else:
+        return None  # mdat solto ou só metadados: nada que o muxer consiga decodificar
+    info = {'container': 'mp4', 'kind': kind, 'offset': 0, 'codecs': codecs, 'timing': timing}
+    if b'ftyp' in found:
+        info['brand'] = buf[found[b'ftyp']:found[b'ftyp'] + 4].decode('ascii', 'replace')
+    return info
+
+
+def _ebml_vint(buf, pos, strip_marker=True):
+    """Inteiro de tamanho variável do EBML: (valor, bytes consumidos)"""
+    first = buf[pos]
+    length = 8 - first.bit_length() + 1
+    if length > 8 or pos + length > len(buf):
+        raise ValueError("vint inválido")
+    value = first & (0xff >> length) if strip_marker else first
+    for byte in buf[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, length
+
+
+def sniff_ebml(buf):
+    """WebM/Matroska: cabeçalho EBML com DocType, ou um Cluster solto (segmento de mídia)"""
+    if buf[:4] == EBML_CLUSTER:
+        try:
+            _, size_len = _ebml_vint(buf, 4)
+            pos = 4 + size_len
+            timing = {}
+            if buf[pos:pos + 1] == b'\xE7':  # Timecode do cluster
+                length, n = _ebml_vint(buf, pos + 1)
+                timing['timecode'] = int.from_bytes(buf[pos + 1 + n:pos + 1 + n + length], 'big')
+        except (ValueError, IndexError):
+            return None
+        return {'container': 'webm', 'kind': 'media', 'offset': 0, 'codecs': [], 'timing': timing}
+    if buf[:4] != EBML_MAGIC:
+        return None
+    try:
+        header_size, n = _ebml_vint(buf, 4)
+        pos, end = 4 + n, min(4 + n + header_size, len(buf))
+        doc_type = None
+        while pos < end:
+            element_id, id_len = _ebml_vint(buf, pos, strip_marker=False)
+            size, size_len = _ebml_vint(buf, pos + id_len)
+            body = pos + id_len + size_len
+            if element_id == 0x4282:
+                doc_type = buf[body:body + size].decode('ascii', 'replace')
+            pos = body + size
+    except (ValueError, IndexError):
+        return None
+    if doc_type not in ('webm', 'matroska'):
+        return None
+    codecs = [codec.decode() for codec in (b'V_VP9', b'V_VP8', b'V_AV1', b'A_OPUS', b'A_VORBIS',
+                                           b'V_MPEG4/ISO/AVC', b'A_AAC') if codec in buf]
+    return {'container': 'webm', 'kind': 'init', 'offset': 0, 'codecs': codecs, 'timing': {},
+            'doc_type': doc_type}
+
+
+def parse_http_headers(blob):
+    """Cabeçalhos HTTP brutos (separados por NUL) dentro do HttpResponseInfo serializado"""
+    match = HTTP_RAW_HEADERS.search(blob)
+    if not match:
+        return {}
+    headers = {'status': int(match.group(1))}
+    for line in match.group(2).split(b'\x00'):
+        name, _, value = line.partition(b':')
+        if value:
+            headers[name.strip().lower().decode('latin-1')] = value.strip().decode('latin-1')
+    return headers
+
+
+def _describe(body, url, headers):
+    """Completa um corpo com URL, tipo e faixa de bytes do recurso original"""
+    body['url'] = url
+    body['content_type'] = headers.get('content-type')
+    match = CONTENT_RANGE.fullmatch(headers.get('content-range', ''))
+    if match and 'range' not in body:
+        body['range'] = (int(match.group(1)), int(match.group(2)))
+    return body
+
+
+def parse_simple_entry(fd, size, buf=b''):
+    """Corpos de uma entrada do cache simple: [{offset, length, url, range, content_type}]
+
+    Retorna None se o arquivo não é uma entrada completa (sem o EOF final, ainda em gravação).
+    """
+    buf = buf if len(buf) >= SIMPLE_HEADER.size else os.pread(fd, SNIFF_SIZE, 0)
+    magic, _, key_length, _ = SIMPLE_HEADER.unpack_from(buf)
+    body_start = SIMPLE_HEADER.size + key_length
+    if magic != SIMPLE_INITIAL_MAGIC or body_start + SIMPLE_EOF.size > size:
+        return None
+    key = (buf[SIMPLE_HEADER.size:body_start] if body_start <= len(buf)
+           else os.pread(fd, key_length, SIMPLE_HEADER.size)).decode('utf-8', 'replace')
+    url = key.rsplit(' ', 1)[-1]
+
+    if int.from_bytes(os.pread(fd, 8, body_start), 'little') == SIMPLE_SPARSE_MAGIC:
+        bodies = []
+        pos = body_start
+        while pos + SIMPLE_SPARSE_RANGE.size <= size:
+            magic, offset, length, _ = SIMPLE_SPARSE_RANGE.unpack(os.pread(fd, SIMPLE_SPARSE_RANGE.size, pos))
+            data = pos + SIMPLE_SPARSE_RANGE.size
+            if magic != SIMPLE_SPARSE_MAGIC or length < 0 or data + length > size:
+                break  # Faixa ainda em gravação
+            bodies.append({'offset': data, 'length': length, 'range': (offset, offset + length - 1), 'url': url,
+                           'content_type': None})
+            pos = data + length
+        return sorted(bodies, key=lambda body: body['range'][0])
+
+    magic, flags, _, stream0_size = SIMPLE_EOF.unpack(os.pread(fd, SIMPLE_EOF.size, size - SIMPLE_EOF.size))
+    if magic != SIMPLE_FINAL_MAGIC:
+        return None
+    stream0_end = size - SIMPLE_EOF.size - (32 if flags & SIMPLE_EOF_HAS_KEY_SHA256 else 0)
+    stream0_start = stream0_end - stream0_size
+    eof1 = stream0_start - SIMPLE_EOF.size
+    if eof1 < body_start or \
+            int.from_bytes(os.pread(fd, 8, eof1), 'little') != SIMPLE_FINAL_MAGIC:
+        return None
+    headers = parse_http_headers(os.pread(fd, stream0_size, stream0_start))
+    return [_describe({'offset': body_start, 'length': eof1 - body_start}, url, headers)]
+
+
+class BlockFileCache:
+    """Cache blockfile do Chrome: liga cada f_XXXXXX à URL e aos cabeçalhos da sua entrada"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.lock = threading.Lock()
+        self.external = {}  # {nome do f_: corpo descrito}
+        self.scanned_at = 0
+
+    @staticmethod
+    def detect(cache_dir):
+        try:
+            with open(Path(cache_dir) / 'data_1', 'rb') as f:
+                return int.from_bytes(f.read(4), 'little') == BLOCK_MAGIC
+        except OSError:
+            return False
+
+    def external_body(self, name, size):
+        """Descrição do corpo guardado em f_XXXXXX (relê o índice se a entrada é nova)"""
+        with self.lock:
+            body = self.external.get(name)
+            if body is None and time.monotonic() - self.scanned_at >= BLOCKFILE_RESCAN:
+                self.scanned_at = time.monotonic()
+                try:
+                    self.external = {entry['file']: entry for entry in self.entries() if 'file' in entry}
+                except OSError as e:
+                    logger.debug(f"Falha ao ler o índice do cache blockfile: {e}")
+                body = self.external.get(name)
+        if body is None:
+            return {'offset': 0, 'length': size, 'url': None, 'content_type': None}
+        return {**body, 'length': min(body['length'], size)}
+
+    def _locate(self, addr):
+        """CacheAddr -> (arquivo, offset); None se não inicializado"""
+        if not addr & 0x80000000:
+            return None
+        file_type = (addr & 0x70000000) >> 28
+        if file_type == 0:
+            return f'f_{addr & 0x0FFFFFFF:06x}', 0
+        selector = (addr & 0x00FF0000) >> 16
+        return f'data_{selector}', BLOCK_HEADER_SIZE + (addr & 0xFFFF) * BLOCK_SIZES[file_type]
+
+    def _read(self, addr, length):
+        location = self._locate(addr)
+        if location is None or length <= 0:
+            return b''
+        with open(self.cache_dir / location[0], 'rb') as f:
+            return os.pread(f.fileno(), length, location[1])
+
+    def entries(self):
+        """Percorre as EntryStore alocadas no data_1"""
+        with open(self.cache_dir / 'data_1', 'rb') as f:
+            data = f.read()
+        magic, _, _, _, entry_size, _, max_entries = struct.unpack_from('<IIhhiii', data)
+        if magic != BLOCK_MAGIC or entry_size != 256:
+            return
+        bitmap = data[80:BLOCK_HEADER_SIZE]
+        for index in range(max_entries):
+            if not bitmap[index // 8] >> (index % 8) & 1:
+                continue
+            pos = BLOCK_HEADER_SIZE + index * entry_size
+            if pos + entry_size > len(data):
+                break
+            fields = BLOCK_ENTRY.unpack_from(data, pos)
+            state, key_length, long_key = fields[5], fields[7], fields[8]
+            data_size, data_addr = fields[9:13], fields[13:17]
+            # Blocos de continuação de entradas longas não passam nestas checagens
+            if state != 0 or not 0 < key_length < 8192 or not data_addr[1] & 0x80000000:
+                continue
+            if long_key & 0x80000000:
+                key = self._read(long_key, key_length)
+            else:
+                key = data[pos + BLOCK_ENTRY_KEY_OFFSET:pos + BLOCK_ENTRY_KEY_OFFSET + key_length]
+            try:
+                key = key.decode('utf-8')
+            except UnicodeDecodeError:
+                continue
+            url = key.rsplit(' ', 1)[-1]
+            if not url.startswith(('http://', 'https://')):
+                continue
+            try:
+                headers = parse_http_headers(self._read(data_addr[0], data_size[0]))
+            except (OSError, KeyError):
+                headers = {}
+            location = self._locate(data_addr[1])
+            body = _describe({'offset': location[1], 'length': data_size[1]}, url, headers)
+            if location[0].startswith('f_'):
+                body['file'] = location[0]
+            yield body
+
+
+def sequence_of(url, byte_range=None):
+    """Número de sequência do segmento pela URL (sq=, segment_123.ts, range=) ou faixa de bytes"""
+    if url:
+        parts = urllib.parse.urlsplit(url)
+        query = urllib.parse.parse_qs(parts.query)
+        for name in SEQUENCE_PARAMS:
+            value = query.get(name, [''])[0]
+            if value.isdigit():
+                return int(value)
+        match = SEGMENT_NUMBER.search(parts.path)
+        if match:
+            return int(match.group(1))
+        value = query.get('range', [''])[0]
+        if re.fullmatch(r'\d+-\d*', value):
+            return int(value.split('-')[0])
+    if byte_range:
+        return byte_range[0]
+    return None
+
+
+def track_of(url):
+    """Rendição a que o segmento pertence: host + diretório (+ itag no googlevideo)
+
+    O diretório, e não o nome do arquivo, identifica a trilha: o init.mp4 e os seg-N.m4s de
+    uma rendição ficam lado a lado e precisam da mesma chave (timescale do init, trilha do ingest).
+    """
+    if not url:
+        return ''
+    parts = urllib.parse.urlsplit(url)
+    directory = parts.path.rsplit('/', 1)[0] + '/'
+    itag = urllib.parse.parse_qs(parts.query).get('itag', [''])[0]
+    return f"{parts.netloc}{directory}" + (f"?itag={itag}" if itag else '')
+
+
+def media_type_of(info):
+    """'video', 'audio' ou None: pelos codecs do init segment, pelo Content-Type ou pelo mime= da URL"""
+    if info['codecs']:
+        return 'video' if VIDEO_CODECS.intersection(info['codecs']) else 'audio'
+    content_type = info['bodies'][0]['content_type'] if info.get('bodies') else None
+    if not content_type and info.get('url'):
+        content_type = urllib.parse.parse_qs(urllib.parse.urlsplit(info['url']).query).get('mime', [''])[0]
+    if content_type and content_type.split('/')[0] in ('video', 'audio'):
+        return content_type.split('/')[0]
+    return None
+
+
+class HlsIngest:
+    """FFmpeg persistente lendo de um pipe: cada fragmento é anexado uma única vez, em ordem
+
+    O pipe carrega um único contêiner: fontes DASH/YouTube entregam áudio e vídeo em trilhas
+    separadas (cada uma com seu moov), então só a trilha de vídeo principal segue para o FFmpeg.
+    """
+
+    def __init__(self, stream_id, hls_dir, log_path):
+        self.stream_id = stream_id
+        self.hls_dir = Path(hls_dir)
+        self.log_path = Path(log_path)
+        self.container = None  # Definido pelo primeiro fragmento
+        self.track = None  # Trilha principal (vídeo); as demais são ignoradas
+        self.skipped_tracks = set()
+        self.init_segment = None  # Reenviado ao relançar o FFmpeg (fMP4 precisa do moov)
+        self.proc = None
+        self.log = None
+        self.spawns = 0
+        self.appended = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def append(self, fd, offset, length, info, name):
+        """Enfileira um trecho de um arquivo já aberto; o descritor passa a ser do ingest"""
+        self.queue.put((fd, offset, length, info, name))
+
+    def stop(self):
+        """Esvazia a fila, fecha o pipe e deixa o FFmpeg finalizar a playlist"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.proc:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self.log:
+            self.log.close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            fd, offset, length, info, name = item
+            container = info['container']
+            try:
+                # Trilha antes do formato: áudio ou trilha secundária não podem fixar o contêiner
+                if not self._is_primary_track(info, name):
+                    continue
+                if self.container is None:
+                    self.container = container
+                    logger.info(f"Formato dos fragmentos: {container}")
+                elif container != self.container:
+                    # Um pipe só carrega um formato; trocar exigiria outra playlist
+                    logger.warning(f"Fragmento {name} em {container} descartado (stream em {self.container})")
+                    continue
+                self._write(fd, offset, length, name)
+                if info['kind'] == 'init' and length <= MAX_INIT_SIZE:
+                    self.init_segment = os.pread(fd, length, offset)
+            except Exception as e:
+                logger.error(f"Erro ao anexar fragmento {name}: {e}")
+            finally:
+                os.close(fd)
+
+    def _is_primary_track(self, info, name):
+        """Escolhe a trilha principal no primeiro fragmento de vídeo utilizável e filtra as outras"""
+        track = info.get('track', '')
+        if self.track is None:
+            media_type = media_type_of(info)
+            # TS já vem multiplexado; fMP4/WebM precisam começar pelo init de uma trilha de vídeo
+            if media_type != 'audio' and (not track or info['container'] == 'mpegts'
+                                          or info['kind'] == 'init' or media_type == 'video'):
+                self.track = track
+                logger.info(f"Trilha principal: {track or 'única'} ({media_type or 'tipo desconhecido'})")
+                return True
+            logger.debug(f"Fragmento {name} aguardando a trilha de vídeo principal, ignorado")
+            return False
+        if track == self.track:
+            return True
+        if track not in self.skipped_tracks:
+            self.skipped_tracks.add(track)
+            logger.info(f"Trilha {track or '?'} ignorada: o pipe do FFmpeg leva só a trilha principal "
+                        f"({self.track or 'única'})")
+        return False
+
+    def _write(self, fd, offset, length, name):
+        for attempt in range(2):
+            try:
+                if self.proc is None or self.proc.poll() is not None:
+                    self._spawn()
+                self._sendfile(fd, offset, length)
+                self.appended += 1
+                logger.info(f"Fragmento anexado: {name} ({length} bytes)")
+                return
+            except BrokenPipeError:
+                logger.warning(f"FFmpeg encerrou (código {self.proc.wait()}), relançando")
+        logger.error(f"Fragmento {name} descartado após relançar o FFmpeg")
+
+    def _sendfile(self, fd, offset, length):
+        """Cópia no kernel do arquivo do cache para o pipe do FFmpeg, sem buffer em Python"""
+        out_fd = self.proc.stdin.fileno()
+        size = offset + length
+        while offset < size:
+            try:
+                sent = os.sendfile(out_fd, fd, offset, size - offset)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+                # Kernel sem sendfile para pipe: leitura posicional em blocos
+                sent = os.write(out_fd, os.pread(fd, min(size - offset, 1024 * 1024), offset))
+            if sent == 0:
+                break  # Arquivo truncado pelo Chrome
+            offset += sent
+
+    def _spawn(self):
+        """Lança o FFmpeg; relançamentos continuam a numeração com append_list"""
+        self.hls_dir.mkdir(parents=True, exist_ok=True)
+        hls_flags = 'delete_segments+append_list+omit_endlist+temp_file'
+        if self.spawns:
+            hls_flags += '+discont_start'
+        # TS aceita H.264/AAC do YouTube; WebM (VP9/Opus) e fMP4 seguem em fMP4
+        if self.container == 'mpegts':
+            segment_args = ['-hls_segment_type', 'mpegts',
+                            '-hls_segment_filename', str(self.hls_dir / 'segment_%05d.ts')]
+        else:
+            segment_args = ['-hls_segment_type', 'fmp4',
+                            '-hls_fmp4_init_filename', 'init.mp4',
+                            '-hls_segment_filename', str(self.hls_dir / 'segment_%05d.m4s')]
+        cmd = [
+            'ffmpeg',
+            '-hide_banner',
+            '-loglevel', 'warning',
+            '-fflags', '+genpts+discardcorrupt',
+            '-i', 'pipe:0',
+            '-c', 'copy',
+            '-f', 'hls',
+            '-hls_time', str(HLS_TIME),
+            '-hls_list_size', str(HLS_LIST_SIZE),
+            '-hls_flags', hls_flags,
+            *segment_args,
+            str(self.hls_dir / 'index.m3u8')
+        ]
+        if self.log is None:
+            self.log = open(self.log_path, 'a')
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=self.log, stderr=self.log)
+        self.spawns += 1
+        logger.info(f"FFmpeg persistente iniciado (pid {self.proc.pid}) para {self.stream_id}")
+        if self.init_segment:
+            self.proc.stdin.write(self.init_segment)
+            self.proc.stdin.flush()
+
+
+class EventCoalescer:
+    """Agrupa eventos por caminho e libera cada arquivo quando o tamanho estabiliza"""
+
+    def __init__(self, classify, on_ready, quiet_window=QUIET_WINDOW, workers=CLASSIFY_WORKERS, on_tick=None):
+        self.classify = classify
+        self.on_ready = on_ready
+        self.on_tick = on_tick
+        self.quiet_window = quiet_window
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='classify')
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()  # {caminho: (tamanho, instante da última mudança)}
+        self.events = 0
+        self.processed = 0
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def touch(self, path):
+        """Registra um evento; chamado na thread do observer, não pode bloquear"""
+        with self.lock:
+            self.events += 1
+            if path not in self.pending:
+                self.pending[path] = (-1, time.monotonic())
+
+    def stop(self):
+        self._stopped.set()
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.quiet_window / 4):
+            if self.on_tick:
+                self.on_tick()
+            ready = self._collect()
+            if not ready:
+                continue
+            # Classificação em paralelo, entrega na ordem de chegada dos eventos
+            futures = [(path, self.pool.submit(self.classify, path, st)) for path, st in ready]
+            results = []
+            for path, future in futures:
+                try:
+                    info = future.result()
+                    if info:
+                        results.append((path, info))
+                except Exception as e:
+                    logger.error(f"Erro ao processar {path}: {e}")
+                self.processed += 1
+            # Com número de sequência em todos, a ordem da URL original vale mais que a dos eventos
+            if all(info.get('sequence') is not None for _, info in results):
+                results.sort(key=lambda item: (item[1]['track'], item[1]['sequence']))
+            for path, info in results:
+                try:
+                    self.on_ready(path, info)
+                except Exception as e:
+                    logger.error(f"Erro ao processar {path}: {e}")
+
+    def _collect(self):
+        """Caminhos cujo tamanho não muda há quiet_window segundos"""
+        now = time.monotonic()
+        with self.lock:
+            candidates = list(self.pending.items())
+        ready = []
+        for path, (size, changed_at) in candidates:
+            try:
+                st = os.stat(path)
+            except OSError:
+                with self.lock:
+                    self.pending.pop(path, None)  # Removido pelo Chrome antes de estabilizar
+                continue
+            with self.lock:
+                if st.st_size != size:
+                    self.pending[path] = (st.st_size, now)
+                elif now - changed_at >= self.quiet_window:
+                    del self.pending[path]
+                    ready.append((path, st))
+        return ready
+
+
+def content_hash(fd, bodies):
+    """Hash do conteúdo dos trechos via mmap: lê do page cache sem copiar para o Python"""
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.fstat(fd).st_size
+    if size == 0:
+        return digest.hexdigest()
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+            for offset, length in bodies:
+                digest.update(view[offset:offset + length])
+    return digest.hexdigest()
+
+
+class FragmentIndex:
+    """Ordena fragmentos pelo tempo de apresentação, descarta repetidos e detecta lacunas
+
+    Memória constante: só os últimos INDEX_SIZE fragmentos liberados (hash e tempo) ficam
+    no anel, mais no máximo REORDER_MAX_PENDING aguardando a janela de reordenação.
+    """
+
+    def __init__(self, emit, size=INDEX_SIZE, window=REORDER_WINDOW, max_pending=REORDER_MAX_PENDING):
+        self.emit = emit
+        self.size = size
+        self.window = window
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = []  # heap: (tempo, ordem de chegada, instante de chegada, fragmento)
+        self.ring = deque()  # (hash, (trilha, tempo)) na ordem de liberação
+        self.hashes = set()
+        self.times = set()
+        self.last = {}  # {trilha: (tempo liberado, duração típica)}
+        self.timescales = {}  # {trilha: timescale do init segment fMP4}
+        self.pts_base = {}  # {trilha: múltiplo de 2^33 somado após o PTS voltar a zero}
+        self.untimed = set()  # Trilhas com tfdt mas sem timescale conhecido (avisadas uma vez)
+        self.arrivals = itertools.count()
+        self.stats = {'released': 0, 'duplicates': 0, 'late': 0, 'gaps': 0}
+
+    def add(self, fragment):
+        """Recebe {'bodies': [(fd, offset, length)], 'info', 'name', 'hash', 'continuation'}"""
+        with self.lock:
+            info = fragment['info']
+            track = info['track']
+            pending_hashes = {queued['hash'] for item in self.pending
+                              for queued in [item[3], *item[3].get('followers', [])]}
+            if fragment['hash'] in self.hashes or fragment['hash'] in pending_hashes:
+                return self._drop(fragment, 'duplicates', "repetido (mesmo conteúdo)")
+            if fragment['continuation']:
+                # Faixa nova de uma entrada esparsa: sai logo depois da própria cabeça
+                head = next((item[3] for item in self.pending if item[3]['name'] == fragment['name']), None)
+                self._remember(fragment['hash'], None)
+                if head:
+                    head.setdefault('followers', []).append(fragment)
+                else:
+                    self._release(fragment)
+                return
+            presentation = self._presentation_time(info)
+            if presentation is None:
+                # Init segment ou sem timestamp: o que já chegou sai antes, na ordem de chegada
+                self._flush(force=True)
+                self._remember(fragment['hash'], None)
+                self._release(fragment)
+                return
+            if (track, presentation) in self.times or \
+                    any(item[3]['info']['track'] == track and item[0] == presentation for item in self.pending):
+                return self._drop(fragment, 'duplicates', f"repetido (t={presentation:.3f}s)")
+            last = self.last.get(track)
+            if last and presentation <= last[0]:
+                return self._drop(fragment, 'late', f"atrasado (t={presentation:.3f}s, já em {last[0]:.3f}s)")
+            heapq.heappush(self.pending, (presentation, next(self.arrivals), time.monotonic(), fragment))
+            self._flush()
+
+    def tick(self):
+        """Libera o que já esperou a janela de reordenação"""
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """Libera tudo o que resta, em ordem"""
+        with self.lock:
+            self._flush(force=True)
+
+    def _flush(self, force=False):
+        now = time.monotonic()
+        while self.pending:
+            oldest = min(item[2] for item in self.pending)
+            if not (force or len(self.pending) > self.max_pending or now - oldest >= self.window):
+                return
+            presentation, _, _, fragment = heapq.heappop(self.pending)
+            track = fragment['info']['track']
+            self._check_gap(track, presentation, fragment['name'])
+            self._remember(fragment['hash'], (track, presentation))
+            self._release(fragment)
+
+    def _check_gap(self, track, presentation, name):
+        last = self.last.get(track)
+        if last is None:
+            self.last[track] = (presentation, None)
+            return
+        delta = presentation - last[0]
+        typical = last[1]
+        if typical and delta > typical * GAP_TOLERANCE:
+            self.stats['gaps'] += 1
+            logger.warning(f"Lacuna de {delta - typical:.2f}s antes de {name} (trilha {track or '?'})")
+        else:
+            # Média móvel da duração dos fragmentos, ignorando as lacunas
+            typical = delta if typical is None else 0.8 * typical + 0.2 * delta
+        self.last[track] = (presentation, typical)
+
+    def _presentation_time(self, info):
+        """Tempo de apresentação em segundos (PTS, tfdt/timescale ou timecode do WebM)"""
+        timing = info['timing']
+        track = info['track']
+        if info['kind'] == 'init':
+            if 'timescale' in timing:
+                self.timescales[track] = timing['timescale']
+            return None
+        if 'pts' in timing:
+            base = self.pts_base.get(track, 0)
+            last = self.last.get(track)
+            # PTS bem abaixo do último liberado: o contador de 33 bits voltou a zero
+            if last and (timing['pts'] + base) / 90000 < last[0] - PTS_WRAP / 2 / 90000:
+                base += PTS_WRAP
+                self.pts_base[track] = base
+            return (timing['pts'] + base) / 90000
+        if 'tfdt' in timing:
+            timescale = self.timescales.get(track) or timing.get('timescale')
+            if timescale:
+                return timing['tfdt'] / timescale
+            # Sem o init da trilha o fragmento segue só pela sequência: sinal de chave de trilha errada
+            if track not in self.untimed:
+                self.untimed.add(track)
+                logger.warning(f"Trilha {track or '?'}: fragmento com tfdt sem timescale do init segment; "
+                               f"ordenando por chegada")
+            return None
+        if 'timecode' in timing:
+            return timing['timecode'] / 1000  # TimecodeScale padrão: 1 ms
+        return None
+
+    def _remember(self, content_hash, key):
+        self.ring.append((content_hash, key))
+        self.hashes.add(content_hash)
+        if key:
+            self.times.add(key)
+        # Anel limitado: o mais antigo sai do índice em vez de varrer diretórios
+        while len(self.ring) > self.size:
+            old_hash, old_key = self.ring.popleft()
+            self.hashes.discard(old_hash)
+            self.times.discard(old_key)
+
+    def _release(self, fragment):
+        self.stats['released'] += 1
+        self.emit(fragment)
+        for follower in fragment.pop('followers', []):
+            self._release(follower)
+
+    def _drop(self, fragment, reason, message):
+        self.stats[reason] += 1
+        logger.info(f"Fragmento {fragment['name']} descartado: {message}")
+        for fd, _, _ in fragment['bodies']:
+            os.close(fd)
+
 
 class CacheCaptureHandler(FileSystemEventHandler):
     """Handler para monitorar arquivos do cache"""
 
-    def __init__(self, stream_id, hls_dir, temp_dir):
+    def __init__(self, stream_id, hls_dir, temp_dir, cache_dir=None):
         self.stream_id = stream_id
         self.hls_dir = Path(hls_dir)
         self.temp_dir = Path(temp_dir)
-        self.fragments = []
-        self.segment_num = 0
+        self.captured = OrderedDict()  # (dispositivo, inode) já anexados
+        self.classified = OrderedDict()  # {(inode, tamanho, mtime): resultado do sniffer}
+        self.classified_lock = threading.Lock()
+        self.blockfile = BlockFileCache(cache_dir) if cache_dir and BlockFileCache.detect(cache_dir) else None
 
         # Criar diretórios
         self.hls_dir.mkdir(parents=True, exist_ok=True)
         self.temp_dir.mkdir(parents=True, exist_ok=True)
 
-        # Detector de tipo MIME
-        self.mime = magic.Magic(mime=True)
+        self.ingest = HlsIngest(stream_id, self.hls_dir, self.temp_dir / 'ffmpeg.log')
+        self.index = FragmentIndex(self.emit_fragment)
+        self.coalescer = EventCoalescer(self.classify,
+                                        lambda path, info: self.capture_fragment(Path(path), info),
+                                        on_tick=self.index.tick)
 
         logger.info(f"Cache Capture iniciado para {stream_id}")
         logger.info(f"HLS Dir: {self.hls_dir}")
         logger.info(f"Temp Dir: {self.temp_dir}")
 
     def is_video_fragment(self, file_path):
-        """Verifica se arquivo é fragmento de vídeo"""
-        try:
-            # Verificar tamanho mínimo (100KB)
-            if os.path.getsize(file_path) < 100 * 1024:
-                return False
-
-            # Verificar tipo MIME
-            mime_type = self.mime.from_file(file_path)
-
-            # Aceitar vídeo, MPEG, ou dados binários (fragmentos podem não ter MIME correto)
-            if any(x in mime_type.lower() for x in ['video', 'mpeg', 'mp4', 'webm', 'octet-stream']):
-                return True
-
-            # Verificar magic bytes manualmente
-            with open(file_path, 'rb') as f:
-                header = f.read(12)
-
-            # MPEG-TS: 0x47 (sync byte)
-            # MP4/M4S: ftyp, mdat, moov
-            # WebM: 0x1A45DFA3
-            if (header[0:1] == b'\x47' or  # MPEG-TS
-                b'ftyp' in header or
-                b'mdat' in header or
-                b'moov' in header or
-                header[0:4] == b'\x1A\x45\xDF\xA3'):  # WebM
-                return True
+        """Informações do sniffer se o arquivo for fragmento de vídeo; None caso contrário
 
-        except Exception as e:
+        Inclui 'bodies': trechos do arquivo com o corpo da resposta, já sem o envelope do cache.
+        """
+        try:
+            fd = os.open(file_path, os.O_RDONLY)
+            try:
+                size = os.fstat(fd).st_size
+                buf = os.pread(fd, SNIFF_SIZE, 0)
+                if int.from_bytes(buf[:8], 'little') == SIMPLE_INITIAL_MAGIC:
+                    bodies = parse_simple_entry(fd, size, buf)
+                elif self.blockfile and BLOCKFILE_EXTERNAL.fullmatch(Path(file_path).name):
+                    bodies = [self.blockfile.external_body(Path(file_path).name, size)]
+                else:
+                    bodies = [{'offset': 0, 'length': size, 'url': None, 'content_type': None}]
+                if not bodies:
+                    return None
+                first = bodies[0]
+                if first['offset'] + SNIFF_SIZE <= len(buf):
+                    head = buf[first['offset']:first['offset'] + min(first['length'], SNIFF_SIZE)]
+                else:
+                    head = os.pread(fd, min(first['length'], SNIFF_SIZE), first['offset'])
+            finally:
+                os.close(fd)
+        except (OSError, struct.error) as e:
             logger.debug(f"Erro ao verificar {file_path}: {e}")
+            return None
 
-        return False
+        info = sniff_media(head)
+        if info is None:
+            return None
+        info.update(
+            bodies=bodies,
+            url=first['url'],
+            track=track_of(first['url']),
+            sequence=sequence_of(first['url'], first.get('range'))
+        )
+        return info
+
+    def classify(self, path, st):
+        """is_video_fragment com cache por (inode, tamanho, mtime)"""
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.classified_lock:
+            if key in self.classified:
+                self.classified.move_to_end(key)
+                return self.classified[key]
+        result = self.is_video_fragment(path)
+        with self.classified_lock:
+            self.classified[key] = result
+            if len(self.classified) > CLASSIFY_CACHE_SIZE:
+                self.classified.popitem(last=False)
+        return result
 
     def on_created(self, event):
         """Callback quando arquivo é criado no cache"""
-        if event.is_directory:
-            return
-
-        file_path = Path(event.src_path)
+        if not event.is_directory:
+            self.coalescer.touch(event.src_path)
 
-        # Dar tempo para o arquivo ser escrito completamente
-        time.sleep(0.5)
+    def on_modified(self, event):
+        """Callback quando arquivo é modificado (Chrome grava em várias etapas)"""
+        if not event.is_directory:
+            self.coalescer.touch(event.src_path)
 
-        # Verificar se é fragmento de vídeo
-        if self.is_video_fragment(str(file_path)):
-            self.capture_fragment(file_path)
+    def on_closed(self, event):
+        """Callback quando o Chrome termina de escrever um arquivo"""
+        if not event.is_directory:
+            self.coalescer.touch(event.src_path)
 
-    def on_modified(self, event):
-        """Callback quando arquivo é modificado"""
-        # Chrome pode modificar arquivos durante download
+    def on_moved(self, event):
+        """Entradas do cache são gravadas em temporário e renomeadas"""
         if not event.is_directory:
-            file_path = Path(event.src_path)
-            if self.is_video_fragment(str(file_path)):
-                self.capture_fragment(file_path)
+            self.coalescer.touch(event.dest_path)
 
-    def capture_fragment(self, file_path):
-        """Captura fragmento de vídeo"""
+    def capture_fragment(self, file_path, info):
+        """Entrega o fragmento ao FFmpeg persistente, uma única vez por arquivo"""
         try:
-            # Nome único para o fragmento
-            timestamp = int(time.time() * 1000000)
-            fragment_name = f"fragment_{timestamp}.ts"
-            fragment_path = self.temp_dir / fragment_name
-
-            # Copiar fragmento
-            subprocess.run(['cp', str(file_path), str(fragment_path)], check=True)
+            # Descritor aberto já: o Chrome pode apagar o arquivo antes do envio
+            fd = os.open(file_path, os.O_RDONLY)
+        except OSError as e:
+            logger.debug(f"Fragmento sumiu antes da captura: {file_path.name} ({e})")
+            return
+        try:
+            st = os.fstat(fd)
+            key = (st.st_dev, st.st_ino)
+            # Entradas esparsas crescem: cada faixa é anexada uma vez
+            bodies = [body for body in info['bodies']
+                      if body['offset'] + body['length'] <= st.st_size
+                      and (*key, body['offset']) not in self.captured]
+            for body in bodies:
+                self.captured[(*key, body['offset'])] = True
+            while len(self.captured) > CAPTURED_MEMORY:
+                self.captured.popitem(last=False)
+            content = content_hash(fd, [(body['offset'], body['length']) for body in bodies]) if bodies else None
+            # Cada trecho enfileirado leva o próprio descritor
+            fds = [fd] + [os.dup(fd) for _ in bodies[1:]] if bodies else []
+        except (OSError, ValueError) as e:
+            os.close(fd)
+            logger.error(f"Erro ao capturar fragmento: {e}")
+            return
+        if not bodies:
+            os.close(fd)
+            return
 
-            # Adicionar à lista
-            self.fragments.append(fragment_path)
-            logger.info(f"Fragmento capturado: {file_path.name} -> {fragment_name}")
+        logger.info(f"Fragmento capturado: {file_path.name} ({info['container']} {info['kind']}, "
+                    f"{','.join(info['codecs']) or 'codecs ?'}, {len(bodies)} trecho(s)"
+                    f"{', seq ' + str(info['sequence']) if info['sequence'] is not None else ''}"
+                    f"{', ' + info['url'] if info['url'] else ''})")
+        # Faixas novas de uma entrada esparsa continuam o recurso: o timestamp é da primeira
+        continuation = bodies[0] is not info['bodies'][0]
+        self.index.add({
+            'bodies': [(body_fd, body['offset'], body['length']) for body_fd, body in zip(fds, bodies)],
+            'info': {**info, 'kind': 'media'} if continuation else info,
+            'name': file_path.name,
+            'hash': content,
+            'continuation': continuation
+        })
 
-            # Se temos fragmentos suficientes, gerar HLS
-            if len(self.fragments) >= 3:
-                self.generate_hls()
+    def emit_fragment(self, fragment):
+        """Fragmento liberado pelo índice, na ordem de apresentação: segue para o FFmpeg"""
+        for index, (fd, offset, length) in enumerate(fragment['bodies']):
+            # Só o primeiro trecho pode ser init segment
+            info = fragment['info'] if index == 0 else {**fragment['info'], 'kind': 'media'}
+            self.ingest.append(fd, offset, length, info, fragment['name'])
 
-        except Exception as e:
-            logger.error(f"Erro ao capturar fragmento: {e}")
 
-    def generate_hls(self):
-        """Gera playlist HLS a partir dos fragmentos"""
-        try:
-            # Criar arquivo de concatenação
-            concat_file = self.temp_dir / 'concat.txt'
-            with open(concat_file, 'w') as f:
-                for frag in self.fragments[-10:]:  # Últimos 10 fragmentos
-                    if frag.exists():
-                        f.write(f"file '{frag}'\n")
-
-            # Gerar HLS com FFmpeg
-            output_file = self.hls_dir / 'index.m3u8'
-            segment_pattern = self.hls_dir / 'segment_%03d.ts'
-
-            cmd = [
-                'ffmpeg',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', str(concat_file),
-                '-c', 'copy',
-                '-f', 'hls',
-                '-hls_time', '2',
-                '-hls_list_size', '10',
-                '-hls_flags', 'delete_segments+append_list',
-                '-hls_segment_filename', str(segment_pattern),
-                str(output_file),
-                '-y'
-            ]
-
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                timeout=5
-            )
-
-            if result.returncode == 0:
-                logger.info(f"HLS gerado: {len(self.fragments)} fragmentos")
-                self.segment_num += 1
-
-                # Limpar fragmentos antigos
-                self.cleanup_old_fragments()
-            else:
-                logger.warning(f"FFmpeg warning: {result.stderr.decode()[:200]}")
-
-        except subprocess.TimeoutExpired:
-            logger.warning("FFmpeg timeout - continuando...")
-        except Exception as e:
-            logger.error(f"Erro ao gerar HLS: {e}")
-
-    def cleanup_old_fragments(self):
-        """Remove fragmentos antigos"""
-        # Manter apenas últimos 20 fragmentos na memória
-        if len(self.fragments) > 20:
-            old_fragments = self.fragments[:-10]
-            for frag in old_fragments:
-                try:
-                    if frag.exists():
-                        frag.unlink()
-                except:
-                    pass
-            self.fragments = self.fragments[-10:]
-
-        # Remover arquivos .ts antigos do temp
-        for old_file in self.temp_dir.glob('fragment_*.ts'):
-            try:
-                # Deletar se mais de 2 minutos
-                if time.time() - old_file.stat().st_mtime > 120:
-                    old_file.unlink()
-            except:
-                pass
+def interrupt(signum, frame):
+    """SIGTERM do Stream Manager encerra como Ctrl+C"""
+    raise KeyboardInterrupt
 
 
 def main():
@@ -215,10 +1030,13 @@ def main():
     logger.info(f"Monitorando: {cache_dir}")
 
     # Criar handler e observer
-    handler = CacheCaptureHandler(stream_id, hls_dir, temp_dir)
+    handler = CacheCaptureHandler(stream_id, hls_dir, temp_dir, cache_dir)
     observer = Observer()
     observer.schedule(handler, str(cache_dir), recursive=True)
 
+    # Encerrar pelo caminho normal finaliza a playlist
+    signal.signal(signal.SIGTERM, interrupt)
+
     # Iniciar monitoramento
     observer.start()
 
@@ -231,6 +1049,13 @@ def main():
         logger.info("Parando...")
 
     observer.join()
+    handler.coalescer.stop()
+    handler.index.close()
+    handler.ingest.stop()
+    stats = handler.index.stats
+    logger.info(f"{handler.coalescer.events} eventos, {handler.coalescer.processed} arquivos verificados, "
+                f"{handler.ingest.appended} fragmentos anexados, {stats['duplicates']} repetidos, "
+                f"{stats['late']} atrasados, {stats['gaps']} lacunas")
 
 
 if __name__ == '__main__':
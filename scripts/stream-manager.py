@@ -6,17 +6,34 @@ Sistema de gerenciamento de streams de navegador
 
 import os
 import sys
+import copy
 import json
+import base64
+import errno
+import select
 import signal
+import socket
+import struct
 import subprocess
+import tempfile
 import threading
 import time
 import logging
+import queue
+import random
+import re
+import shutil
+import uuid
+import urllib.parse
+import urllib.request
 import psutil
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_file, send_from_directory
+from werkzeug.security import safe_join
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 
@@ -39,6 +56,106 @@ LOGS_DIR = BASE_DIR / 'logs'
 HLS_DIR = Path('/var/www/hls')
 SCRIPTS_DIR = BASE_DIR / 'scripts'
 
+# Pipeline de inicialização
+# Segundos máximos aguardando a prontidão de cada estágio (sobrescrito por server.stage_timeouts)
+DEFAULT_STAGE_TIMEOUTS = {'xvfb': 10, 'audio': 10, 'browser': 30, 'ffmpeg': 20}
+MAX_JOBS = 200  # Jobs finalizados mantidos para consulta
+DEFAULT_START_CONCURRENCY = 4  # Pipelines de inicialização simultâneos (server.start_concurrency)
+DEFAULT_STOP_CONCURRENCY = 16  # Paradas simultâneas em operações em lote
+DEFAULT_ADMISSION_MAX_CPU = 85  # % de CPU acima do qual novas inicializações aguardam
+DEFAULT_ADMISSION_TIMEOUT = 60  # Segundos máximos aguardando admissão por CPU
+BULK_SELECTORS = ('all', 'running', 'stopped')
+STOP_TIMEOUT = 5  # Prazo único para todos os processos de um stream encerrarem
+PROCESS_NAMES = ('ffmpeg', 'browser', 'xvfb', 'vnc')
+STACK_PROCESSES = ('xvfb', 'browser', 'ffmpeg')  # Componentes supervisionados de cada stream
+COMPONENT_RESTARTABLE = ('browser', 'ffmpeg')  # Relançados sem derrubar o Xvfb
+CHILD_POLL_INTERVAL = 1  # Segundos entre verificações quando pidfd não está disponível
+METRICS_INTERVAL = 5  # Segundos entre envios periódicos de status
+MAX_TOMBSTONES = 100  # Remoções de streams lembradas para resync incremental
+DEFAULT_STATS_INTERVAL = 2  # Segundos entre amostras do sistema (server.stats_interval)
+DEFAULT_STATS_HISTORY = 300  # Amostras mantidas no ring buffer (server.stats_history)
+# cgroup v2: cada stream ganha streams/<id>/{display,browser,encoder} sob o cgroup do serviço
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+CGROUP_CONTROLLERS = ('cpu', 'cpuset', 'memory', 'io')
+CGROUP_COMPONENTS = {'xvfb': 'display', 'browser': 'browser', 'ffmpeg': 'encoder', 'vnc': 'display'}
+DEFAULT_CGROUP_WEIGHTS = {'display': 100, 'browser': 100, 'encoder': 1000}  # cpu.weight interno
+STREAM_LIMIT_FIELDS = ('cpu_max', 'cpu_weight', 'memory_high', 'memory_max', 'io_weight', 'cpu_cores',
+                       'hls_quota_mb')
+DEFAULT_CORES_PER_STREAM = 2  # Núcleos físicos por stream (server.placement.cores_per_stream)
+RESOURCE_FIELDS = ('cpu_percent', 'rss_mb', 'pss_mb', 'threads', 'processes',
+                   'disk_read_bytes_per_sec', 'disk_write_bytes_per_sec',
+                   'io_read_chars_per_sec', 'io_write_chars_per_sec')
+
+# Política de reinício automático (sobrescrita por server.restart_policy)
+DEFAULT_RESTART_POLICY = {
+    'base_delay': 0.5,  # Atraso do primeiro reinício, dobrado a cada falha seguida
+    'max_delay': 60,  # Teto do backoff
+    'jitter': 0.2,  # Variação aleatória (+/-) aplicada ao atraso
+    'max_restarts': 5,  # Falhas toleradas dentro da janela antes do crash-loop
+    'window': 300,  # Janela (s) de contagem das falhas
+    'stable_after': 120  # Sem falhas por este tempo, o backoff volta ao início
+}
+DEFAULT_ENCODER_PROFILE = {
+    'fps': 15,
+    'preset': 'ultrafast',
+    'tune': 'zerolatency',
+    'bitrate': '1500k',  # Alvo/teto; com crf vira só o teto (-maxrate)
+    'crf': None,
+    'gop': None,  # Padrão: um keyframe por segmento (fps * hls_time)
+    'threads': 0,  # 0 = automático
+    'pix_fmt': 'yuv420p',
+    'hls_time': None,  # Padrão: server.hls_time
+    'hls_list_size': None,  # Padrão: server.hls_list_size
+    'renditions': None,  # ABR: [{'height': 720, 'bitrate': '2500k'}, ...] numa única captura
+    'low_latency': False,  # LL-HLS: partes fMP4 com EXT-X-PART e reload bloqueante
+    'part_duration': 0.5  # Duração alvo das partes no modo low_latency
+}
+X264_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast',
+                'medium', 'slow', 'slower', 'veryslow')
+X264_TUNES = ('film', 'animation', 'grain', 'stillimage', 'fastdecode', 'zerolatency')
+PIXEL_FORMATS = ('yuv420p', 'yuv422p', 'yuv444p', 'nv12')
+DEFAULT_HLS_STORE = {
+    'enabled': True,
+    'path': '/dev/shm/stream-manager-hls',  # Precisa estar num tmpfs (ou mount: true para montar um)
+    'mount': False,
+    'size_mb': 2048,  # Orçamento total de RAM para HLS
+    'stream_quota_mb': 64,  # Cota quando não dá para estimar pelo bitrate (crf sem teto)
+    'min_available_mb': 1024,  # Abaixo disso, novos streams vão para o disco
+    'high_watermark': 90  # % do orçamento que dispara remoção de órfãos e alerta
+}
+DEFAULT_HLS_ORIGIN = {
+    'enabled': False,  # Servir /hls/ pelo próprio manager (implantação sem nginx)
+    'cache_mb': 256,  # Orçamento do cache LRU em memória
+    'max_object_kb': 8192,  # Arquivos maiores são servidos direto do disco
+    'playlist_ttl': 1  # max-age das playlists (segmentos são imutáveis)
+}
+HLS_MIMETYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4'
+}
+DEFAULT_LAZY_IDLE_TIMEOUT = 300  # Segundos sem pedidos de playlist até parar um stream lazy
+LAZY_START_NUMBER = 10000  # Primeira sequência real de um stream lazy, acima das do placeholder
+PLACEHOLDER_SEGMENT = 'placeholder.ts'  # Tela preta servida enquanto um stream lazy inicia
+PLACEHOLDER_DURATION = 2
+ACCESS_LOG_HIT = re.compile(r'"GET /hls/([^/\s"]+)/[^\s"]*\.m3u8')
+DEFAULT_WARM_POOL = {'size': 0, 'resolution': '1280x720'}  # server.warm_pool
+WARM_DISPLAY_BASE = 200  # Primeiro display candidato dos slots pré-aquecidos
+WARM_DISPLAY_MARGIN = 100  # Folga acima do último display de stream (99 + índice) para streams novos
+WARM_RETRY_DELAY = 30  # Segundos de espera após falha ao preparar um slot
+WARM_CHECK_INTERVAL = 5  # Segundos entre verificações de slots ociosos
+HLS_EVICT_MIN_AGE = 10  # Segundos: arquivos mais novos podem estar em gravação
+LL_POLL_INTERVAL = 0.05  # Segundos entre verificações da playlist de partes do FFmpeg
+LL_PARTS_PLAYLIST = 'parts.m3u8'  # Playlist interna do FFmpeg; a pública (index.m3u8) é do empacotador
+LL_PART_PATTERN = re.compile(r'part_[0-9a-f]+_(\d+)\.m4s')
+DEVTOOLS_BASE_PORT = 9222
+# Página considerada pronta após o primeiro paint com conteúdo ou o load completo
+PAGE_READY_EXPRESSION = (
+    "performance.getEntriesByType('paint').some(e => e.name === 'first-contentful-paint')"
+    " || document.readyState === 'complete'"
+)
+
 # Criar diretórios se não existirem
 for dir_path in [CONFIG_DIR, PROFILES_DIR, LOGS_DIR, HLS_DIR]:
     dir_path.mkdir(parents=True, exist_ok=True)
@@ -49,14 +166,1628 @@ app.config['SECRET_KEY'] = os.urandom(24).hex()
 CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 
+class StartCancelled(Exception):
+    """Inicialização interrompida porque o stream foi parado no meio do pipeline"""
+
+
+class DevToolsClient:
+    """Cliente mínimo do protocolo DevTools sobre WebSocket, usando apenas a stdlib"""
+
+    def __init__(self, ws_url, timeout=5):
+        parsed = urllib.parse.urlparse(ws_url)
+        self.sock = socket.create_connection((parsed.hostname, parsed.port), timeout=timeout)
+        self._buffer = b''
+        self._next_id = 0
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = parsed.path + (f'?{parsed.query}' if parsed.query else '')
+        handshake = (
+            f'GET {path} HTTP/1.1\r\n'
+            f'Host: {parsed.hostname}:{parsed.port}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'
+        )
+        self.sock.sendall(handshake.encode())
+        while b'\r\n\r\n' not in self._buffer:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("DevTools fechou a conexão no handshake")
+            self._buffer += chunk
+        header, self._buffer = self._buffer.split(b'\r\n\r\n', 1)
+        if b' 101 ' not in header.split(b'\r\n', 1)[0]:
+            raise ConnectionError(f"Handshake DevTools recusado: {header[:80]!r}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def call(self, method, **params):
+        """Envia um comando e aguarda a resposta correspondente (eventos são descartados)"""
+        self._next_id += 1
+        msg_id = self._next_id
+        self._send(json.dumps({'id': msg_id, 'method': method, 'params': params}).encode())
+        while True:
+            message = json.loads(self._recv())
+            if message.get('id') == msg_id:
+                if 'error' in message:
+                    raise RuntimeError(message['error'].get('message', 'erro DevTools'))
+                return message.get('result', {})
+
+    def evaluate(self, expression):
+        """Avalia uma expressão JavaScript na página e retorna o valor"""
+        result = self.call('Runtime.evaluate', expression=expression, returnByValue=True)
+        return result.get('result', {}).get('value')
+
+    def _send(self, payload, opcode=0x1):
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 65536:
+            header.append(0x80 | 126)
+            header += struct.pack('!H', length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack('!Q', length)
+        # Frames do cliente precisam ser mascarados (RFC 6455)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(bytes(header) + mask + masked)
+
+    def _recv_exact(self, size):
+        while len(self._buffer) < size:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("DevTools fechou a conexão")
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _recv(self):
+        """Lê uma mensagem completa, reagrupando frames fragmentados"""
+        message = b''
+        while True:
+            b1, b2 = self._recv_exact(2)
+            opcode = b1 & 0x0f
+            length = b2 & 0x7f
+            if length == 126:
+                length = struct.unpack('!H', self._recv_exact(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self._recv_exact(8))[0]
+            mask = self._recv_exact(4) if b2 & 0x80 else None
+            payload = self._recv_exact(length)
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+            if opcode == 0x8:
+                raise ConnectionError("DevTools encerrou a sessão")
+            if opcode == 0x9:
+                self._send(payload, opcode=0xA)
+                continue
+            if opcode in (0x0, 0x1, 0x2):
+                message += payload
+                if b1 & 0x80:
+                    return message
+
+
+class RestartPolicy:
+    """Backoff exponencial com jitter e disjuntor de crash-loop para um stream"""
+
+    def __init__(self, config):
+        self.config = {**DEFAULT_RESTART_POLICY, **config}
+        self.failures = deque()  # Instantes (monotônicos) das falhas dentro da janela
+        self.consecutive = 0
+        self.crash_looping = False
+
+    def record_failure(self):
+        """Registra uma falha; retorna o atraso do próximo reinício ou None em crash-loop"""
+        now = time.monotonic()
+        while self.failures and now - self.failures[0] > self.config['window']:
+            self.failures.popleft()
+        if self.failures and now - self.failures[-1] > self.config['stable_after']:
+            self.consecutive = 0
+        self.failures.append(now)
+        self.consecutive += 1
+
+        if len(self.failures) > self.config['max_restarts']:
+            self.crash_looping = True
+            return None
+
+        delay = min(self.config['max_delay'],
+                    self.config['base_delay'] * 2 ** (self.consecutive - 1))
+        jitter = self.config['jitter']
+        return delay * random.uniform(1 - jitter, 1 + jitter)
+
+    def reset(self):
+        """Limpa o histórico (início manual do stream)"""
+        self.failures.clear()
+        self.consecutive = 0
+        self.crash_looping = False
+
+
+class SystemSampler:
+    """Amostra CPU, memória, disco, load e rede em cadência fixa num ring buffer"""
+
+    def __init__(self, interval, history, on_sample=None):
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self.on_sample = on_sample
+        self._last_net = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def latest(self):
+        """Última amostra (ou None antes da primeira)"""
+        return self.samples[-1] if self.samples else None
+
+    def history(self, seconds):
+        """Amostras dos últimos `seconds` segundos, da mais antiga para a mais recente"""
+        cutoff = time.time() - seconds
+        return [sample for sample in list(self.samples) if sample['timestamp'] >= cutoff]
+
+    def _run(self):
+        psutil.cpu_percent(interval=None)  # Primeira chamada só estabelece a referência
+        while True:
+            time.sleep(self.interval)
+            try:
+                sample = self._sample()
+            except Exception as e:
+                logger.error(f"Erro ao amostrar o sistema: {e}")
+                continue
+            self.samples.append(sample)
+            if self.on_sample:
+                try:
+                    self.on_sample(sample)
+                except Exception as e:
+                    logger.error(f"Erro ao publicar amostra do sistema: {e}")
+
+    def _sample(self):
+        now = time.time()
+        net = psutil.net_io_counters()
+        rx_rate = tx_rate = 0.0
+        if self._last_net:
+            last_time, last_net = self._last_net
+            elapsed = max(now - last_time, 1e-6)
+            rx_rate = (net.bytes_recv - last_net.bytes_recv) / elapsed
+            tx_rate = (net.bytes_sent - last_net.bytes_sent) / elapsed
+        self._last_net = (now, net)
+
+        return {
+            'timestamp': now,
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'memory_percent': psutil.virtual_memory().percent,
+            'disk_percent': psutil.disk_usage('/').percent,
+            'load_avg': list(os.getloadavg()),
+            'net_rx_bytes_per_sec': round(rx_rate),
+            'net_tx_bytes_per_sec': round(tx_rate)
+        }
+
+
+class CgroupManager:
+    """Isola a pilha de cada stream num cgroup v2 próprio, com cotas e leitura de consumo"""
+
+    def __init__(self, config):
+        self.config = config
+        self.enabled = False
+        self.base = None
+        self.controllers = []
+        self._usage_prev = {}  # {stream_id: (instante, usage_usec)}
+        if config.get('enabled', True):
+            try:
+                self._setup()
+            except OSError as e:
+                logger.warning(f"cgroup v2 indisponível, streams sem isolamento: {e}")
+
+    def _setup(self):
+        if not (CGROUP_ROOT / 'cgroup.controllers').exists():
+            raise OSError("/sys/fs/cgroup não é cgroup v2")
+
+        # Cgroup atual do serviço (linha "0::/caminho"); requer Delegate=yes no systemd
+        with open('/proc/self/cgroup') as f:
+            own = next(line.split('::', 1)[1].strip() for line in f if line.startswith('0::'))
+        service = CGROUP_ROOT / own.lstrip('/')
+        if service.name == 'manager':
+            service = service.parent  # Reinício sem novo cgroup: já estamos na folha
+
+        available = (service / 'cgroup.controllers').read_text().split()
+        self.controllers = [c for c in CGROUP_CONTROLLERS if c in available]
+        if not self.controllers:
+            raise OSError("nenhum controlador cpu/memory/io delegado ao serviço")
+
+        # Regra "sem processos internos": o próprio manager vai para uma folha
+        manager_leaf = service / 'manager'
+        manager_leaf.mkdir(exist_ok=True)
+        (manager_leaf / 'cgroup.procs').write_text(str(os.getpid()))
+
+        self.base = service / 'streams'
+        self.base.mkdir(exist_ok=True)
+        self._enable_controllers(service)
+        self._enable_controllers(self.base)
+        self.enabled = True
+        logger.info(f"cgroup v2 ativo em {self.base} ({', '.join(self.controllers)})")
+
+    def _enable_controllers(self, path):
+        (path / 'cgroup.subtree_control').write_text(' '.join(f'+{c}' for c in self.controllers))
+
+    def _stream_path(self, stream_id):
+        # Ids viram nomes de diretório: rejeitar qualquer coisa fora do padrão seguro
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+', stream_id) or stream_id in ('.', '..'):
+            return None
+        return self.base / stream_id
+
+    def prepare(self, stream_id, stream):
+        """Cria o cgroup do stream e aplica as cotas configuradas em streams.json"""
+        path = self._stream_path(stream_id) if self.enabled else None
+        if path is None:
+            return
+        try:
+            path.mkdir(exist_ok=True)
+            self._enable_controllers(path)
+            self._write_limits(path, stream)
+            weights = {**DEFAULT_CGROUP_WEIGHTS, **self.config.get('weights', {})}
+            for leaf, weight in weights.items():
+                (path / leaf).mkdir(exist_ok=True)
+                self._write(path / leaf, 'cpu.weight', weight)
+        except OSError as e:
+            logger.warning(f"[{stream_id}] Falha ao preparar cgroup: {e}")
+
+    def update_limits(self, stream_id, stream):
+        """Reaplica as cotas de um stream em execução (edição via API)"""
+        path = self._stream_path(stream_id) if self.enabled else None
+        if path is None or not path.exists():
+            return
+        try:
+            self._write_limits(path, stream)
+        except OSError as e:
+            logger.warning(f"[{stream_id}] Falha ao atualizar cotas do cgroup: {e}")
+
+    def attach(self, stream_id, procs):
+        """Move processos já em execução (e seus filhos) para as folhas do stream"""
+        path = self._stream_path(stream_id) if self.enabled else None
+        if path is None or not path.exists():
+            return
+        for name, proc in procs.items():
+            procs_file = path / CGROUP_COMPONENTS[name] / 'cgroup.procs'
+            try:
+                root = psutil.Process(proc.pid)
+                for process in [root, *root.children(recursive=True)]:
+                    procs_file.write_text(str(process.pid))
+            except (psutil.Error, OSError) as e:
+                logger.warning(f"[{stream_id}] Falha ao mover {name} para o cgroup: {e}")
+
+    def set_cpus(self, stream_id, cpus_by_leaf, mems):
+        """Restringe cada folha do stream a um conjunto de CPUs e ao nó de memória"""
+        path = self._stream_path(stream_id) if self.enabled else None
+        if path is None or 'cpuset' not in self.controllers or not path.exists():
+            return False
+        try:
+            for leaf, cpus in cpus_by_leaf.items():
+                self._write(path / leaf, 'cpuset.cpus', cpus)
+                self._write(path / leaf, 'cpuset.mems', mems)
+            return True
+        except OSError as e:
+            logger.warning(f"[{stream_id}] Falha ao aplicar cpuset: {e}")
+            return False
+
+    def _write_limits(self, path, stream):
+        cpu_max = stream.get('cpu_max')
+        if isinstance(cpu_max, (int, float)):
+            # Em núcleos: 1.5 -> "150000 100000"
+            cpu_max = f'{int(cpu_max * 100000)} 100000'
+        self._write(path, 'cpu.max', cpu_max or 'max 100000')
+        self._write(path, 'cpu.weight', stream.get('cpu_weight', 100))
+        self._write(path, 'memory.high', stream.get('memory_high', 'max'))
+        self._write(path, 'memory.max', stream.get('memory_max', 'max'))
+        self._write(path, 'io.weight', stream.get('io_weight', 100))
+
+    def _write(self, path, name, value):
+        controller = name.split('.', 1)[0]
+        if controller in self.controllers:
+            (path / name).write_text(str(value))
+
+    def wrap(self, stream_id, component, cmd):
+        """Prefixa o comando para que o processo entre no cgroup antes do exec"""
+        path = self._stream_path(stream_id) if self.enabled else None
+        if path is None or not (path / CGROUP_COMPONENTS[component]).is_dir():
+            return cmd
+        procs_file = path / CGROUP_COMPONENTS[component] / 'cgroup.procs'
+        # Mover antes do exec garante que todos os filhos nasçam dentro do cgroup
+        return ['sh', '-c', 'echo $$ > "$0" 2>/dev/null; exec "$@"', str(procs_file), *cmd]
+
+    def release(self, stream_id):
+        """Mata processos remanescentes do stream e remove seu cgroup"""
+        path = self._stream_path(stream_id) if self.enabled else None
+        if path is None or not path.exists():
+            return
+        kill_file = path / 'cgroup.kill'
+        try:
+            if kill_file.exists():
+                kill_file.write_text('1')
+            for leaf in sorted(p for p in path.iterdir() if p.is_dir()):
+                self._rmdir(leaf)
+            self._rmdir(path)
+        except OSError as e:
+            logger.warning(f"[{stream_id}] Falha ao remover cgroup: {e}")
+        self._usage_prev.pop(stream_id, None)
+
+    @staticmethod
+    def _rmdir(path, attempts=20):
+        # Após cgroup.kill o kernel leva alguns ms para esvaziar o cgroup
+        for _ in range(attempts):
+            try:
+                path.rmdir()
+                return
+            except OSError as e:
+                if e.errno != errno.EBUSY:
+                    raise
+                time.sleep(0.05)
+        path.rmdir()
+
+    def sample_usage(self, stream_ids):
+        """Lê o consumo direto dos arquivos do cgroup (sem percorrer processos)"""
+        now = time.time()
+        result = {}
+        for stream_id in stream_ids:
+            path = self._stream_path(stream_id) if self.enabled else None
+            if path is None or not path.exists():
+                continue
+            try:
+                usage = {}
+                if 'cpu' in self.controllers:
+                    stat = self._read_keyed(path / 'cpu.stat')
+                    usage['throttled_usec'] = stat.get('throttled_usec', 0)
+                    previous = self._usage_prev.get(stream_id)
+                    self._usage_prev[stream_id] = (now, stat.get('usage_usec', 0))
+                    if previous:
+                        elapsed = max(now - previous[0], 1e-6)
+                        usage['cpu_percent'] = round(
+                            (stat.get('usage_usec', 0) - previous[1]) / 1e6 / elapsed * 100, 1)
+                if 'memory' in self.controllers:
+                    usage['memory_mb'] = round(int((path / 'memory.current').read_text()) / (1024 * 1024), 1)
+                if 'io' in self.controllers:
+                    totals = {'rbytes': 0, 'wbytes': 0}
+                    for line in (path / 'io.stat').read_text().splitlines():
+                        for field in line.split()[1:]:
+                            key, _, value = field.partition('=')
+                            if key in totals:
+                                totals[key] += int(value)
+                    usage['io_read_bytes'] = totals['rbytes']
+                    usage['io_write_bytes'] = totals['wbytes']
+                result[stream_id] = usage
+            except (OSError, ValueError) as e:
+                logger.debug(f"[{stream_id}] Erro lendo cgroup: {e}")
+        return result
+
+    @staticmethod
+    def _read_keyed(path):
+        return {k: int(v) for k, v in (line.split() for line in path.read_text().splitlines())}
+
+
+class CpuPlacer:
+    """Distribui núcleos físicos entre streams, mantendo cada pilha num único nó NUMA"""
+
+    def __init__(self, config, cgroups):
+        self.cgroups = cgroups
+        self.cores_per_stream = config.get('cores_per_stream', DEFAULT_CORES_PER_STREAM)
+        self.nodes = {}  # {nó: [núcleo físico = tupla de CPUs lógicas irmãs]}
+        self.load = {}  # {núcleo: streams atribuídos}
+        self.assignments = {}  # {stream_id: {node, encoder, browser}}
+        self.lock = threading.Lock()
+        self.mode = 'disabled'
+        if not config.get('enabled', True):
+            return
+        try:
+            self._discover(self._parse_cpulist(config.get('reserved_cpus', '')))
+        except OSError as e:
+            logger.warning(f"Topologia de CPU indisponível, streams sem afinidade: {e}")
+            return
+        if not self.nodes:
+            logger.warning("Nenhuma CPU disponível para afinidade (reserved_cpus cobre todas?)")
+        elif cgroups.enabled and 'cpuset' in cgroups.controllers:
+            self.mode = 'cpuset'
+        elif shutil.which('taskset'):
+            self.mode = 'affinity'
+        else:
+            logger.warning("Sem cpuset delegado nem taskset, streams sem afinidade")
+        if self.mode != 'disabled':
+            cores = sum(len(c) for c in self.nodes.values())
+            logger.info(f"Afinidade via {self.mode}: {len(self.nodes)} nó(s) NUMA, {cores} núcleos físicos")
+
+    @staticmethod
+    def _parse_cpulist(text):
+        """ "0-3,8,10-11" -> {0, 1, 2, 3, 8, 10, 11}"""
+        cpus = set()
+        for part in str(text).strip().split(','):
+            if not part:
+                continue
+            first, _, last = part.partition('-')
+            cpus.update(range(int(first), int(last or first) + 1))
+        return cpus
+
+    @staticmethod
+    def _format_cpulist(cpus):
+        return ','.join(str(cpu) for cpu in sorted(cpus))
+
+    def _discover(self, reserved):
+        allowed = os.sched_getaffinity(0) - reserved
+        node_cpus = {
+            int(path.name[4:]): self._parse_cpulist((path / 'cpulist').read_text())
+            for path in Path('/sys/devices/system/node').glob('node[0-9]*')
+        } or {0: allowed}
+        for node, cpus in sorted(node_cpus.items()):
+            # Agrupar hyperthreads irmãos: o núcleo físico é a unidade de atribuição
+            cores = {}
+            for cpu in sorted(cpus & allowed):
+                try:
+                    siblings = self._parse_cpulist(Path(
+                        f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list').read_text())
+                except OSError:
+                    siblings = {cpu}
+                cores.setdefault(min(siblings), []).append(cpu)
+            if cores:
+                self.nodes[node] = [tuple(threads) for _, threads in sorted(cores.items())]
+        self.load = {core: 0 for cores in self.nodes.values() for core in cores}
+
+    def _window(self, node, count):
+        """Janela de núcleos vizinhos menos carregada do nó (compartilham cache)"""
+        cores = self.nodes[node]
+        count = min(count, len(cores))
+        start = min(range(len(cores) - count + 1),
+                    key=lambda i: sum(self.load[core] for core in cores[i:i + count]))
+        return cores[start:start + count]
+
+    def _node_load(self, node):
+        cores = self.nodes[node]
+        return sum(self.load[core] for core in cores) / len(cores)
+
+    def _take(self, stream_id, node, cores):
+        for core in cores:
+            self.load[core] += 1
+        # Encoder fica com a primeira metade (arredondada para cima); display e navegador com o resto
+        split = len(cores) - len(cores) // 2
+        encoder = [cpu for core in cores[:split] for cpu in core]
+        browser = [cpu for core in (cores[split:] or cores) for cpu in core]
+        self.assignments[stream_id] = {'node': node, 'cores': list(cores),
+                                       'encoder': encoder, 'browser': browser}
+        return self.assignments[stream_id]
+
+    def _drop(self, stream_id):
+        assignment = self.assignments.pop(stream_id, None)
+        if assignment:
+            for core in assignment['cores']:
+                self.load[core] -= 1
+        return assignment
+
+    def assign(self, stream_id, count=None):
+        """Reserva núcleos vizinhos no nó menos carregado; retorna a atribuição"""
+        if self.mode == 'disabled':
+            return None
+        with self.lock:
+            if stream_id in self.assignments:
+                return self.assignments[stream_id]
+            node = min(self.nodes, key=lambda n: (self._node_load(n), -len(self.nodes[n]), n))
+            return self._take(stream_id, node, self._window(node, count or self.cores_per_stream))
+
+    def release(self, stream_id):
+        """Libera os núcleos de um stream encerrado"""
+        with self.lock:
+            self._drop(stream_id)
+
+    def rebalance(self):
+        """Move streams que dividem núcleos para janelas mais livres; retorna os ids movidos"""
+        moved = []
+        with self.lock:
+            for stream_id in sorted(self.assignments):
+                current = self.assignments[stream_id]
+                if max(self.load[core] for core in current['cores']) <= 1:
+                    continue
+                # Só dentro do mesmo nó: a memória já alocada não migra junto
+                self._drop(stream_id)
+                node = current['node']
+                candidate = self._window(node, len(current['cores']))
+                if sum(self.load[c] for c in candidate) < sum(self.load[c] for c in current['cores']):
+                    self._take(stream_id, node, candidate)
+                    moved.append(stream_id)
+                else:
+                    self._take(stream_id, node, current['cores'])
+        return moved
+
+    def cpus_for(self, stream_id, component):
+        assignment = self.assignments.get(stream_id)
+        if not assignment:
+            return None
+        return assignment['encoder'] if component == 'ffmpeg' else assignment['browser']
+
+    def wrap(self, stream_id, component, cmd):
+        """Sem cpuset, o taskset fixa a afinidade antes do exec (herdada pelos filhos)"""
+        cpus = self.cpus_for(stream_id, component) if self.mode == 'affinity' else None
+        if not cpus:
+            return cmd
+        # A política padrão aloca memória no nó da CPU em uso: fixar a CPU basta para o NUMA
+        return ['taskset', '-c', self._format_cpulist(cpus), *cmd]
+
+    def apply(self, stream_id, procs):
+        """Aplica a atribuição atual a um stream já em execução"""
+        assignment = self.assignments.get(stream_id)
+        if not assignment:
+            return
+        if self.mode == 'cpuset':
+            self.cgroups.set_cpus(stream_id, {
+                'display': self._format_cpulist(assignment['browser']),
+                'browser': self._format_cpulist(assignment['browser']),
+                'encoder': self._format_cpulist(assignment['encoder'])
+            }, str(assignment['node']))
+            return
+        for name, proc in procs.items():
+            cpus = set(self.cpus_for(stream_id, name))
+            try:
+                root = psutil.Process(proc.pid)
+                for process in [root, *root.children(recursive=True)]:
+                    for thread in process.threads():
+                        os.sched_setaffinity(thread.id, cpus)
+            except (psutil.Error, OSError) as e:
+                logger.debug(f"[{stream_id}] Falha ao fixar afinidade de {name}: {e}")
+
+    def snapshot(self):
+        """Mapa de núcleos por nó e atribuições atuais, para a API"""
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'cores_per_stream': self.cores_per_stream,
+                'nodes': {
+                    node: [{'cpus': list(core), 'streams': self.load[core]} for core in cores]
+                    for node, cores in self.nodes.items()
+                },
+                'streams': {
+                    sid: {'node': a['node'], 'encoder': a['encoder'], 'browser': a['browser']}
+                    for sid, a in self.assignments.items()
+                }
+            }
+
+
+class ResourceTracker:
+    """Contabiliza CPU, memória, threads e I/O de cada stream somando suas árvores de processos"""
+
+    def __init__(self, with_pss=False):
+        self.with_pss = with_pss  # PSS lê /proc/<pid>/smaps: preciso, porém caro
+        self._procs = {}  # {pid: psutil.Process} reaproveitados para o delta de cpu_percent
+        self._io = {}  # {pid: (instante, io_counters)} da amostra anterior
+
+    def sample(self, processes):
+        """Amostra {stream_id: {componente: Popen}} numa única passada; retorna totais por stream"""
+        now = time.time()
+        seen = set()
+        result = {}
+        for stream_id, components in processes.items():
+            per_component = {}
+            for name, popen in components.items():
+                tree = self._process_tree(popen.pid)
+                per_component[name] = self._aggregate(tree, now, seen)
+            totals = self._empty()
+            for usage in per_component.values():
+                for field in RESOURCE_FIELDS:
+                    if usage[field] is not None:
+                        totals[field] = (totals[field] or 0) + usage[field]
+            result[stream_id] = {
+                **self._rounded(totals),
+                'components': {n: self._rounded(u) for n, u in per_component.items()},
+                'sampled_at': now
+            }
+
+        # Descartar processos que não existem mais
+        for pid in set(self._procs) - seen:
+            del self._procs[pid]
+            self._io.pop(pid, None)
+        return result
+
+    def _process(self, pid):
+        proc = self._procs.get(pid)
+        if proc is None:
+            proc = psutil.Process(pid)
+            proc.cpu_percent(interval=None)  # Referência para o próximo delta
+            self._procs[pid] = proc
+        return proc
+
+    def _process_tree(self, pid):
+        """Processo raiz e todos os descendentes (renderers/GPU do Chromium etc.)"""
+        try:
+            root = self._process(pid)
+            return [root] + [self._process(child.pid) for child in root.children(recursive=True)]
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return []
+
+    def _empty(self):
+        usage = dict.fromkeys(RESOURCE_FIELDS, 0)
+        usage['pss_mb'] = 0 if self.with_pss else None
+        return usage
+
+    def _aggregate(self, tree, now, seen):
+        usage = self._empty()
+        for proc in tree:
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_percent(interval=None)
+                    rss = proc.memory_info().rss
+                    threads = proc.num_threads()
+                    io = proc.io_counters()
+                    pss = proc.memory_full_info().pss if self.with_pss else None
+            except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError):
+                continue
+
+            seen.add(proc.pid)
+            usage['cpu_percent'] += cpu
+            usage['rss_mb'] += rss / (1024 * 1024)
+            if pss is not None:
+                usage['pss_mb'] += pss / (1024 * 1024)
+            usage['threads'] += threads
+            usage['processes'] += 1
+
+            previous = self._io.get(proc.pid)
+            self._io[proc.pid] = (now, io)
+            if previous:
+                elapsed = max(now - previous[0], 1e-6)
+                last = previous[1]
+                usage['disk_read_bytes_per_sec'] += max(0, io.read_bytes - last.read_bytes) / elapsed
+                usage['disk_write_bytes_per_sec'] += max(0, io.write_bytes - last.write_bytes) / elapsed
+                # read_chars/write_chars contam todo read()/write(), incluindo sockets e pipes
+                usage['io_read_chars_per_sec'] += max(0, io.read_chars - last.read_chars) / elapsed
+                usage['io_write_chars_per_sec'] += max(0, io.write_chars - last.write_chars) / elapsed
+        return usage
+
+    @staticmethod
+    def _rounded(usage):
+        rounded = {}
+        for field, value in usage.items():
+            if isinstance(value, float):
+                value = round(value, 1) if field in ('cpu_percent', 'rss_mb', 'pss_mb') else round(value)
+            rounded[field] = value
+        return rounded
+
+
+class HlsStore:
+    """Mantém o HLS dos streams num tmpfs com orçamento e cotas, com fallback para disco"""
+
+    def __init__(self, config, reaper_queue):
+        self.config = {**DEFAULT_HLS_STORE, **config}
+        self.reaper_queue = reaper_queue
+        self.root = None  # Diretório no tmpfs; None = todos os streams em disco
+        self.budget = 0
+        self.allocations = {}  # {stream_id: {storage, quota, used}}
+        self.alerts = {}  # {chave: mensagem} ativos
+        self.lock = threading.Lock()
+        if self.config['enabled']:
+            try:
+                self._setup()
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"tmpfs para HLS indisponível, streams em disco: {e}")
+
+    def _setup(self):
+        path = Path(self.config['path'])
+        size_mb = self.config['size_mb']
+        if self._fs_type(path) != 'tmpfs':
+            if not self.config['mount']:
+                raise OSError(f"{path} não está num tmpfs")
+            path.mkdir(parents=True, exist_ok=True)
+            subprocess.run(['mount', '-t', 'tmpfs', '-o', f'size={size_mb}m,mode=0755,nosuid,nodev,noexec',
+                            'tmpfs', str(path)], check=True, capture_output=True, timeout=10)
+        path.mkdir(parents=True, exist_ok=True)
+        os.chmod(path, 0o755)
+
+        fs = os.statvfs(path)
+        self.budget = min(size_mb * 1024 * 1024, fs.f_blocks * fs.f_frsize)
+        self.root = path
+        for leftover in path.glob('.trash-*'):
+            self.reaper_queue.put(leftover)
+        logger.info(f"HLS em tmpfs: {path} ({self.budget // (1024 * 1024)} MB)")
+
+    @staticmethod
+    def _fs_type(path):
+        """Tipo do sistema de arquivos do ponto de montagem mais específico que contém path"""
+        path = os.path.realpath(path)
+        best, fs_type = '', None
+        with open('/proc/mounts') as f:
+            for line in f:
+                _, mount_point, kind = line.split()[:3]
+                mount_point = mount_point.replace('\\040', ' ')
+                inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+                if inside and len(mount_point) >= len(best):
+                    best, fs_type = mount_point, kind
+        return fs_type
+
+    def _choose(self, stream_id, quota):
+        if self.root is None:
+            return 'disk'
+        committed = sum(a['quota'] for a in self.allocations.values() if a['storage'] == 'ram')
+        available = psutil.virtual_memory().available
+        reason = None
+        if committed + quota > self.budget:
+            reason = f"orçamento do tmpfs esgotado ({committed // (1024 * 1024)} MB reservados)"
+        elif available - quota < self.config['min_available_mb'] * 1024 * 1024:
+            reason = f"pouca memória livre ({available // (1024 * 1024)} MB)"
+        elif 'tmpfs' in self.alerts:
+            reason = "tmpfs acima do limite de uso"
+        if reason:
+            logger.warning(f"[{stream_id}] HLS em disco: {reason}")
+            return 'disk'
+        return 'ram'
+
+    def allocate(self, stream_id, quota):
+        """Prepara HLS_DIR/<id>: link para o tmpfs se houver espaço e memória, senão diretório em disco"""
+        link = HLS_DIR / stream_id
+        if link.is_symlink() or link.exists():
+            self.release(stream_id)  # Sobra de uma execução que não terminou limpa
+        with self.lock:
+            storage = self._choose(stream_id, quota)
+            if storage == 'ram':
+                target = self.root / stream_id
+                target.mkdir(exist_ok=True)
+                os.chmod(target, 0o755)
+                link.symlink_to(target)
+            else:
+                link.mkdir(parents=True, exist_ok=True)
+            self.allocations[stream_id] = {'storage': storage, 'quota': quota, 'used': 0}
+        return storage
+
+    def storage(self, stream_id):
+        allocation = self.allocations.get(stream_id)
+        return allocation['storage'] if allocation else None
+
+    def release(self, stream_id):
+        """Tira o diretório do stream do caminho público e agenda a remoção com o reaper"""
+        with self.lock:
+            self.allocations.pop(stream_id, None)
+            self.alerts.pop(f'quota:{stream_id}', None)
+
+        # Renomear é instantâneo e libera o caminho para um novo start
+        link = HLS_DIR / stream_id
+        suffix = f'{stream_id}-{uuid.uuid4().hex[:8]}'
+        try:
+            if link.is_symlink():
+                target = Path(os.readlink(link))
+                link.unlink()
+                if target.exists():
+                    trash = target.parent / f'.trash-{suffix}'
+                    target.rename(trash)
+                    self.reaper_queue.put(trash)
+            elif link.exists():
+                trash = HLS_DIR / f'.trash-{suffix}'
+                link.rename(trash)
+                self.reaper_queue.put(trash)
+        except OSError as e:
+            logger.warning(f"[{stream_id}] Falha ao mover diretório HLS: {e}")
+            shutil.rmtree(link, ignore_errors=True)
+
+    def monitor(self):
+        """Mede o uso, remove órfãos de quem passou da cota e atualiza os alertas"""
+        with self.lock:
+            allocations = dict(self.allocations)
+        for stream_id, allocation in allocations.items():
+            path = HLS_DIR / stream_id
+            used = self._usage(path)
+            if used > allocation['quota']:
+                used -= self._evict(path, used - allocation['quota'])
+            allocation['used'] = used
+            self._set_alert(f'quota:{stream_id}', used > allocation['quota'],
+                            f"[{stream_id}] HLS ocupa {used // (1024 * 1024)} MB, "
+                            f"acima da cota de {allocation['quota'] // (1024 * 1024)} MB")
+
+        if self.root is None:
+            return
+        fs = os.statvfs(self.root)
+        used = (fs.f_blocks - fs.f_bfree) * fs.f_frsize
+        limit = self.budget * self.config['high_watermark'] / 100
+        if used > limit:
+            # Antes de encher: liberar órfãos dos streams em RAM, dos maiores para os menores
+            for stream_id, allocation in sorted(allocations.items(), key=lambda item: -item[1]['used']):
+                if used <= limit:
+                    break
+                if allocation['storage'] == 'ram':
+                    used -= self._evict(HLS_DIR / stream_id, used - limit)
+        self._set_alert('tmpfs', used > limit,
+                        f"tmpfs do HLS com {used * 100 // max(self.budget, 1)}% do orçamento; "
+                        f"novos streams irão para o disco")
+
+    def _set_alert(self, key, active, message):
+        with self.lock:
+            if active and key not in self.alerts:
+                self.alerts[key] = message
+                logger.warning(message)
+            elif not active and key in self.alerts:
+                del self.alerts[key]
+                logger.info(f"Alerta resolvido: {key}")
+
+    @staticmethod
+    def _usage(path):
+        total = 0
+        try:
+            for dirpath, _, filenames in os.walk(path, followlinks=True):
+                for name in filenames:
+                    try:
+                        total += os.stat(os.path.join(dirpath, name)).st_size
+                    except FileNotFoundError:
+                        pass  # Segmento removido pelo FFmpeg durante a varredura
+        except OSError:
+            pass
+        return total
+
+    @staticmethod
+    def _evict(path, needed):
+        """Remove arquivos que nenhuma playlist referencia, do mais antigo ao mais novo"""
+        referenced = set()
+        candidates = []
+        cutoff = time.time() - HLS_EVICT_MIN_AGE
+        for dirpath, _, filenames in os.walk(path, followlinks=True):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                if name.endswith('.m3u8'):
+                    try:
+                        with open(full) as f:
+                            for line in f:
+                                line = line.strip()
+                                if line and not line.startswith('#'):
+                                    referenced.add(os.path.normpath(os.path.join(dirpath, line)))
+                                for uri in re.findall(r'URI="([^"]+)"', line):
+                                    referenced.add(os.path.normpath(os.path.join(dirpath, uri)))
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    stat = os.stat(full)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime < cutoff:
+                    candidates.append((stat.st_mtime, full, stat.st_size))
+
+        freed = 0
+        for _, full, size in sorted(candidates):
+            if freed >= needed:
+                break
+            if os.path.normpath(full) in referenced:
+                continue
+            try:
+                os.unlink(full)
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def snapshot(self):
+        """Uso do armazenamento HLS para a API e o dashboard"""
+        with self.lock:
+            streams = {sid: {'storage': a['storage'], 'quota_mb': round(a['quota'] / (1024 * 1024), 1),
+                             'used_mb': round(a['used'] / (1024 * 1024), 1)}
+                       for sid, a in self.allocations.items()}
+            alerts = list(self.alerts.values())
+        snapshot = {'storage': 'tmpfs' if self.root else 'disk', 'path': str(self.root or HLS_DIR),
+                    'streams': streams, 'alerts': alerts}
+        if self.root:
+            fs = os.statvfs(self.root)
+            snapshot['budget_mb'] = round(self.budget / (1024 * 1024), 1)
+            snapshot['used_mb'] = round((fs.f_blocks - fs.f_bfree) * fs.f_frsize / (1024 * 1024), 1)
+        return snapshot
+
+
+class HlsOrigin:
+    """Serve o HLS pelo manager, com cache LRU em memória limitado por bytes"""
+
+    def __init__(self, config):
+        config = {**DEFAULT_HLS_ORIGIN, **config}
+        self.enabled = config['enabled']
+        self.capacity = config['cache_mb'] * 1024 * 1024
+        self.max_object = config['max_object_kb'] * 1024
+        self.playlist_ttl = config['playlist_ttl']
+        self.cache = OrderedDict()  # {(stream_id, caminho): (etag, bytes)}, do menos ao mais recente
+        self.size = 0
+        self.hits = self.misses = self.bytes_served = 0
+        self.lock = threading.Lock()
+
+    def serve(self, stream_id, filename):
+        """Resposta para /hls/<stream_id>/<filename>, ou None se o arquivo não existe"""
+        path = safe_join(str(HLS_DIR / stream_id), filename)
+        suffix = os.path.splitext(filename)[1]
+        if path is None or suffix not in HLS_MIMETYPES:
+            return None
+        try:
+            f = open(path, 'rb')
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            return None
+
+        with f:
+            # fstat do arquivo aberto: playlists trocadas por rename não misturam versões
+            stat = os.fstat(f.fileno())
+            etag = f'{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}'
+            if self.enabled and stat.st_size <= self.max_object:
+                key = (stream_id, filename)
+                data = self._get(key, etag)
+                if data is None:
+                    data = f.read()
+                    self._put(key, etag, data)
+                response = Response(data, mimetype=HLS_MIMETYPES[suffix])
+                response.set_etag(etag)
+                response.last_modified = stat.st_mtime
+                response = response.make_conditional(request, accept_ranges=True,
+                                                      complete_length=len(data))
+            else:
+                response = None
+
+        if response is None:
+            # Sem cache: o arquivo vai direto do disco (via wsgi.file_wrapper, se o servidor oferecer)
+            response = send_file(path, mimetype=HLS_MIMETYPES[suffix], conditional=True,
+                                 etag=etag, max_age=None)
+        response.headers['Cache-Control'] = self._cache_control(filename, suffix)
+        if response.status_code in (200, 206):
+            self.bytes_served += response.content_length or 0
+        return response
+
+    def _cache_control(self, filename, suffix):
+        if suffix == '.m3u8':
+            return f'public, max-age={self.playlist_ttl}'
+        if suffix == '.mp4':
+            return 'no-cache'  # init.mp4 é regravado a cada respawn do FFmpeg
+        # Segmentos levam o id da execução no nome: o conteúdo de um nome nunca muda
+        return 'public, max-age=86400, immutable'
+
+    def _get(self, key, etag):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and entry[0] == etag:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def _put(self, key, etag, data):
+        with self.lock:
+            previous = self.cache.pop(key, None)
+            if previous:
+                self.size -= len(previous[1])
+            self.cache[key] = (etag, data)
+            self.size += len(data)
+            while self.size > self.capacity and self.cache:
+                _, (_, evicted) = self.cache.popitem(last=False)
+                self.size -= len(evicted)
+
+    def drop(self, stream_id):
+        """Remove do cache tudo de um stream parado"""
+        with self.lock:
+            for key in [k for k in self.cache if k[0] == stream_id]:
+                self.size -= len(self.cache.pop(key)[1])
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self.cache),
+                'cache_mb': round(self.size / (1024 * 1024), 1),
+                'capacity_mb': round(self.capacity / (1024 * 1024), 1),
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes_served': self.bytes_served
+            }
+
+
+class LowLatencyPackager:
+    """Monta playlists LL-HLS (EXT-X-PART, preload hint) a partir das partes fMP4 do FFmpeg"""
+
+    def __init__(self):
+        self.streams = {}  # {stream_id: estado do empacotamento}
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def add(self, stream_id, hls_dir, profile):
+        """Passa a empacotar um stream; no respawn do FFmpeg o estado é mantido"""
+        with self.lock:
+            self.streams.setdefault(stream_id, {
+                'dir': Path(hls_dir),
+                'target': profile['hls_time'],
+                'part_target': profile['part_duration'],
+                'list_size': profile['hls_list_size'],
+                'segments': deque(),  # Segmentos completos na janela
+                'current': None,  # Segmento em formação
+                'next_msn': 0,
+                'last_part': -1,  # Número da última parte publicada
+                'part_prefix': None,  # Nome da parte sem o número ("part_<execução>_")
+                'run': uuid.uuid4().hex[:6],  # Nomes de segmentos únicos entre execuções
+                'discontinuity_sequence': 0,
+                'mtime': 0
+            })
+
+    def remove(self, stream_id):
+        with self.lock:
+            self.streams.pop(stream_id, None)
+
+    def is_active(self, stream_id):
+        return stream_id in self.streams
+
+    def has_part(self, stream_id, msn, part=None):
+        """Indica se a playlist publicada já contém o segmento msn (e a parte, se informada)"""
+        with self.lock:
+            state = self.streams.get(stream_id)
+            if state is None:
+                return False
+            if state['segments'] and msn <= state['segments'][-1]['msn']:
+                return True
+            current = state['current']
+            return (current is not None and part is not None and msn == current['msn']
+                    and len(current['parts']) > part)
+
+    def has_file(self, stream_id, number):
+        """Indica se a parte de número `number` já foi publicada"""
+        with self.lock:
+            state = self.streams.get(stream_id)
+            return state is not None and state['last_part'] >= number
+
+    def next_msn(self, stream_id):
+        with self.lock:
+            state = self.streams.get(stream_id)
+            return state['next_msn'] if state else 0
+
+    def timing(self, stream_id):
+        """(duração alvo dos segmentos, duração alvo das partes) de um stream"""
+        state = self.streams.get(stream_id)
+        return (state['target'], state['part_target']) if state else (0, 0)
+
+    def _run(self):
+        while True:
+            time.sleep(LL_POLL_INTERVAL)
+            with self.lock:
+                states = list(self.streams.items())
+            for stream_id, state in states:
+                try:
+                    self._update(state)
+                except Exception as e:
+                    logger.error(f"[{stream_id}] Erro ao empacotar LL-HLS: {e}")
+
+    def _update(self, state):
+        parts_playlist = state['dir'] / LL_PARTS_PLAYLIST
+        try:
+            mtime = parts_playlist.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == state['mtime']:
+            return
+        state['mtime'] = mtime
+
+        # Partes novas (ainda não publicadas) na ordem em que o FFmpeg as listou
+        new_parts = []
+        duration = None
+        discontinuity = False
+        for line in parts_playlist.read_text().splitlines():
+            if line.startswith('#EXTINF:'):
+                duration = float(line[8:].split(',', 1)[0])
+            elif line == '#EXT-X-DISCONTINUITY':
+                discontinuity = True
+            elif line and not line.startswith('#'):
+                match = LL_PART_PATTERN.fullmatch(line)
+                if match and duration is not None and int(match.group(1)) > state['last_part']:
+                    new_parts.append((int(match.group(1)), line, duration, discontinuity))
+                    state['part_prefix'] = line[:match.start(1)]
+                duration = None
+                discontinuity = False
+        if not new_parts:
+            return
+
+        with self.lock:
+            for number, uri, duration, discontinuity in new_parts:
+                independent = self._starts_with_keyframe(state['dir'] / uri)
+                self._add_part(state, uri, duration, independent, discontinuity)
+                state['last_part'] = number
+            self._write_playlist(state)
+
+    def _add_part(self, state, uri, duration, independent, discontinuity):
+        current = state['current']
+        # Segmentos começam sempre numa parte independente, perto da duração alvo
+        if current and (discontinuity or
+                        (independent and current['duration'] >= state['target'] - state['part_target'] / 2)):
+            self._close_segment(state)
+            current = None
+        if current is None:
+            current = state['current'] = {
+                'msn': state['next_msn'],
+                'uri': f"segment_{state['run']}_{state['next_msn']:05d}.m4s",
+                'parts': [],
+                'duration': 0.0,
+                'discontinuity': discontinuity
+            }
+            state['next_msn'] += 1
+        current['parts'].append({'uri': uri, 'duration': duration, 'independent': independent})
+        current['duration'] += duration
+
+    def _close_segment(self, state):
+        """Concatena as partes no segmento completo (para players sem LL-HLS)"""
+        segment = state['current']
+        state['current'] = None
+        tmp_path = state['dir'] / f".{segment['uri']}.tmp"
+        with open(tmp_path, 'wb') as out:
+            for part in segment['parts']:
+                with open(state['dir'] / part['uri'], 'rb') as src:
+                    os.sendfile(out.fileno(), src.fileno(), 0, os.fstat(src.fileno()).st_size)
+        os.replace(tmp_path, state['dir'] / segment['uri'])
+        state['segments'].append(segment)
+        while len(state['segments']) > state['list_size']:
+            expired = state['segments'].popleft()
+            if expired['discontinuity']:
+                state['discontinuity_sequence'] += 1
+            (state['dir'] / expired['uri']).unlink(missing_ok=True)
+
+    def _write_playlist(self, state):
+        segments = list(state['segments'])
+        if state['current']:
+            segments.append(state['current'])
+        if not segments:
+            return
+        target = max([state['target']] + [round(s['duration']) for s in state['segments']])
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:9',
+            f'#EXT-X-TARGETDURATION:{target}',
+            f"#EXT-X-PART-INF:PART-TARGET={state['part_target']:.3f}",
+            f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={3 * state['part_target']:.3f}",
+            f"#EXT-X-MEDIA-SEQUENCE:{segments[0]['msn']}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{state['discontinuity_sequence']}",
+            '#EXT-X-MAP:URI="init.mp4"'
+        ]
+        # Partes só dos segmentos recentes (últimas ~3 durações alvo), como pede a especificação
+        with_parts = {s['msn'] for s in segments[-3:]}
+        for segment in segments:
+            if segment['discontinuity']:
+                lines.append('#EXT-X-DISCONTINUITY')
+            if segment['msn'] in with_parts:
+                for part in segment['parts']:
+                    attributes = f"DURATION={part['duration']:.3f},URI=\"{part['uri']}\""
+                    if part['independent']:
+                        attributes += ',INDEPENDENT=YES'
+                    lines.append(f'#EXT-X-PART:{attributes}')
+            if segment is not state['current']:
+                lines += [f"#EXTINF:{segment['duration']:.3f},", segment['uri']]
+        lines.append(f"#EXT-X-PRELOAD-HINT:TYPE=PART,URI=\"{state['part_prefix']}{state['last_part'] + 1:05d}.m4s\"")
+
+        tmp_path = state['dir'] / '.index.m3u8.tmp'
+        tmp_path.write_text('\n'.join(lines) + '\n')
+        os.replace(tmp_path, state['dir'] / 'index.m3u8')
+
+    @staticmethod
+    def _starts_with_keyframe(path):
+        """Lê moof/traf de uma parte fMP4 e verifica se a primeira amostra é sync"""
+        def boxes(data, offset=0, end=None):
+            end = len(data) if end is None else end
+            while offset + 8 <= end:
+                size, kind = struct.unpack_from('>I4s', data, offset)
+                if size < 8:
+                    return
+                yield kind, offset + 8, min(offset + size, end)
+                offset += size
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read(65536)
+        except OSError:
+            return False
+        for kind, start, end in boxes(data):
+            if kind != b'moof':
+                continue
+            for kind, start, end in boxes(data, start, end):
+                if kind != b'traf':
+                    continue
+                default_flags = None
+                for kind, body, box_end in boxes(data, start, end):
+                    flags = int.from_bytes(data[body + 1:body + 4], 'big')
+                    if kind == b'tfhd':
+                        offset = body + 8  # version/flags + track_ID
+                        offset += 8 if flags & 0x1 else 0
+                        offset += 4 if flags & 0x2 else 0
+                        offset += 4 if flags & 0x8 else 0
+                        offset += 4 if flags & 0x10 else 0
+                        if flags & 0x20:
+                            default_flags = struct.unpack_from('>I', data, offset)[0]
+                    elif kind == b'trun':
+                        offset = body + 8  # version/flags + sample_count
+                        offset += 4 if flags & 0x1 else 0
+                        if flags & 0x4:
+                            sample_flags = struct.unpack_from('>I', data, offset)[0]
+                        elif flags & 0x400:
+                            offset += 4 if flags & 0x100 else 0
+                            offset += 4 if flags & 0x200 else 0
+                            sample_flags = struct.unpack_from('>I', data, offset)[0]
+                        else:
+                            sample_flags = default_flags
+                        # sample_is_non_sync_sample (bit 16)
+                        return sample_flags is not None and not sample_flags & 0x10000
+        return False
+
+
+class PlaylistValidator:
+    """Confere se a playlist publicada de cada stream é consistente com os segmentos em disco"""
+
+    def __init__(self):
+        self._sequences = {}  # {caminho da playlist: último EXT-X-MEDIA-SEQUENCE visto}
+
+    def forget(self, prefix):
+        """Esquece o histórico das playlists sob prefix (stream parado)"""
+        for key in [k for k in self._sequences if k.startswith(prefix)]:
+            del self._sequences[key]
+
+    def validate(self, path):
+        """Retorna a lista de problemas encontrados (vazia = playlist consistente)"""
+        path = Path(path)
+        try:
+            lines = [line.strip() for line in path.read_text().splitlines() if line.strip()]
+            age = time.time() - path.stat().st_mtime
+        except FileNotFoundError:
+            return [f"{path.name} ausente"]
+        except (OSError, UnicodeDecodeError) as e:
+            return [f"{path.name} ilegível: {e}"]
+        if not lines or lines[0] != '#EXTM3U':
+            return [f"{path.name} sem cabeçalho #EXTM3U (leitura parcial?)"]
+
+        if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+            # Master playlist: validar cada variante
+            errors = []
+            variants = [line for line in lines if not line.startswith('#')]
+            if not variants:
+                errors.append(f"{path.name} sem variantes")
+            for variant in variants:
+                errors += [f"{variant}: {error}" for error in self.validate(path.parent / variant)]
+            return errors
+
+        errors = []
+        target = sequence = None
+        segments = []
+        duration = None
+        try:
+            for line in lines:
+                if line.startswith('#EXT-X-TARGETDURATION:'):
+                    target = int(line.split(':', 1)[1])
+                elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+                    sequence = int(line.split(':', 1)[1])
+                elif line.startswith('#EXTINF:'):
+                    duration = float(line[8:].split(',', 1)[0])
+                elif line.startswith('#EXT-X-MAP:'):
+                    match = re.search(r'URI="([^"]+)"', line)
+                    if match:
+                        segments.append((match.group(1), None))
+                elif not line.startswith('#'):
+                    segments.append((line, duration))
+                    duration = None
+        except ValueError as e:
+            return [f"{path.name} com tag malformada: {e}"]
+
+        if target is None:
+            return [f"{path.name} sem #EXT-X-TARGETDURATION"]
+        if not any(d is not None for _, d in segments):
+            errors.append(f"{path.name} sem segmentos")
+        for uri, seg_duration in segments:
+            if seg_duration is not None and round(seg_duration) > target:
+                errors.append(f"{uri} dura {seg_duration:.2f}s, acima do TARGETDURATION {target}")
+            try:
+                if (path.parent / uri).stat().st_size == 0:
+                    errors.append(f"{uri} vazio")
+            except FileNotFoundError:
+                errors.append(f"{uri} listado mas ausente")
+
+        key = str(path)
+        previous = self._sequences.get(key)
+        if sequence is not None:
+            if previous is not None and sequence < previous:
+                errors.append(f"MEDIA-SEQUENCE retrocedeu de {previous} para {sequence}")
+            self._sequences[key] = sequence
+        if age > 3 * target:
+            errors.append(f"{path.name} sem atualização há {age:.0f}s")
+        return errors
+
+
+class WarmPool:
+    """Slots Xvfb + Chromium ociosos e pré-lançados, assumidos por streams ao iniciar"""
+
+    def __init__(self, config, spawn_slot, terminate, display_free):
+        self.config = {**DEFAULT_WARM_POOL, **config}
+        self.size = self.config['size']
+        self.resolution = self.config['resolution']
+        self.spawn_slot = spawn_slot
+        self.terminate = terminate
+        self.display_free = display_free
+        self.lock = threading.Lock()
+        self.idle = []  # Slots prontos: {'display', 'xvfb', 'browser', 'profile_dir'}
+        self.spawning = set()  # Displays com slot em preparação
+        self.leased = {}  # {stream_id: slot} assumidos por streams em execução
+        self.claims = 0
+        self.misses = 0
+        self._closed = False
+        self._wakeup = threading.Event()
+        if self.size > 0:
+            threading.Thread(target=self._run, daemon=True).start()
+
+    @staticmethod
+    def _alive(slot):
+        return slot['xvfb'].poll() is None and slot['browser'].poll() is None
+
+    def _discard(self, slots):
+        """Encerra os processos dos slots e apaga seus perfis temporários"""
+        self.terminate([proc for slot in slots for proc in (slot['xvfb'], slot['browser'])])
+        for slot in slots:
+            shutil.rmtree(slot['profile_dir'], ignore_errors=True)
+
+    def claim(self, stream_id, resolution):
+        """Entrega um slot pronto na mesma resolução (ou None) e dispara a reposição"""
+        if self.size <= 0:
+            return None
+        with self.lock:
+            slot = None
+            if resolution == self.resolution:
+                slot = next((s for s in self.idle if self._alive(s)), None)
+            if slot:
+                self.idle.remove(slot)
+                self.leased[stream_id] = slot
+                self.claims += 1
+            else:
+                self.misses += 1
+        self._wakeup.set()
+        return slot
+
+    def release(self, stream_id):
+        """Stream parado: apaga o perfil do slot assumido e libera seu display"""
+        with self.lock:
+            slot = self.leased.pop(stream_id, None)
+        if slot:
+            # Os processos já foram encerrados com o stream; cookies e logins não passam adiante
+            shutil.rmtree(slot['profile_dir'], ignore_errors=True)
+        self._wakeup.set()
+
+    def shutdown(self):
+        """Encerra os slots ociosos e para a reposição"""
+        with self.lock:
+            self._closed = True
+            idle, self.idle = self.idle, []
+        self._wakeup.set()
+        self._discard(idle)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'resolution': self.resolution,
+                'idle': len(self.idle),
+                'spawning': len(self.spawning),
+                'leased': {sid: slot['display'] for sid, slot in self.leased.items()},
+                'claims': self.claims,
+                'misses': self.misses
+            }
+
+    def _next_display(self):
+        used = {slot['display'] for slot in [*self.idle, *self.leased.values()]} | self.spawning
+        display = WARM_DISPLAY_BASE
+        while display in used or not self.display_free(display):
+            display += 1
+        return display
+
+    def _run(self):
+        while not self._closed:
+            # Slots que morreram ociosos são descartados e repostos
+            with self.lock:
+                dead = [slot for slot in self.idle if not self._alive(slot)]
+                self.idle = [slot for slot in self.idle if slot not in dead]
+                display = None
+                if len(self.idle) + len(self.spawning) < self.size:
+                    display = self._next_display()
+                    self.spawning.add(display)
+            if dead:
+                logger.warning(f"{len(dead)} slot(s) aquecido(s) encerraram ociosos")
+                self._discard(dead)
+            if display is None:
+                self._wakeup.wait(WARM_CHECK_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            try:
+                slot = self.spawn_slot(display, self.resolution)
+            except Exception as e:
+                logger.warning(f"Falha ao preparar slot aquecido no display :{display}: {e}")
+                slot = None
+            with self.lock:
+                self.spawning.discard(display)
+                if slot and not self._closed:
+                    self.idle.append(slot)
+                    slot = None
+                    failed = False
+                else:
+                    failed = slot is None
+            if slot:
+                self._discard([slot])  # Pool encerrado durante o preparo
+            if failed:
+                self._wakeup.wait(WARM_RETRY_DELAY)
+                self._wakeup.clear()
+
+
+class AccessLogTailer:
+    """Acompanha o access log do nginx e avisa a cada pedido de playlist HLS"""
+
+    def __init__(self, path, on_hit):
+        self.path = Path(path)
+        self.on_hit = on_hit
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        f = None
+        inode = None
+        while True:
+            try:
+                if f is None:
+                    f = open(self.path, 'r', errors='replace')
+                    inode = os.fstat(f.fileno()).st_ino
+                    f.seek(0, os.SEEK_END)  # Só pedidos novos contam
+                line = f.readline()
+                if line:
+                    match = ACCESS_LOG_HIT.search(line)
+                    if match:
+                        self.on_hit(urllib.parse.unquote(match.group(1)))
+                    continue
+                time.sleep(1)
+                # Rotação (logrotate): arquivo novo no mesmo caminho ou truncado
+                stat = os.stat(self.path)
+                if stat.st_ino != inode or stat.st_size < f.tell():
+                    f.close()
+                    f = open(self.path, 'r', errors='replace')
+                    inode = os.fstat(f.fileno()).st_ino
+            except FileNotFoundError:
+                time.sleep(5)
+            except Exception as e:
+                logger.error(f"Erro lendo access log {self.path}: {e}")
+                if f:
+                    f.close()
+                f = None
+                time.sleep(5)
+
+
+class ChildWatcher:
+    """Detecta a saída de processos filhos por eventos (pidfd + epoll), sem polling"""
+
+    def __init__(self, on_exit):
+        self.on_exit = on_exit
+        self._lock = threading.Lock()
+        self._watches = {}  # fd -> (proc, context)
+        self._polled = []  # Fallback para kernels/Pythons sem pidfd_open
+        # Decidido uma vez aqui: trocar de modo com a thread em poll() perderia os pidfds registrados
+        self._epoll = select.epoll() if self._pidfd_supported() else None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    @staticmethod
+    def _pidfd_supported():
+        """pidfd_open existe no Python e no kernel (>= 5.3)?"""
+        if not hasattr(os, 'pidfd_open'):
+            return False
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            return False
+        return True
+
+    def watch(self, proc, *context):
+        """Passa a observar um Popen; on_exit(proc, *context) é chamado quando ele encerrar"""
+        if self._epoll is not None:
+            try:
+                fd = os.pidfd_open(proc.pid)
+            except ProcessLookupError:
+                # Já encerrou e foi coletado antes de ser observado
+                proc.poll()
+                self._notify(proc, context)
+                return
+            except OSError as e:
+                # Falha pontual (ex.: limite de descritores): só este processo vai para o polling
+                logger.warning(f"pidfd_open falhou para o pid {proc.pid} ({e}), observando por polling")
+            else:
+                with self._lock:
+                    self._watches[fd] = (proc, context)
+                self._epoll.register(fd, select.EPOLLIN)
+                return
+        with self._lock:
+            self._polled.append((proc, context))
+
+    def _notify(self, proc, context):
+        try:
+            self.on_exit(proc, *context)
+        except Exception as e:
+            logger.error(f"Erro tratando saída do processo {proc.pid}: {e}")
+
+    def _run(self):
+        while True:
+            if self._epoll is not None:
+                events = self._epoll.poll(CHILD_POLL_INTERVAL)
+            else:
+                time.sleep(CHILD_POLL_INTERVAL)
+                events = []
+
+            for fd, _ in events:
+                with self._lock:
+                    proc, context = self._watches.pop(fd)
+                self._epoll.unregister(fd)
+                os.close(fd)
+                proc.poll()  # Coletar o status de saída (evita zumbis)
+                self._notify(proc, context)
+
+            with self._lock:
+                exited = [(p, c) for p, c in self._polled if p.poll() is not None]
+                self._polled = [(p, c) for p, c in self._polled if p.returncode is None]
+            for proc, context in exited:
+                self._notify(proc, context)
+
+
 # Estado global dos streams
 class StreamManager:
     def __init__(self):
         self.streams = {}  # Configuração dos streams
         self.processes = {}  # Processos ativos {stream_id: {xvfb, browser, ffmpeg, vnc}}
         self.status = {}  # Status dos streams
+        self.jobs = {}  # Jobs de inicialização {job_id: {stream_id, state, stage, ...}}
+        self.last_errors = {}  # Último erro de inicialização por stream
+        self.restart_policies = {}  # RestartPolicy por stream
+        self.pending_restarts = {}  # Reinícios agendados {stream_id: (Timer, next_restart_at, componente)}
+
+        # Protocolo de status incremental: revisão global e último estado publicado
+        self.epoch = uuid.uuid4().hex[:8]  # Muda a cada reinício do serviço
+        self.revision = 0
+        self._published = {}  # {stream_id: (revisão, snapshot)}
+        self._tombstones = {}  # {stream_id: revisão da remoção}
+        self._tombstone_floor = 0  # Revisões anteriores a esta exigem snapshot completo
+        self._publish_lock = threading.Lock()
+        self.lock = threading.RLock()
         self.load_config()
 
+        # Pools limitados: inicializações concorrem por CPU, paradas só aguardam processos
+        self.start_pool = ThreadPoolExecutor(
+            max_workers=self.server_config.get('start_concurrency', DEFAULT_START_CONCURRENCY),
+            thread_name_prefix='start'
+        )
+        self.stop_pool = ThreadPoolExecutor(
+            max_workers=self.server_config.get('stop_concurrency', DEFAULT_STOP_CONCURRENCY),
+            thread_name_prefix='stop'
+        )
+        self.cgroups = CgroupManager(self.server_config.get('cgroups', {}))
+        self.placer = CpuPlacer(self.server_config.get('placement', {}), self.cgroups)
+        self.resources = {}  # Último consumo medido por stream
+        self.resource_tracker = ResourceTracker(self.server_config.get('resource_pss', False))
+        self.sampler = SystemSampler(
+            self.server_config.get('stats_interval', DEFAULT_STATS_INTERVAL),
+            self.server_config.get('stats_history', DEFAULT_STATS_HISTORY),
+            on_sample=self._on_system_sample
+        )
+        self.child_watcher = ChildWatcher(self._on_child_exit)
+        self.ll_packager = LowLatencyPackager()
+        self.playlist_validator = PlaylistValidator()
+        self.playlist_errors = {}  # {stream_id: problemas da última validação}
+
+        # Remoção de diretórios HLS fora do caminho da requisição
+        self.reaper_queue = queue.Queue()
+        threading.Thread(target=self._reaper_loop, daemon=True).start()
+        for leftover in HLS_DIR.glob('.trash-*'):
+            self.reaper_queue.put(leftover)
+        self.hls_store = HlsStore(self.server_config.get('hls_store', {}), self.reaper_queue)
+        self.hls_origin = HlsOrigin(self.server_config.get('hls_origin', {}))
+        self.warm_pool = WarmPool(self.server_config.get('warm_pool', {}),
+                                  self._spawn_warm_slot, self._terminate_processes,
+                                  self._warm_display_free)
+
+        # Streams lazy: iniciados pelo primeiro pedido de playlist, parados sem espectadores
+        self.last_viewed = {}  # {stream_id: instante (monotonic) do último pedido de playlist}
+        self.lazy_started = {}  # {stream_id: instante do start disparado por espectador}
+        self.placeholder_path = BASE_DIR / 'placeholder' / PLACEHOLDER_SEGMENT
+        lazy_config = self.server_config.get('lazy', {})
+        if lazy_config.get('access_log'):
+            AccessLogTailer(lazy_config['access_log'], self.record_view)
+        self._placeholder_thread = None
+        self._placeholder_data = None
+        if any(stream.get('lazy') for stream in self.streams.values()):
+            self._request_placeholder()
+
     def load_config(self):
         """Carrega configuração do arquivo JSON"""
         config_file = CONFIG_DIR / 'streams.json'
@@ -75,6 +1806,69 @@ class StreamManager:
             self.streams = {}
             self.server_config = {'port': 8080, 'hls_time': 2, 'hls_list_size': 5}
 
+        for name in self.server_config.get('encoder_profiles', {}):
+            try:
+                self.get_encoder_profile(name)
+            except ValueError as e:
+                logger.error(f"Perfil de encoder inválido: {e}")
+
+    def get_encoder_profile(self, name=None):
+        """Resolve um perfil de encoder (server.encoder_profiles) sobre os padrões; ValueError se inválido"""
+        profiles = self.server_config.get('encoder_profiles', {})
+        name = name or 'default'
+        if name not in profiles and name != 'default':
+            raise ValueError(f"perfil '{name}' não existe")
+        overrides = profiles.get(name, {})
+        unknown = set(overrides) - set(DEFAULT_ENCODER_PROFILE)
+        if unknown:
+            raise ValueError(f"{name}: campos desconhecidos {sorted(unknown)}")
+        profile = {**DEFAULT_ENCODER_PROFILE, **overrides}
+        if profile['hls_time'] is None:
+            profile['hls_time'] = self.server_config.get('hls_time', 2)
+        if profile['hls_list_size'] is None:
+            profile['hls_list_size'] = self.server_config.get('hls_list_size', 5)
+        if profile['gop'] is None and isinstance(profile['fps'], int) and isinstance(profile['hls_time'], int):
+            profile['gop'] = profile['fps'] * profile['hls_time']
+
+        def check(ok, message):
+            if not ok:
+                raise ValueError(f"{name}: {message}")
+
+        def is_int(value, low, high):
+            return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+
+        check(is_int(profile['fps'], 1, 60), "fps deve ser inteiro entre 1 e 60")
+        check(profile['preset'] in X264_PRESETS, f"preset deve ser um de {', '.join(X264_PRESETS)}")
+        check(profile['tune'] in (None, *X264_TUNES), f"tune deve ser um de {', '.join(X264_TUNES)}")
+        check(profile['bitrate'] is None or re.fullmatch(r'\d+(\.\d+)?[kM]?', str(profile['bitrate'])),
+              "bitrate deve ser como 1500k ou 3M")
+        check(profile['crf'] is None or is_int(profile['crf'], 0, 51), "crf deve ser inteiro entre 0 e 51")
+        check(profile['bitrate'] is not None or profile['crf'] is not None, "defina bitrate ou crf")
+        check(is_int(profile['threads'], 0, 64), "threads deve ser inteiro entre 0 e 64")
+        check(profile['pix_fmt'] in PIXEL_FORMATS, f"pix_fmt deve ser um de {', '.join(PIXEL_FORMATS)}")
+        check(is_int(profile['hls_time'], 1, 30), "hls_time deve ser inteiro entre 1 e 30")
+        check(is_int(profile['hls_list_size'], 1, 100), "hls_list_size deve ser inteiro entre 1 e 100")
+        check(is_int(profile['gop'], 1, 600), "gop deve ser inteiro entre 1 e 600")
+        if profile['renditions'] is not None:
+            renditions = profile['renditions']
+            check(isinstance(renditions, list) and renditions, "renditions deve ser uma lista não vazia")
+            for rendition in renditions:
+                check(isinstance(rendition, dict) and is_int(rendition.get('height'), 144, 2160),
+                      "cada rendition precisa de height inteiro entre 144 e 2160")
+                check(re.fullmatch(r'\d+(\.\d+)?[kM]?', str(rendition.get('bitrate', ''))),
+                      f"rendition {rendition['height']}p: bitrate deve ser como 2500k")
+            heights = [r['height'] for r in renditions]
+            check(len(set(heights)) == len(heights), "renditions com altura repetida")
+        if profile['low_latency']:
+            check(not profile['renditions'], "low_latency não suporta renditions")
+            check(isinstance(profile['part_duration'], (int, float))
+                  and 0.1 <= profile['part_duration'] <= profile['hls_time'] / 2,
+                  "part_duration deve ficar entre 0.1 e hls_time / 2")
+        # Segmentos só cortam em keyframe: o GOP precisa dividir a duração do segmento
+        check((profile['fps'] * profile['hls_time']) % profile['gop'] == 0,
+              f"gop {profile['gop']} não divide fps * hls_time ({profile['fps'] * profile['hls_time']})")
+        return profile
+
     def save_config(self):
         """Salva configuração no arquivo JSON"""
         config_file = CONFIG_DIR / 'streams.json'
@@ -95,172 +1889,705 @@ class StreamManager:
         index = list(self.streams.keys()).index(stream_id) if stream_id in self.streams else len(self.streams)
         return base + index
 
-    def start_stream(self, stream_id):
-        """Inicia um stream"""
-        if stream_id not in self.streams:
-            return False, "Stream não encontrado"
-
-        if stream_id in self.processes:
-            return False, "Stream já está rodando"
-
-        stream = self.streams[stream_id]
-        display = self.get_display_number(stream_id)
-        resolution = stream.get('resolution', '1280x720')
-        width, height = resolution.split('x')
-
-        try:
+    def get_devtools_port(self, display):
+        """Porta do DevTools do navegador associado a um display"""
+        return DEVTOOLS_BASE_PORT + display - 99
+
+    def _warm_display_free(self, display):
+        """Display utilizável por um slot aquecido: fora da faixa dos streams, sem servidor X e com portas livres"""
+        if display < 99 + len(self.streams) + WARM_DISPLAY_MARGIN:
+            return False
+        if Path(f'/tmp/.X{display}-lock').exists() or Path(f'/tmp/.X11-unix/X{display}').exists():
+            return False
+        return all(self._port_free(port) for port in (self.get_devtools_port(display), 5900 + display - 99))
+
+    @staticmethod
+    def _port_free(port):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                sock.bind(('127.0.0.1', port))
+            except OSError:
+                return False
+        return True
+
+    def start_stream(self, stream_id, restart=False):
+        """Agenda o início de um stream e retorna imediatamente com o id do job"""
+        with self.lock:
+            if stream_id not in self.streams:
+                return False, "Stream não encontrado", None
+
+            # Início manual cancela reinícios pendentes e rearma o disjuntor
+            if not restart:
+                self._cancel_pending_restart(stream_id)
+                self.get_restart_policy(stream_id).reset()
+
+            if stream_id in self.processes:
+                return False, "Stream já está rodando", None
+
+            job_id = uuid.uuid4().hex[:12]
+            now = datetime.now().isoformat()
+            stream = self.streams[stream_id]
+            display = self.get_display_number(stream_id)
             self.processes[stream_id] = {}
             self.status[stream_id] = {
                 'state': 'starting',
-                'started_at': datetime.now().isoformat(),
+                'stage': 'queued',
+                'job_id': job_id,
+                'started_at': now,
                 'display': display
             }
-            self.emit_status_update()
-
-            # 1. Iniciar Xvfb (display virtual)
-            xvfb_cmd = [
-                'Xvfb', f':{display}',
-                '-screen', '0', f'{width}x{height}x24',
-                '-ac'
-            ]
+            self.jobs[job_id] = {
+                'id': job_id,
+                'stream_id': stream_id,
+                'state': 'pending',
+                'stage': 'queued',
+                'created_at': now,
+                'finished_at': None,
+                'error': None,
+                'restart': restart
+            }
+            self.last_errors.pop(stream_id, None)
+            self._prune_jobs()
+
+        self.start_pool.submit(self._run_start_pipeline, stream_id, job_id, stream, display,
+                               time.monotonic())
+        self.emit_status_update()
+        return True, "Inicialização agendada", job_id
+
+    def select_streams(self, ids=None, selector=None):
+        """Resolve uma lista de ids ou um seletor (all, running, stopped)"""
+        if ids is not None:
+            return list(dict.fromkeys(ids))
+        if selector == 'running':
+            return [sid for sid in self.streams if sid in self.processes]
+        if selector == 'stopped':
+            return [sid for sid in self.streams if sid not in self.processes]
+        return list(self.streams)
+
+    def bulk_start(self, stream_ids):
+        """Agenda vários streams; a concorrência real é limitada pelo start_pool"""
+        results = {}
+        for stream_id in stream_ids:
+            success, message, job_id = self.start_stream(stream_id)
+            results[stream_id] = {'success': success, 'message': message, 'job_id': job_id}
+        return results
+
+    def bulk_stop(self, stream_ids):
+        """Para vários streams em paralelo; retorna {stream_id: Future}"""
+        return {sid: self.stop_pool.submit(self.stop_stream, sid) for sid in stream_ids}
+
+    def _cpu_percent(self):
+        """Uso de CPU mais recente do amostrador em segundo plano"""
+        sample = self.sampler.latest()
+        return sample['cpu_percent'] if sample else 0.0
+
+    def _await_admission(self, stream_id, job_id):
+        """Segura o pipeline enquanto a CPU estiver acima do limite de admissão"""
+        max_cpu = self.server_config.get('admission_max_cpu', DEFAULT_ADMISSION_MAX_CPU)
+        timeout = self.server_config.get('admission_timeout', DEFAULT_ADMISSION_TIMEOUT)
+        deadline = time.monotonic() + timeout
+        while self._cpu_percent() > max_cpu and time.monotonic() < deadline:
+            if not self._is_current_job(stream_id, job_id):
+                raise StartCancelled(stream_id)
+            time.sleep(0.5)
+
+    def get_job(self, job_id):
+        """Retorna o estado de um job de inicialização"""
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    def _prune_jobs(self):
+        """Descarta jobs finalizados mais antigos além do limite"""
+        finished = [j for j in self.jobs.values() if j['finished_at']]
+        for job in finished[:max(0, len(self.jobs) - MAX_JOBS)]:
+            del self.jobs[job['id']]
+
+    def _is_current_job(self, stream_id, job_id):
+        """Verifica se o job ainda é o responsável pelo stream (não foi cancelado)"""
+        return (stream_id in self.processes and
+                self.status.get(stream_id, {}).get('job_id') == job_id)
+
+    def _set_stage(self, stream_id, job_id, stage):
+        """Avança o estágio do pipeline e publica o progresso"""
+        with self.lock:
+            if not self._is_current_job(stream_id, job_id):
+                raise StartCancelled(stream_id)
+            self.status[stream_id]['stage'] = stage
+            self.jobs[job_id]['state'] = 'running'
+            self.jobs[job_id]['stage'] = stage
+        logger.info(f"[{stream_id}] Estágio: {stage}")
+        self.emit_status_update()
+        return time.monotonic()
+
+    def _record_latency(self, stream_id, stage, stage_start, ready=True):
+        """Registra a latência de um estágio no status do stream"""
+        elapsed_ms = int((time.monotonic() - stage_start) * 1000)
+        with self.lock:
+            status = self.status.get(stream_id)
+            if status is None:
+                return
+            status.setdefault('stage_latency_ms', {})[stage] = elapsed_ms
+            if not ready:
+                status.setdefault('readiness_timeouts', []).append(stage)
+        if ready:
+            logger.info(f"[{stream_id}] {stage} pronto em {elapsed_ms} ms")
+        else:
+            logger.warning(f"[{stream_id}] {stage} sem sinal de prontidão após {elapsed_ms} ms")
+
+    def get_stage_timeout(self, stage):
+        """Timeout de prontidão de um estágio, configurável em server.stage_timeouts"""
+        timeouts = self.server_config.get('stage_timeouts', {})
+        return timeouts.get(stage, DEFAULT_STAGE_TIMEOUTS[stage])
+
+    def _command(self, stream_id, component, cmd):
+        """Prefixa um comando da pilha com a afinidade de CPU e a entrada no cgroup"""
+        return self.cgroups.wrap(stream_id, component, self.placer.wrap(stream_id, component, cmd))
+
+    def _register_process(self, stream_id, job_id, name, proc):
+        """Registra um processo do pipeline; encerra-o se o job foi cancelado"""
+        with self.lock:
+            if self._is_current_job(stream_id, job_id):
+                self.processes[stream_id][name] = proc
+                self.child_watcher.watch(proc, stream_id, name)
+                return
+        if proc.poll() is None:
+            proc.kill()
+        raise StartCancelled(stream_id)
+
+    def _finish_job(self, job_id, state, error=None):
+        """Marca um job como finalizado"""
+        job = self.jobs.get(job_id)
+        if job:
+            job['state'] = state
+            job['error'] = error
+            job['finished_at'] = datetime.now().isoformat()
+
+    def _wait_until(self, predicate, timeout, proc=None, interval=0.05):
+        """Aguarda uma condição de prontidão; falha cedo se o processo morrer"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return True
+            if proc is not None and proc.poll() is not None:
+                return False
+            time.sleep(interval)
+        return predicate()
+
+    def _wait_xvfb_ready(self, display, ready_fd, timeout, proc):
+        """Aguarda o handshake -displayfd do Xvfb, com o socket X11 como alternativa"""
+        x_socket = Path(f'/tmp/.X11-unix/X{display}')
+        deadline = time.monotonic() + timeout
+        watch_fd = True
+        while time.monotonic() < deadline:
+            if watch_fd:
+                readable, _, _ = select.select([ready_fd], [], [], 0.05)
+                if readable:
+                    # O Xvfb escreve o número do display quando está aceitando conexões
+                    if os.read(ready_fd, 32).strip():
+                        return True
+                    # EOF sem número: Xvfb sem suporte a -displayfd ou encerrado
+                    watch_fd = False
+            else:
+                time.sleep(0.05)
+            if x_socket.exists():
+                return True
+            if proc.poll() is not None:
+                return False
+        return x_socket.exists()
+
+    def _devtools_json(self, port, path):
+        """Consulta um endpoint HTTP do DevTools; retorna None se indisponível"""
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=0.5) as resp:
+                return json.loads(resp.read())
+        except (OSError, ValueError):
+            return None
+
+    def _page_target(self, port):
+        """Primeira aba do navegador com WebSocket do DevTools disponível"""
+        targets = self._devtools_json(port, '/json/list') or []
+        return next((t for t in targets if t.get('type') == 'page'
+                     and t.get('webSocketDebuggerUrl')), None)
+
+    def _navigate(self, port, url):
+        """Leva a aba de um navegador já aberto para outra URL via DevTools"""
+        page = self._page_target(port)
+        if page is None:
+            raise RuntimeError(f"Nenhuma aba no DevTools da porta {port}")
+        with DevToolsClient(page['webSocketDebuggerUrl']) as client:
+            result = client.call('Page.navigate', url=url)
+        if result.get('errorText'):
+            raise RuntimeError(f"Navegação falhou: {result['errorText']}")
+
+    def _wait_browser_ready(self, port, timeout, proc):
+        """Aguarda a página carregar ou pintar o primeiro frame, via DevTools"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                return False
+            page = self._page_target(port)
+            if page is None:
+                time.sleep(0.1)
+                continue
+            try:
+                with DevToolsClient(page['webSocketDebuggerUrl']) as client:
+                    while time.monotonic() < deadline:
+                        if client.evaluate(PAGE_READY_EXPRESSION):
+                            return True
+                        if proc.poll() is not None:
+                            return False
+                        time.sleep(0.1)
+            except (OSError, ConnectionError, RuntimeError, ValueError) as e:
+                # Navegação recria o alvo; tentar de novo com a lista atualizada
+                logger.debug(f"DevTools indisponível na porta {port}: {e}")
+                time.sleep(0.1)
+        return False
+
+    def _spawn_browser(self, stream_id, stream, display):
+        """Lança o Chromium no display do stream, com DevTools local habilitado"""
+        width, height = stream.get('resolution', '1280x720').split('x')
+
+        # Criar diretório do perfil se não existir
+        profile_name = stream.get('profile', stream_id)
+        profile_dir = PROFILES_DIR / profile_name
+        profile_dir.mkdir(parents=True, exist_ok=True)
+
+        browser_cmd = self._browser_command(display, width, height, profile_dir, stream['url'])
+        browser_env = {**os.environ, 'DISPLAY': f':{display}'}
+        return subprocess.Popen(
+            self._command(stream_id, 'browser', browser_cmd),
+            env=browser_env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+    def _browser_command(self, display, width, height, profile_dir, url):
+        """Linha de comando do Chromium com DevTools local habilitado"""
+        return [
+            'chromium-browser',
+            '--no-sandbox',
+            '--disable-gpu',
+            '--disable-dev-shm-usage',
+            '--disable-software-rasterizer',
+            f'--window-size={width},{height}',
+            '--start-maximized',
+            '--autoplay-policy=no-user-gesture-required',
+            '--disable-features=PreloadMediaEngagementData,MediaEngagementBypassAutoplayPolicies',
+            f'--user-data-dir={profile_dir}',
+            '--remote-debugging-address=127.0.0.1',
+            f'--remote-debugging-port={self.get_devtools_port(display)}',
+            url
+        ]
+
+    def _xvfb_command(self, display, width, height, ready_fd):
+        """-displayfd: o Xvfb sinaliza no pipe quando o display está pronto"""
+        return [
+            'Xvfb', f':{display}',
+            '-screen', '0', f'{width}x{height}x24',
+            '-ac',
+            '-displayfd', str(ready_fd)
+        ]
+
+    def _start_audio(self, display):
+        """Garante o PulseAudio virtual (um daemon por usuário, compartilhado)"""
+        pulse_cmd = [
+            'pulseaudio',
+            '--start',
+            '--exit-idle-time=-1',
+            f'--high-priority'
+        ]
+        subprocess.run(pulse_cmd, env={**os.environ, 'DISPLAY': f':{display}'},
+                       capture_output=True, timeout=self.get_stage_timeout('audio'))
+
+    def _spawn_warm_slot(self, display, resolution):
+        """Prepara um slot do pool: Xvfb + Chromium em about:blank, prontos para navegar"""
+        width, height = resolution.split('x')
+        ready_r, ready_w = os.pipe()
+        try:
             xvfb_proc = subprocess.Popen(
-                xvfb_cmd,
+                self._xvfb_command(display, width, height, ready_w),
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.DEVNULL,
                 stdin=subprocess.DEVNULL,
+                pass_fds=(ready_w,),
                 start_new_session=True
             )
-            self.processes[stream_id]['xvfb'] = xvfb_proc
-            time.sleep(1)
-            logger.info(f"[{stream_id}] Xvfb iniciado no display :{display}")
-
-            # 2. Iniciar PulseAudio virtual
-            pulse_cmd = [
-                'pulseaudio',
-                '--start',
-                '--exit-idle-time=-1',
-                f'--high-priority'
-            ]
-            subprocess.run(pulse_cmd, env={**os.environ, 'DISPLAY': f':{display}'}, capture_output=True)
-
-            # 3. Criar diretório do perfil se não existir
-            profile_name = stream.get('profile', stream_id)
-            profile_dir = PROFILES_DIR / profile_name
-            profile_dir.mkdir(parents=True, exist_ok=True)
-
-            # 4. Iniciar navegador
-            browser_cmd = [
-                'chromium-browser',
-                '--no-sandbox',
-                '--disable-gpu',
-                '--disable-dev-shm-usage',
-                '--disable-software-rasterizer',
-                f'--window-size={width},{height}',
-                '--start-maximized',
-                '--autoplay-policy=no-user-gesture-required',
-                '--disable-features=PreloadMediaEngagementData,MediaEngagementBypassAutoplayPolicies',
-                f'--user-data-dir={profile_dir}',
-                stream['url']
-            ]
-            browser_env = {**os.environ, 'DISPLAY': f':{display}'}
+        finally:
+            os.close(ready_w)
+        browser_proc = profile_dir = None
+        try:
+            try:
+                ready = self._wait_xvfb_ready(display, ready_r, self.get_stage_timeout('xvfb'), xvfb_proc)
+            finally:
+                os.close(ready_r)
+            if not ready:
+                raise RuntimeError("Xvfb não ficou pronto")
+            self._start_audio(display)
+
+            # Perfil temporário e exclusivo do slot, fora de PROFILES_DIR; apagado ao liberar o slot
+            profile_dir = tempfile.mkdtemp(prefix=f'stream-manager-warm-{display}-')
             browser_proc = subprocess.Popen(
-                browser_cmd,
-                env=browser_env,
+                self._browser_command(display, width, height, profile_dir, 'about:blank'),
+                env={**os.environ, 'DISPLAY': f':{display}'},
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.DEVNULL,
                 stdin=subprocess.DEVNULL,
                 start_new_session=True
             )
-            self.processes[stream_id]['browser'] = browser_proc
-            time.sleep(3)
-            logger.info(f"[{stream_id}] Browser iniciado")
-
-            # 5. Criar diretório HLS para este stream
-            hls_stream_dir = HLS_DIR / stream_id
-            hls_stream_dir.mkdir(parents=True, exist_ok=True)
-            os.chmod(hls_stream_dir, 0o755)
-            logger.info(f"[{stream_id}] Diretório HLS criado: {hls_stream_dir}")
-
-            # 6. Iniciar FFmpeg para capturar e gerar HLS diretamente
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-y',
-                '-f', 'x11grab',
-                '-framerate', '15',
-                '-video_size', resolution,
-                '-i', f':{display}',
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
-                '-b:v', '1500k',
-                '-maxrate', '1500k',
-                '-bufsize', '3000k',
-                '-pix_fmt', 'yuv420p',
-                '-g', '30',
-                '-f', 'hls',
-                '-hls_time', '2',
-                '-hls_list_size', '10',
-                '-hls_flags', 'delete_segments+append_list',
-                '-hls_segment_filename', f'{hls_stream_dir}/segment_%03d.ts',
-                f'{hls_stream_dir}/index.m3u8'
-            ]
-
-            ffmpeg_log = open(LOGS_DIR / f'ffmpeg-{stream_id}.log', 'w')
+            port = self.get_devtools_port(display)
+            if not self._wait_until(lambda: self._page_target(port) is not None,
+                                    self.get_stage_timeout('browser'), proc=browser_proc, interval=0.1):
+                raise RuntimeError("DevTools do navegador não respondeu")
+        except Exception:
+            self._terminate_processes([proc for proc in (xvfb_proc, browser_proc) if proc])
+            if profile_dir:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        logger.info(f"Slot aquecido pronto no display :{display}")
+        return {'display': display, 'xvfb': xvfb_proc, 'browser': browser_proc, 'profile_dir': profile_dir}
+
+    def _adopt_warm_slot(self, stream_id, job_id, stream, slot):
+        """Assume um slot do pool para o stream e navega até a URL; retorna o display"""
+        display = slot['display']
+        procs = {'xvfb': slot['xvfb'], 'browser': slot['browser']}
+        with self.lock:
+            adopted = self._is_current_job(stream_id, job_id)
+            if adopted:
+                self.status[stream_id]['display'] = display
+                self.processes[stream_id].update(procs)
+                for name, proc in procs.items():
+                    self.child_watcher.watch(proc, stream_id, name)
+        if not adopted:
+            self._terminate_processes(list(procs.values()))
+            raise StartCancelled(stream_id)
+        self.cgroups.attach(stream_id, procs)
+        self.placer.apply(stream_id, procs)
+
+        stage_start = self._set_stage(stream_id, job_id, 'browser')
+        self._navigate(self.get_devtools_port(display), stream['url'])
+        self._record_latency(stream_id, 'browser', stage_start)
+        logger.info(f"[{stream_id}] Slot aquecido do display :{display} assumido")
+        return display
+
+    def _spawn_ffmpeg(self, stream_id, stream, display, respawn=False):
+        """Lança o FFmpeg capturando o display; retorna (processo, arquivo de log)"""
+        hls_stream_dir = HLS_DIR / stream_id
+        profile = self.get_encoder_profile(stream.get('encoder_profile'))
+        ffmpeg_cmd = self._build_ffmpeg_command(stream, display, hls_stream_dir, respawn)
+
+        # Criar diretório HLS para este stream (no tmpfs, se houver espaço)
+        if self.hls_store.storage(stream_id) is None or not hls_stream_dir.exists():
+            self.hls_store.allocate(stream_id, self._estimate_hls_bytes(stream, profile))
+        os.chmod(hls_stream_dir, 0o755)
+        for rendition in self._select_renditions(profile, stream):
+            (hls_stream_dir / f"{rendition['height']}p").mkdir(exist_ok=True)
+        if profile['low_latency']:
+            self.ll_packager.add(stream_id, hls_stream_dir, profile)
+
+        # Preservar o log da execução que caiu ao relançar só o FFmpeg
+        ffmpeg_log = open(LOGS_DIR / f'ffmpeg-{stream_id}.log', 'a' if respawn else 'w')
+        try:
             ffmpeg_proc = subprocess.Popen(
-                ffmpeg_cmd,
+                self._command(stream_id, 'ffmpeg', ffmpeg_cmd),
                 env={**os.environ, 'DISPLAY': f':{display}'},
                 stdout=ffmpeg_log,
                 stderr=ffmpeg_log,
                 stdin=subprocess.DEVNULL,
                 start_new_session=True
             )
-            self.processes[stream_id]['ffmpeg'] = ffmpeg_proc
-            self.processes[stream_id]['ffmpeg_log'] = ffmpeg_log
+        except Exception:
+            ffmpeg_log.close()
+            raise
+        return ffmpeg_proc, ffmpeg_log
+
+    def _build_ffmpeg_command(self, stream, display, hls_stream_dir, respawn=False):
+        """Monta a linha de comando do FFmpeg a partir do perfil de encoder do stream"""
+        profile = self.get_encoder_profile(stream.get('encoder_profile'))
+        # Nomes de segmento únicos por execução: caches podem tratá-los como imutáveis
+        run_id = uuid.uuid4().hex[:6]
+        cmd = [
+            'ffmpeg',
+            '-y',
+            '-f', 'x11grab',
+            '-framerate', str(profile['fps']),
+            '-video_size', stream.get('resolution', '1280x720'),
+            '-i', f':{display}',
+            '-c:v', 'libx264',
+            '-preset', profile['preset']
+        ]
+        if profile['tune']:
+            cmd += ['-tune', profile['tune']]
+        renditions = self._select_renditions(profile, stream)
+        if renditions:
+            # Uma captura decodificada uma vez, dividida e reescalada para cada encoder;
+            # a rendition na altura capturada sai do split sem passar pelo scale
+            capture_height = int(stream.get('resolution', '1280x720').split('x')[1])
+            native = [r['height'] == capture_height for r in renditions]
+            split = ''.join(f'[v{i}]' if native[i] else f'[s{i}]' for i in range(len(renditions)))
+            graph = [f'[0:v]split={len(renditions)}{split}']
+            for i, rendition in enumerate(renditions):
+                if not native[i]:
+                    graph.append(f"[s{i}]scale=-2:{rendition['height']}:flags=fast_bilinear[v{i}]")
+            cmd += ['-filter_complex', ';'.join(graph)]
+            for i, rendition in enumerate(renditions):
+                cmd += ['-map', f'[v{i}]']
+                cmd += self._rate_control(profile, rendition['bitrate'], f':v:{i}')
+        else:
+            cmd += self._rate_control(profile, profile['bitrate'])
+        cmd += [
+            '-pix_fmt', profile['pix_fmt'],
+            '-g', str(profile['gop']),
+            '-keyint_min', str(profile['gop']),
+            '-sc_threshold', '0',
+            '-threads', str(profile['threads'])
+        ]
+
+        # No respawn, append_list continua a numeração e discont_start marca a emenda;
+        # temp_file grava playlists e segmentos em .tmp e renomeia só quando completos
+        lazy = bool(stream.get('lazy'))
+        hls_flags = 'delete_segments+append_list+temp_file' + ('+discont_start' if respawn or lazy else '')
+        if profile['low_latency']:
+            # O FFmpeg corta partes fMP4 curtas (sem esperar keyframe); o LowLatencyPackager
+            # agrupa as partes em segmentos e publica o index.m3u8 com EXT-X-PART
+            parts_per_segment = int(profile['hls_time'] / profile['part_duration']) + 1
+            cmd += [
+                '-f', 'hls',
+                '-hls_time', str(profile['part_duration']),
+                '-hls_list_size', str(4 * parts_per_segment),
+                '-hls_segment_type', 'fmp4',
+                '-hls_fmp4_init_filename', 'init.mp4',
+                '-hls_flags', hls_flags + '+split_by_time',
+                '-hls_segment_filename', f'{hls_stream_dir}/part_{run_id}_%05d.m4s',
+                f'{hls_stream_dir}/{LL_PARTS_PLAYLIST}'
+            ]
+            return cmd
+        cmd += [
+            '-f', 'hls',
+            '-hls_time', str(profile['hls_time']),
+            '-hls_list_size', str(profile['hls_list_size']),
+            '-hls_flags', hls_flags
+        ]
+        if lazy:
+            # Continua depois das sequências do placeholder, sem retroceder no player
+            cmd += ['-start_number', str(LAZY_START_NUMBER)]
+        if renditions:
+            # %v vira o nome da rendition: <id>/720p/index.m3u8, mais o master.m3u8
+            cmd += [
+                '-var_stream_map', ' '.join(f"v:{i},name:{r['height']}p" for i, r in enumerate(renditions)),
+                '-master_pl_name', 'master.m3u8',
+                '-hls_segment_filename', f'{hls_stream_dir}/%v/segment_{run_id}_%03d.ts',
+                f'{hls_stream_dir}/%v/index.m3u8'
+            ]
+        else:
+            cmd += [
+                '-hls_segment_filename', f'{hls_stream_dir}/segment_{run_id}_%03d.ts',
+                f'{hls_stream_dir}/index.m3u8'
+            ]
+        return cmd
+
+    @staticmethod
+    def _rate_control(profile, bitrate, suffix=''):
+        """Opções de taxa de um encoder; suffix seleciona o stream de saída (":v:1")"""
+        if profile['crf'] is not None:
+            # Qualidade constante; bitrate, se houver, só limita os picos
+            options = [f'-crf{suffix}', str(profile['crf'])]
+            if bitrate:
+                options += [f'-maxrate{suffix}', bitrate, f'-bufsize{suffix}', bitrate]
+            return options
+        return [f'-b{suffix or ":v"}', bitrate, f'-maxrate{suffix}', bitrate,
+                f'-bufsize{suffix}', StreamManager._double_rate(bitrate)]
+
+    @staticmethod
+    def _select_renditions(profile, stream):
+        """Renditions até a altura capturada (sem upscale), da maior para a menor"""
+        if not profile['renditions']:
+            return []
+        height = int(stream.get('resolution', '1280x720').split('x')[1])
+        renditions = sorted(profile['renditions'], key=lambda r: r['height'], reverse=True)
+        return [r for r in renditions if r['height'] <= height] or renditions[-1:]
+
+    def get_playlist_name(self, stream):
+        """Playlist de entrada do stream: master.m3u8 no modo ABR, index.m3u8 caso contrário"""
+        try:
+            profile = self.get_encoder_profile(stream.get('encoder_profile'))
+        except ValueError:
+            return 'index.m3u8'
+        return 'master.m3u8' if profile['renditions'] else 'index.m3u8'
+
+    def _estimate_hls_bytes(self, stream, profile):
+        """Cota de armazenamento HLS do stream: janela da playlist no bitrate máximo, com folga"""
+        if stream.get('hls_quota_mb'):
+            return int(stream['hls_quota_mb'] * 1024 * 1024)
+        rates = [r['bitrate'] for r in self._select_renditions(profile, stream)] or [profile['bitrate']]
+        if None in rates:
+            return self.hls_store.config['stream_quota_mb'] * 1024 * 1024
+        bits_per_second = sum(self._rate_bps(rate) for rate in rates)
+        # Lista + limiar de remoção do FFmpeg + segmento em gravação
+        window = profile['hls_time'] * (profile['hls_list_size'] + 3)
+        if profile['low_latency']:
+            window *= 2  # Partes e segmentos concatenados coexistem
+        return int(bits_per_second / 8 * window * 1.5)
+
+    @staticmethod
+    def _rate_bps(rate):
+        """"1500k" -> 1500000"""
+        number, unit = re.fullmatch(r'(\d+(?:\.\d+)?)([kM]?)', str(rate)).groups()
+        return float(number) * {'': 1, 'k': 1e3, 'M': 1e6}[unit]
+
+    @staticmethod
+    def _double_rate(rate):
+        """Buffer do VBV com o dobro do bitrate: "1500k" -> "3000k\""""
+        number, unit = re.fullmatch(r'(\d+(?:\.\d+)?)([kM]?)', str(rate)).groups()
+        return f'{float(number) * 2:g}{unit}'
+
+    def _run_start_pipeline(self, stream_id, job_id, stream, display, queued_at):
+        """Executa os estágios Xvfb -> áudio -> navegador -> FFmpeg em segundo plano"""
+        restart = self.jobs[job_id]['restart']
+        try:
+            self._await_admission(stream_id, job_id)
+            self._record_latency(stream_id, 'queue', queued_at)
+            pipeline_start = time.monotonic()
+
+            # 1. Iniciar Xvfb (display virtual)
+            stage_start = self._set_stage(stream_id, job_id, 'xvfb')
+            with self.lock:
+                if not self._is_current_job(stream_id, job_id):
+                    raise StartCancelled(stream_id)
+                self.placer.assign(stream_id, stream.get('cpu_cores'))
+            self.cgroups.prepare(stream_id, stream)
+            self.placer.apply(stream_id, {})
+
+            # Slot pré-aquecido: Xvfb e navegador já de pé, só falta navegar e capturar
+            slot = self.warm_pool.claim(stream_id, stream.get('resolution', '1280x720')) \
+                if stream.get('warm_start') else None
+            if slot:
+                display = self._adopt_warm_slot(stream_id, job_id, stream, slot)
+            else:
+                self._launch_stack(stream_id, job_id, stream, display, stage_start)
+
+            # 4. Iniciar FFmpeg para capturar e gerar HLS diretamente
+            stage_start = self._set_stage(stream_id, job_id, 'ffmpeg')
+            hls_stream_dir = HLS_DIR / stream_id
+            ffmpeg_proc, ffmpeg_log = self._spawn_ffmpeg(stream_id, stream, display)
+            try:
+                self._register_process(stream_id, job_id, 'ffmpeg', ffmpeg_proc)
+            finally:
+                with self.lock:
+                    if self.processes.get(stream_id, {}).get('ffmpeg') is ffmpeg_proc:
+                        self.processes[stream_id]['ffmpeg_log'] = ffmpeg_log
+                    else:
+                        ffmpeg_log.close()
             logger.info(f"[{stream_id}] FFmpeg iniciado")
 
-            self.status[stream_id]['state'] = 'running'
+            # Pronto quando a primeira playlist for publicada
+            playlist = hls_stream_dir / self.get_playlist_name(stream)
+            ready = self._wait_until(playlist.exists, self.get_stage_timeout('ffmpeg'),
+                                     proc=ffmpeg_proc, interval=0.1)
+            if ffmpeg_proc.poll() is not None:
+                raise RuntimeError(f"FFmpeg encerrou (código {ffmpeg_proc.returncode})")
+            self._record_latency(stream_id, 'ffmpeg', stage_start, ready)
+
+            with self.lock:
+                if not self._is_current_job(stream_id, job_id):
+                    raise StartCancelled(stream_id)
+                self.status[stream_id]['state'] = 'running'
+                self.status[stream_id]['stage'] = None
+                self.status[stream_id]['start_latency_ms'] = int((time.monotonic() - pipeline_start) * 1000)
+                self._finish_job(job_id, 'done')
+                procs = dict(self.processes[stream_id])
             self.emit_status_update()
 
-            return True, "Stream iniciado com sucesso"
+            # Saídas durante o start foram ignoradas pelo watcher; conferir agora
+            for name in STACK_PROCESSES:
+                if procs[name].poll() is not None:
+                    self._on_child_exit(procs[name], stream_id, name)
+                    break
+
+        except StartCancelled:
+            logger.info(f"[{stream_id}] Inicialização cancelada")
+            self._finish_job(job_id, 'cancelled')
+            # stop_stream pode ter liberado os recursos antes do pipeline recriá-los
+            # (cgroup, reserva no tmpfs, empacotador LL); sem outro job no stream, liberar de novo
+            with self.lock:
+                orphaned = stream_id not in self.processes
+            if orphaned:
+                self._release_stream_resources(stream_id, {})
 
         except Exception as e:
             logger.error(f"Erro ao iniciar stream {stream_id}: {e}")
-            self.stop_stream(stream_id)
-            return False, str(e)
+            self._finish_job(job_id, 'failed', str(e))
+            self.last_errors[stream_id] = str(e)
+            if self._is_current_job(stream_id, job_id):
+                self.stop_stream(stream_id)
+                # Falha num reinício automático conta para o backoff
+                if restart:
+                    self._schedule_restart(stream_id, str(e))
+
+    def _launch_stack(self, stream_id, job_id, stream, display, stage_start):
+        """Estágios a frio: Xvfb, PulseAudio e navegador abrindo a URL do stream"""
+        width, height = stream.get('resolution', '1280x720').split('x')
+        ready_r, ready_w = os.pipe()
+        try:
+            xvfb_proc = subprocess.Popen(
+                self._command(stream_id, 'xvfb', self._xvfb_command(display, width, height, ready_w)),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                stdin=subprocess.DEVNULL,
+                pass_fds=(ready_w,),
+                start_new_session=True
+            )
+        finally:
+            os.close(ready_w)
+        try:
+            self._register_process(stream_id, job_id, 'xvfb', xvfb_proc)
+            ready = self._wait_xvfb_ready(display, ready_r, self.get_stage_timeout('xvfb'), xvfb_proc)
+        finally:
+            os.close(ready_r)
+        if not ready:
+            raise RuntimeError(f"Xvfb não ficou pronto no display :{display}")
+        self._record_latency(stream_id, 'xvfb', stage_start)
+        logger.info(f"[{stream_id}] Xvfb iniciado no display :{display}")
+
+        # 2. Iniciar PulseAudio virtual
+        stage_start = self._set_stage(stream_id, job_id, 'audio')
+        self._start_audio(display)
+        self._record_latency(stream_id, 'audio', stage_start)
+
+        # 3. Iniciar navegador
+        stage_start = self._set_stage(stream_id, job_id, 'browser')
+        browser_proc = self._spawn_browser(stream_id, stream, display)
+        self._register_process(stream_id, job_id, 'browser', browser_proc)
+        ready = self._wait_browser_ready(self.get_devtools_port(display),
+                                         self.get_stage_timeout('browser'), browser_proc)
+        if browser_proc.poll() is not None:
+            raise RuntimeError("Navegador encerrou durante a inicialização")
+        # Página lenta não impede a captura: seguir e registrar o timeout
+        self._record_latency(stream_id, 'browser', stage_start, ready)
+        logger.info(f"[{stream_id}] Browser iniciado")
 
     def stop_stream(self, stream_id):
         """Para um stream"""
-        if stream_id not in self.processes:
+        cancelled = self._cancel_pending_restart(stream_id)
+        with self.lock:
+            running = stream_id in self.processes
+            if running:
+                # Retirar do estado antes de encerrar, cancelando um pipeline em andamento
+                procs = self.processes.pop(stream_id)
+                self.status.pop(stream_id, None)
+
+        if not running:
+            if cancelled:
+                self.emit_status_update()
+                return True, "Reinício agendado cancelado"
             return False, "Stream não está rodando"
 
         try:
-            procs = self.processes.get(stream_id, {})
-
-            # Parar na ordem inversa
-            for proc_name in ['ffmpeg', 'browser', 'xvfb']:
-                proc = procs.get(proc_name)
-                if proc and proc.poll() is None:
-                    proc.terminate()
-                    try:
-                        proc.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                        proc.kill()
-                    logger.info(f"[{stream_id}] {proc_name} parado")
-
-            # Fechar log do ffmpeg
-            if 'ffmpeg_log' in procs:
-                procs['ffmpeg_log'].close()
-
-            # Limpar
-            del self.processes[stream_id]
-            if stream_id in self.status:
-                del self.status[stream_id]
-
-            # Limpar arquivos HLS
-            hls_stream_dir = HLS_DIR / stream_id
-            if hls_stream_dir.exists():
-                import shutil
-                shutil.rmtree(hls_stream_dir, ignore_errors=True)
+            self._terminate_processes([procs[name] for name in PROCESS_NAMES if name in procs])
+            logger.info(f"[{stream_id}] Processos parados")
+            self._release_stream_resources(stream_id, procs)
+            self._rebalance_placement()
 
             self.emit_status_update()
             return True, "Stream parado com sucesso"
@@ -269,6 +2596,230 @@ class StreamManager:
             logger.error(f"Erro ao parar stream {stream_id}: {e}")
             return False, str(e)
 
+    def stop_all(self):
+        """Para todos os streams de uma vez, com um único prazo para todos os processos"""
+        self.warm_pool.shutdown()
+        with self.lock:
+            detached = dict(self.processes)
+            self.processes.clear()
+            self.status.clear()
+
+        self._terminate_processes([
+            procs[name] for procs in detached.values() for name in PROCESS_NAMES if name in procs
+        ])
+        for stream_id, procs in detached.items():
+            self._release_stream_resources(stream_id, procs)
+        logger.info(f"{len(detached)} streams parados")
+
+    def _release_stream_resources(self, stream_id, procs):
+        """Fecha o log do FFmpeg, remove o cgroup e agenda a remoção do diretório HLS"""
+        if 'ffmpeg_log' in procs:
+            procs['ffmpeg_log'].close()
+        self.cgroups.release(stream_id)
+        self.placer.release(stream_id)
+        self.warm_pool.release(stream_id)
+        self.ll_packager.remove(stream_id)
+
+        self.hls_store.release(stream_id)
+        self.hls_origin.drop(stream_id)
+        self.playlist_validator.forget(str(HLS_DIR / stream_id) + '/')
+        self.playlist_errors.pop(stream_id, None)
+
+    def _rebalance_placement(self):
+        """Núcleos liberados: streams que dividiam núcleos migram para os livres"""
+        for stream_id in self.placer.rebalance():
+            with self.lock:
+                procs = {name: proc for name, proc in self.processes.get(stream_id, {}).items()
+                         if name in PROCESS_NAMES}
+            self.placer.apply(stream_id, procs)
+            assignment = self.placer.assignments.get(stream_id, {})
+            logger.info(f"[{stream_id}] Realocado: encoder em {assignment.get('encoder')}, "
+                        f"navegador em {assignment.get('browser')}")
+
+    def _terminate_processes(self, procs, timeout=STOP_TIMEOUT):
+        """Sinaliza todos os grupos de processos de uma vez e aguarda com um prazo único"""
+        alive = [proc for proc in procs if proc.poll() is None]
+        for proc in alive:
+            self._signal_process_group(proc, signal.SIGTERM)
+
+        deadline = time.monotonic() + timeout
+        while alive and time.monotonic() < deadline:
+            time.sleep(0.05)
+            alive = [proc for proc in alive if proc.poll() is None]
+
+        for proc in alive:
+            logger.warning(f"Processo {proc.pid} não encerrou em {timeout}s, enviando SIGKILL")
+            self._signal_process_group(proc, signal.SIGKILL)
+        for proc in alive:
+            try:
+                proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                logger.error(f"Processo {proc.pid} não respondeu ao SIGKILL")
+
+    @staticmethod
+    def _signal_process_group(proc, sig):
+        """Envia um sinal ao grupo do processo (inclui filhos como renderers do Chromium)"""
+        try:
+            # Processos iniciados com start_new_session=True lideram o próprio grupo
+            if os.getpgid(proc.pid) == proc.pid:
+                os.killpg(proc.pid, sig)
+            else:
+                proc.send_signal(sig)
+        except ProcessLookupError:
+            pass
+
+    def _on_child_exit(self, proc, stream_id, name):
+        """Chamado pelo ChildWatcher quando um processo de um stream encerra"""
+        with self.lock:
+            procs = self.processes.get(stream_id, {})
+            # Parada intencional ou processo já substituído
+            if procs.get(name) is not proc:
+                return
+            # Falhas durante a inicialização são tratadas pelo próprio pipeline
+            state = self.status.get(stream_id, {}).get('state')
+            if state not in ('running', 'recovering'):
+                return
+
+            reason = f"{name} encerrou (código {proc.returncode})"
+            logger.warning(f"[{stream_id}] {reason}")
+
+            # FFmpeg e navegador são relançados sozinhos enquanto o resto da pilha
+            # estiver de pé; queda do Xvfb (ou de um segundo componente) reinicia tudo
+            others_alive = all(procs[n].poll() is None for n in STACK_PROCESSES if n != name)
+            if name in COMPONENT_RESTARTABLE and state == 'running' and others_alive:
+                self.status[stream_id]['state'] = 'recovering'
+                self._schedule_restart(stream_id, reason, component=name)
+                return
+
+            self._cancel_pending_restart(stream_id)
+            self.status[stream_id]['state'] = 'restarting'
+
+        self.stop_pool.submit(self._handle_failure, stream_id, reason)
+
+    def _handle_failure(self, stream_id, reason):
+        """Derruba o stream com falha e agenda o reinício conforme a política"""
+        self.stop_stream(stream_id)
+        self._schedule_restart(stream_id, reason)
+
+    def get_restart_policy(self, stream_id):
+        """Política de reinício do stream (criada sob demanda)"""
+        with self.lock:
+            if stream_id not in self.restart_policies:
+                self.restart_policies[stream_id] = RestartPolicy(
+                    self.server_config.get('restart_policy', {}))
+            return self.restart_policies[stream_id]
+
+    def _schedule_restart(self, stream_id, reason, component=None):
+        """Agenda um reinício (do stream ou de um componente) com backoff, ou abre o disjuntor"""
+        with self.lock:
+            if stream_id not in self.streams:
+                return
+            policy = self.get_restart_policy(stream_id)
+            delay = policy.record_failure()
+            if delay is None:
+                self.last_errors[stream_id] = (
+                    f"Crash-loop: {len(policy.failures)} falhas em {policy.config['window']}s "
+                    f"(última: {reason})"
+                )
+                logger.error(f"[{stream_id}] Em crash-loop, reinícios automáticos suspensos")
+                if component:
+                    # Pilha ainda de pé: derrubá-la fora da thread do watcher
+                    self.stop_pool.submit(self.stop_stream, stream_id)
+            else:
+                timer = threading.Timer(delay, self._run_scheduled_restart, args=(stream_id, component))
+                timer.daemon = True
+                next_restart_at = datetime.fromtimestamp(time.time() + delay).isoformat()
+                self.pending_restarts[stream_id] = (timer, next_restart_at, component)
+                timer.start()
+                logger.warning(f"[{stream_id}] Reinício de {component or 'stream'} em {delay:.1f}s "
+                               f"(falha {policy.consecutive})")
+        self.emit_status_update()
+
+    def _run_scheduled_restart(self, stream_id, component=None):
+        """Executado pelo Timer: reinicia o stream ou componente se não foi cancelado"""
+        with self.lock:
+            if self.pending_restarts.pop(stream_id, None) is None:
+                return
+        if component:
+            self._restart_component(stream_id, component)
+        else:
+            self.start_stream(stream_id, restart=True)
+
+    def _restart_component(self, stream_id, name):
+        """Relança só o FFmpeg ou só o navegador, mantendo o restante da pilha"""
+        with self.lock:
+            procs = self.processes.get(stream_id)
+            if procs is None or self.status.get(stream_id, {}).get('state') != 'recovering':
+                return
+            stream = self.streams[stream_id]
+            display = self.status[stream_id]['display']
+
+        started = time.monotonic()
+        log_file = None
+        try:
+            if name == 'ffmpeg':
+                proc, log_file = self._spawn_ffmpeg(stream_id, stream, display, respawn=True)
+            else:
+                proc = self._spawn_browser(stream_id, stream, display)
+                self._wait_browser_ready(self.get_devtools_port(display),
+                                         self.get_stage_timeout('browser'), proc)
+                if proc.poll() is not None:
+                    raise RuntimeError("Navegador encerrou ao ser relançado")
+        except Exception as e:
+            logger.error(f"[{stream_id}] Falha ao relançar {name}: {e}")
+            with self.lock:
+                if self.processes.get(stream_id) is not procs:
+                    return
+                self.status[stream_id]['state'] = 'restarting'
+            self._handle_failure(stream_id, f"relançamento de {name} falhou: {e}")
+            return
+
+        with self.lock:
+            # Stream parado (ou reiniciado por inteiro) enquanto o componente subia
+            if self.processes.get(stream_id) is not procs or \
+                    self.status.get(stream_id, {}).get('state') != 'recovering':
+                stale = True
+            else:
+                stale = False
+                procs[name] = proc
+                if log_file:
+                    old_log = procs.get('ffmpeg_log')
+                    procs['ffmpeg_log'] = log_file
+                    if old_log:
+                        old_log.close()
+                self.child_watcher.watch(proc, stream_id, name)
+                self.status[stream_id]['state'] = 'running'
+                self.status[stream_id].setdefault('component_restarts', {})
+                self.status[stream_id]['component_restarts'][name] = \
+                    self.status[stream_id]['component_restarts'].get(name, 0) + 1
+
+        if stale:
+            self._terminate_processes([proc])
+            if log_file:
+                log_file.close()
+            return
+
+        logger.info(f"[{stream_id}] {name} relançado em {int((time.monotonic() - started) * 1000)} ms")
+        self.emit_status_update()
+
+    def _cancel_pending_restart(self, stream_id):
+        """Cancela um reinício agendado; retorna True se havia um"""
+        with self.lock:
+            pending = self.pending_restarts.pop(stream_id, None)
+        if pending:
+            pending[0].cancel()
+            return True
+        return False
+
+    def _reaper_loop(self):
+        """Remove em segundo plano os diretórios HLS de streams parados"""
+        while True:
+            path = self.reaper_queue.get()
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            except Exception as e:
+                logger.error(f"Erro ao remover {path}: {e}")
+
     def start_vnc(self, stream_id):
         """Inicia VNC para configurar login"""
         if stream_id not in self.processes:
@@ -290,9 +2841,10 @@ class StreamManager:
                 '-shared'
             ]
             vnc_proc = subprocess.Popen(
-                vnc_cmd,
+                self._command(stream_id, 'vnc', vnc_cmd),
                 stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
+                stderr=subprocess.DEVNULL,
+                start_new_session=True
             )
             self.processes[stream_id]['vnc'] = vnc_proc
             logger.info(f"[{stream_id}] VNC iniciado na porta {vnc_port}")
@@ -316,32 +2868,329 @@ class StreamManager:
         for stream_id, stream in self.streams.items():
             is_running = stream_id in self.processes
             status = self.status.get(stream_id, {})
+            policy = self.restart_policies.get(stream_id)
+            pending = self.pending_restarts.get(stream_id)
+
+            if is_running:
+                state = status.get('state', 'running')
+            elif pending:
+                state = 'restarting'
+            elif policy and policy.crash_looping:
+                state = 'crash_loop'
+            else:
+                state = 'stopped'
 
             result[stream_id] = {
                 **stream,
                 'running': is_running,
-                'state': status.get('state', 'stopped'),
+                'state': state,
+                'restart_count': len(policy.failures) if policy else 0,
+                'next_restart_at': pending[1] if pending else None,
+                'stage': status.get('stage'),
+                'job_id': status.get('job_id'),
+                'last_error': self.last_errors.get(stream_id),
+                'stage_latency_ms': status.get('stage_latency_ms', {}),
+                'start_latency_ms': status.get('start_latency_ms'),
+                'readiness_timeouts': status.get('readiness_timeouts', []),
+                'component_restarts': status.get('component_restarts', {}),
                 'started_at': status.get('started_at'),
                 'display': status.get('display'),
-                'hls_url': f'/hls/{stream_id}/index.m3u8' if is_running else None,
+                'numa_node': self.placer.assignments.get(stream_id, {}).get('node') if is_running else None,
+                'hls_storage': self.hls_store.storage(stream_id),
+                'playlist_errors': self.playlist_errors.get(stream_id, []) if is_running else [],
+                'hls_url': f'/hls/{stream_id}/{self.get_playlist_name(stream)}'
+                if is_running or stream.get('lazy') else None,
                 'rtmp_url': f'rtmp://{{server}}:1935/live/{stream_id}' if is_running else None,
                 'vnc_active': 'vnc' in self.processes.get(stream_id, {})
             }
         return result
 
+    def get_streams_overview(self):
+        """Status de todos os streams com o consumo da última amostra (resposta de /api/streams)"""
+        with self.lock:
+            result = copy.deepcopy(self.get_all_status())
+        usage = self.get_stream_usage()
+        for stream_id, status in result.items():
+            status['resources'] = usage.get(stream_id)
+        return result
+
+    def get_stream_usage(self):
+        """CPU, memória e I/O agregados de cada stream em execução (sem o detalhe por componente)"""
+        return {sid: {k: v for k, v in usage.items() if k not in ('components', 'cgroup')}
+                for sid, usage in self.resources.items() if sid in self.processes}
+
     def emit_status_update(self):
-        """Envia atualização de status via WebSocket"""
-        socketio.emit('status_update', self.get_all_status())
+        """Publica via WebSocket apenas os campos que mudaram desde a última revisão"""
+        with self._publish_lock:
+            patch = self._publish()
+        if patch:
+            socketio.emit('status_patch', patch)
+
+    def _publish(self):
+        """Compara o status atual com o publicado e gera um patch (ou None sem mudanças)"""
+        # Sob self.lock: sampler, ChildWatcher, timers e pools alteram esses dicts concorrentemente
+        with self.lock:
+            current = copy.deepcopy(self.get_all_status())
+        changes = {}
+        for stream_id, snapshot in current.items():
+            _, previous = self._published.get(stream_id, (0, {}))
+            delta = {k: v for k, v in snapshot.items() if previous.get(k, object()) != v}
+            delta.update({k: None for k in previous if k not in snapshot})
+            if delta:
+                changes[stream_id] = delta
+        removed = [sid for sid in self._published if sid not in current]
+
+        if not changes and not removed:
+            return None
+
+        base_rev = self.revision
+        self.revision += 1
+        for stream_id in changes:
+            self._published[stream_id] = (self.revision, current[stream_id])
+            self._tombstones.pop(stream_id, None)
+        for stream_id in removed:
+            del self._published[stream_id]
+            self._tombstones[stream_id] = self.revision
+        while len(self._tombstones) > MAX_TOMBSTONES:
+            oldest = min(self._tombstones, key=self._tombstones.get)
+            self._tombstone_floor = self._tombstones.pop(oldest)
+
+        return {'epoch': self.epoch, 'base_rev': base_rev, 'rev': self.revision,
+                'streams': changes, 'removed': removed}
+
+    def get_status_since(self, rev, epoch=None):
+        """Resync: ('status_patch', patch) desde a revisão do cliente ou ('status_snapshot', tudo)"""
+        with self._publish_lock:
+            self._publish()
+            if epoch != self.epoch or rev <= 0 or rev < self._tombstone_floor or rev > self.revision:
+                return 'status_snapshot', {
+                    'epoch': self.epoch,
+                    'rev': self.revision,
+                    'streams': {sid: snap for sid, (_, snap) in self._published.items()}
+                }
+            return 'status_patch', {
+                'epoch': self.epoch,
+                'base_rev': rev,
+                'rev': self.revision,
+                'streams': {sid: snap for sid, (srev, snap) in self._published.items() if srev > rev},
+                'removed': [sid for sid, trev in self._tombstones.items() if trev > rev]
+            }
 
-    def get_system_stats(self):
-        """Retorna estatísticas do sistema"""
-        return {
-            'cpu_percent': psutil.cpu_percent(interval=1),
+    def get_system_stats(self, history_seconds=0):
+        """Última amostra do sistema (sem bloquear) e, opcionalmente, o histórico"""
+        stats = {
+            'cpu_percent': 0.0,
             'memory_percent': psutil.virtual_memory().percent,
-            'disk_percent': psutil.disk_usage('/').percent,
+            'disk_percent': 0.0,
+            **(self.sampler.latest() or {}),
             'active_streams': len(self.processes),
-            'total_streams': len(self.streams)
+            'total_streams': len(self.streams),
+            'hls_store': self.hls_store.snapshot(),
+            'hls_origin': self.hls_origin.snapshot(),
+            'warm_pool': self.warm_pool.snapshot(),
+            # Consumo por stream vai com a amostra, fora do status revisionado (que só muda com o estado)
+            'stream_resources': self.get_stream_usage()
         }
+        if history_seconds:
+            stats['history'] = self.sampler.history(history_seconds)
+        return stats
+
+    def _on_system_sample(self, sample):
+        """A cada amostra do sistema, mede os streams e envia tudo aos dashboards"""
+        with self.lock:
+            processes = {
+                sid: {name: procs[name] for name in PROCESS_NAMES if name in procs}
+                for sid, procs in self.processes.items()
+            }
+        resources = self.resource_tracker.sample(processes)
+        # Com cgroups, o consumo agregado do kernel inclui processos que escaparam da árvore
+        for stream_id, usage in self.cgroups.sample_usage(list(resources)).items():
+            resources[stream_id]['cgroup'] = usage
+        self.resources = resources
+        self.hls_store.monitor()
+        self._validate_playlists()
+        self._stop_idle_streams()
+        socketio.emit('system_stats', self.get_system_stats())
+        self.emit_status_update()
+
+    def _validate_playlists(self):
+        """Valida a playlist publicada de cada stream em execução e registra mudanças"""
+        with self.lock:
+            running = [sid for sid, status in self.status.items() if status.get('state') == 'running']
+        for stream_id in running:
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                continue
+            errors = self.validate_playlist(stream_id)
+            previous = self.playlist_errors.get(stream_id, [])
+            if errors and errors != previous:
+                logger.warning(f"[{stream_id}] Playlist inconsistente: {'; '.join(errors)}")
+            elif previous and not errors:
+                logger.info(f"[{stream_id}] Playlist consistente novamente")
+            self.playlist_errors[stream_id] = errors
+
+    def validate_playlist(self, stream_id):
+        """Problemas na playlist publicada de um stream (lista vazia = consistente)"""
+        playlist = HLS_DIR / stream_id / self.get_playlist_name(self.streams[stream_id])
+        return self.playlist_validator.validate(playlist)
+
+    def record_view(self, stream_id):
+        """Pedido de playlist de um espectador: renova o prazo e inicia streams lazy parados"""
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            return
+        self.last_viewed[stream_id] = time.monotonic()
+        if not stream.get('lazy') or stream_id in self.processes or stream_id in self.pending_restarts:
+            return
+        self._request_placeholder()
+        policy = self.restart_policies.get(stream_id)
+        if policy and policy.crash_looping:
+            return  # Não rearmar o disjuntor a cada espectador
+        success, _, job_id = self.start_stream(stream_id)
+        if success:
+            self.lazy_started[stream_id] = time.monotonic()
+            logger.info(f"[{stream_id}] Iniciado sob demanda (job {job_id})")
+
+    def is_lazy_pending(self, stream_id):
+        """Stream lazy com espectador aguardando e playlist real ainda não publicada
+
+        Só parado ou em 'starting': em 'recovering' um componente é relançado e a playlist
+        real continua válida (o placeholder faria a sequência retroceder no player).
+        """
+        stream = self.streams.get(stream_id, {})
+        if not stream.get('lazy'):
+            return False
+        return stream_id not in self.processes or self.status.get(stream_id, {}).get('state') == 'starting'
+
+    def lazy_failure(self, stream_id):
+        """Motivo pelo qual um stream lazy parado não vai iniciar (disjuntor aberto), ou None"""
+        stream = self.streams.get(stream_id, {})
+        policy = self.restart_policies.get(stream_id)
+        if not stream.get('lazy') or stream_id in self.processes or not (policy and policy.crash_looping):
+            return None
+        error = self.last_errors.get(stream_id)
+        return f"Stream em crash_loop{': ' + error if error else ''}"
+
+    def placeholder_playlist(self, stream_id):
+        """Playlist ao vivo com a tela preta, enquanto o stream lazy inicia (None se indisponível)"""
+        stream = self.streams[stream_id]
+        if not self.placeholder_path.exists() or self.get_playlist_name(stream) != 'index.m3u8':
+            return None
+        try:
+            if self.get_encoder_profile(stream.get('encoder_profile'))['low_latency']:
+                return None
+        except ValueError:
+            return None
+        # Uma "nova" tela por período, com timestamps contínuos (ver placeholder_segment);
+        # a sequência real começa em LAZY_START_NUMBER, após o EXT-X-DISCONTINUITY do discont_start
+        elapsed = time.monotonic() - self.lazy_started.get(stream_id, time.monotonic())
+        sequence = min(int(elapsed / PLACEHOLDER_DURATION), LAZY_START_NUMBER - 1)
+        return '\n'.join([
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{PLACEHOLDER_DURATION}',
+            f'#EXT-X-MEDIA-SEQUENCE:{sequence}',
+            f'#EXTINF:{PLACEHOLDER_DURATION}.0,',
+            f'{PLACEHOLDER_SEGMENT}?seq={sequence}',
+            ''
+        ])
+
+    def placeholder_segment(self, sequence):
+        """Tela preta da sequência pedida, com PTS/DTS/PCR deslocados para seguir a anterior"""
+        if self._placeholder_data is None:
+            self._placeholder_data = self.placeholder_path.read_bytes()
+        sequence = max(0, min(sequence, LAZY_START_NUMBER - 1))
+        return self._shift_ts_timestamps(self._placeholder_data, sequence * PLACEHOLDER_DURATION * 90000)
+
+    @staticmethod
+    def _shift_ts_timestamps(data, offset):
+        """Soma offset (em unidades de 90 kHz) aos PTS/DTS dos PES e ao PCR de um MPEG-TS"""
+        def shift(buf, pos):
+            b = buf[pos:pos + 5]
+            ts = ((b[0] >> 1) & 0x07) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1
+            ts = (ts + offset) % (1 << 33)
+            buf[pos:pos + 5] = bytes([
+                (b[0] & 0xF0) | ((ts >> 29) & 0x0E) | 1,
+                (ts >> 22) & 0xFF,
+                ((ts >> 14) & 0xFE) | 1,
+                (ts >> 7) & 0xFF,
+                ((ts << 1) & 0xFE) | 1
+            ])
+
+        out = bytearray(data)
+        for start in range(0, len(out) - 187, 188):
+            if out[start] != 0x47:
+                continue
+            pusi = out[start + 1] & 0x40
+            control = (out[start + 3] >> 4) & 0x03
+            payload = start + 4
+            if control & 0x02:
+                length = out[start + 4]
+                if length and out[start + 5] & 0x10:
+                    # PCR: base de 33 bits em 90 kHz, seguida da extensão em 27 MHz
+                    pcr = start + 6
+                    base = out[pcr] << 25 | out[pcr + 1] << 17 | out[pcr + 2] << 9 | out[pcr + 3] << 1 | out[pcr + 4] >> 7
+                    base = (base + offset) % (1 << 33)
+                    out[pcr:pcr + 5] = bytes([(base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF,
+                                              (base >> 1) & 0xFF, ((base & 1) << 7) | (out[pcr + 4] & 0x7F)])
+                payload += 1 + length
+            if not (pusi and control & 0x01) or payload + 19 > start + 188:
+                continue
+            if out[payload:payload + 3] != b'\x00\x00\x01':
+                continue  # PAT/PMT e afins
+            flags = out[payload + 7] >> 6
+            if flags & 0x02:
+                shift(out, payload + 9)
+            if flags == 0x03:
+                shift(out, payload + 14)
+        return bytes(out)
+
+    def _request_placeholder(self):
+        """Gera o placeholder em segundo plano, se ainda não existir"""
+        if self.placeholder_path.exists():
+            return
+        if self._placeholder_thread is None or not self._placeholder_thread.is_alive():
+            self._placeholder_thread = threading.Thread(target=self._ensure_placeholder, daemon=True)
+            self._placeholder_thread.start()
+
+    def _ensure_placeholder(self):
+        """Gera uma vez o segmento de tela preta usado pelos streams lazy"""
+        if self.placeholder_path.exists():
+            return
+        self.placeholder_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.placeholder_path.with_suffix('.tmp.ts')
+        try:
+            subprocess.run([
+                'ffmpeg', '-y', '-loglevel', 'error',
+                '-f', 'lavfi', '-i', f'color=c=black:s=1280x720:r=15:d={PLACEHOLDER_DURATION}',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-g', '30',
+                '-f', 'mpegts', str(tmp_path)
+            ], check=True, capture_output=True, timeout=60)
+            os.replace(tmp_path, self.placeholder_path)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Placeholder dos streams lazy indisponível: {e}")
+
+    def _stop_idle_streams(self):
+        """Para streams lazy sem pedidos de playlist há mais que o idle_timeout"""
+        now = time.monotonic()
+        default_timeout = self.server_config.get('lazy', {}).get('idle_timeout', DEFAULT_LAZY_IDLE_TIMEOUT)
+        with self.lock:
+            running = [sid for sid, status in self.status.items() if status.get('state') == 'running']
+        for stream_id in running:
+            stream = self.streams.get(stream_id, {})
+            if not stream.get('lazy'):
+                continue
+            # Sem registro (ex.: start manual), o prazo conta a partir de agora
+            idle = now - self.last_viewed.setdefault(stream_id, now)
+            if idle > stream.get('idle_timeout', default_timeout):
+                logger.info(f"[{stream_id}] Sem espectadores há {idle:.0f}s, parando")
+                self.last_viewed.pop(stream_id, None)
+                self.lazy_started.pop(stream_id, None)
+                self.stop_pool.submit(self.stop_stream, stream_id)
+
+    def get_stream_resources(self, stream_id):
+        """Consumo detalhado (por componente) de um stream em execução"""
+        return self.resources.get(stream_id)
 
 
 # Instância global
@@ -361,8 +3210,8 @@ def static_files(path):
 
 @app.route('/api/streams', methods=['GET'])
 def get_streams():
-    """Lista todos os streams"""
-    return jsonify(manager.get_all_status())
+    """Lista todos os streams, com o consumo de recursos dos que estão rodando"""
+    return jsonify(manager.get_streams_overview())
 
 
 @app.route('/api/streams', methods=['POST'])
@@ -377,6 +3226,11 @@ def add_stream():
     if data['id'] in manager.streams:
         return jsonify({'error': 'Stream com este ID já existe'}), 400
 
+    try:
+        manager.get_encoder_profile(data.get('encoder_profile'))
+    except ValueError as e:
+        return jsonify({'error': f'Perfil de encoder inválido: {e}'}), 400
+
     stream = {
         'id': data['id'],
         'name': data['name'],
@@ -385,6 +3239,17 @@ def add_stream():
         'resolution': data.get('resolution', '1280x720'),
         'audio': data.get('audio', True)
     }
+    if data.get('encoder_profile'):
+        stream['encoder_profile'] = data['encoder_profile']
+    # Sob demanda: inicia no primeiro pedido de playlist e para após idle_timeout sem espectadores
+    if data.get('warm_start'):
+        stream['warm_start'] = True  # Aceita slot pré-aquecido (sem o perfil persistente do stream)
+    if data.get('lazy'):
+        stream['lazy'] = True
+        if 'idle_timeout' in data:
+            stream['idle_timeout'] = data['idle_timeout']
+    # Cotas de cgroup opcionais (cpu_max, cpu_weight, memory_high, memory_max, io_weight)
+    stream.update({k: data[k] for k in STREAM_LIMIT_FIELDS if k in data})
 
     manager.streams[data['id']] = stream
     manager.save_config()
@@ -402,10 +3267,21 @@ def update_stream(stream_id):
     data = request.json
     stream = manager.streams[stream_id]
 
-    for key in ['name', 'url', 'profile', 'resolution', 'audio']:
+    if 'encoder_profile' in data:
+        try:
+            manager.get_encoder_profile(data['encoder_profile'])
+        except ValueError as e:
+            return jsonify({'error': f'Perfil de encoder inválido: {e}'}), 400
+
+    # Novo perfil de encoder vale a partir do próximo start (ou respawn do FFmpeg)
+    for key in ['name', 'url', 'profile', 'resolution', 'audio', 'encoder_profile', 'lazy', 'idle_timeout', 'warm_start',
+                *STREAM_LIMIT_FIELDS]:
         if key in data:
             stream[key] = data[key]
 
+    if stream_id in manager.processes:
+        manager.cgroups.update_limits(stream_id, stream)
+
     manager.save_config()
     manager.emit_status_update()
 
@@ -418,9 +3294,9 @@ def delete_stream(stream_id):
     if stream_id not in manager.streams:
         return jsonify({'error': 'Stream não encontrado'}), 404
 
-    # Parar se estiver rodando
-    if stream_id in manager.processes:
-        manager.stop_stream(stream_id)
+    # Parar se estiver rodando (ou com reinício agendado)
+    _stop_in_pool(stream_id)
+    manager.restart_policies.pop(stream_id, None)
 
     del manager.streams[stream_id]
     manager.save_config()
@@ -431,20 +3307,144 @@ def delete_stream(stream_id):
 
 @app.route('/api/streams/<stream_id>/start', methods=['POST'])
 def start_stream(stream_id):
-    """Inicia um stream"""
-    success, message = manager.start_stream(stream_id)
-    status_code = 200 if success else 400
-    return jsonify({'success': success, 'message': message}), status_code
+    """Agenda o início de um stream; o progresso segue via WebSocket"""
+    success, message, job_id = manager.start_stream(stream_id)
+    status_code = 202 if success else 400
+    return jsonify({'success': success, 'message': message, 'job_id': job_id}), status_code
 
 
 @app.route('/api/streams/<stream_id>/stop', methods=['POST'])
 def stop_stream(stream_id):
     """Para um stream"""
-    success, message = manager.stop_stream(stream_id)
+    success, message = _stop_in_pool(stream_id)
     status_code = 200 if success else 400
     return jsonify({'success': success, 'message': message}), status_code
 
 
+def _stop_in_pool(stream_id, timeout=60):
+    """Para o stream no stop_pool: a espera pelos processos não bloqueia o loop do eventlet"""
+    future = manager.stop_pool.submit(manager.stop_stream, stream_id)
+    if not _wait_until_done(future.done, timeout):
+        return False, "Tempo esgotado aguardando a parada"
+    return future.result()
+
+
+def _bulk_request_ids(default_selector):
+    """Extrai ids ou seletor do corpo de uma requisição em lote"""
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    selector = data.get('selector', default_selector)
+    if ids is not None and not isinstance(ids, list):
+        return None, data, "Campo 'ids' deve ser uma lista"
+    if ids is None and selector not in BULK_SELECTORS:
+        return None, data, f"Seletor inválido, use: {', '.join(BULK_SELECTORS)}"
+    return manager.select_streams(ids, selector), data, None
+
+
+def _wait_until_done(is_done, timeout, interval=0.1):
+    """Aguarda cedendo o loop do eventlet em vez de bloquear o servidor"""
+    deadline = time.monotonic() + timeout
+    while not is_done() and time.monotonic() < deadline:
+        socketio.sleep(interval)
+    return is_done()
+
+
+@app.route('/api/streams/bulk/start', methods=['POST'])
+def bulk_start_streams():
+    """Inicia vários streams em paralelo (ids ou seletor), com concorrência limitada"""
+    stream_ids, data, error = _bulk_request_ids('stopped')
+    if error:
+        return jsonify({'error': error}), 400
+
+    results = manager.bulk_start(stream_ids)
+
+    # Opcional: aguardar os jobs e devolver o resultado final de cada stream
+    if data.get('wait'):
+        job_ids = [r['job_id'] for r in results.values() if r['job_id']]
+        _wait_until_done(
+            lambda: all(manager.jobs.get(j, {}).get('finished_at') for j in job_ids),
+            float(data.get('timeout', 120))
+        )
+        for result in results.values():
+            job = manager.get_job(result['job_id']) if result['job_id'] else None
+            if job:
+                result['job_state'] = job['state']
+                result['success'] = job['state'] in ('pending', 'running', 'done')
+                if job['error']:
+                    result['message'] = job['error']
+
+    return jsonify({
+        'success': all(r['success'] for r in results.values()),
+        'results': results
+    }), 202
+
+
+@app.route('/api/streams/bulk/stop', methods=['POST'])
+def bulk_stop_streams():
+    """Para vários streams em paralelo (ids ou seletor)"""
+    stream_ids, data, error = _bulk_request_ids('running')
+    if error:
+        return jsonify({'error': error}), 400
+
+    futures = manager.bulk_stop(stream_ids)
+    _wait_until_done(lambda: all(f.done() for f in futures.values()),
+                     float(data.get('timeout', 60)))
+
+    results = {}
+    for stream_id, future in futures.items():
+        if future.done():
+            success, message = future.result()
+        else:
+            success, message = False, "Tempo esgotado aguardando a parada"
+        results[stream_id] = {'success': success, 'message': message}
+
+    return jsonify({
+        'success': all(r['success'] for r in results.values()),
+        'results': results
+    })
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Retorna o progresso de um job de inicialização"""
+    job = manager.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/streams/<stream_id>/resources', methods=['GET'])
+def get_stream_resources(stream_id):
+    """Consumo de CPU, memória e I/O de um stream, por componente"""
+    if stream_id not in manager.streams:
+        return jsonify({'error': 'Stream não encontrado'}), 404
+    resources = manager.get_stream_resources(stream_id)
+    if resources is None:
+        return jsonify({'error': 'Stream não está rodando ou ainda não foi amostrado'}), 404
+    return jsonify(resources)
+
+
+@app.route('/api/placement', methods=['GET'])
+def get_placement():
+    """Topologia de CPU/NUMA e núcleos atribuídos a cada stream"""
+    return jsonify(manager.placer.snapshot())
+
+
+@app.route('/api/streams/<stream_id>/playlist', methods=['GET'])
+def validate_stream_playlist(stream_id):
+    """Valida agora a playlist publicada de um stream (segmentos listados, durações, sequência)"""
+    if stream_id not in manager.streams:
+        return jsonify({'error': 'Stream não encontrado'}), 404
+    if stream_id not in manager.processes:
+        return jsonify({'error': 'Stream não está rodando'}), 404
+    errors = manager.validate_playlist(stream_id)
+    return jsonify({
+        'playlist': manager.get_playlist_name(manager.streams[stream_id]),
+        'valid': not errors,
+        'errors': errors
+    })
+
+
 @app.route('/api/streams/<stream_id>/vnc/start', methods=['POST'])
 def start_vnc(stream_id):
     """Inicia VNC para um stream"""
@@ -461,8 +3461,82 @@ def stop_vnc(stream_id):
 
 @app.route('/api/system/stats', methods=['GET'])
 def get_system_stats():
-    """Retorna estatísticas do sistema"""
-    return jsonify(manager.get_system_stats())
+    """Retorna a última amostra do sistema (?history=<segundos> inclui o histórico)"""
+    history = request.args.get('history', 0, type=int)
+    return jsonify(manager.get_system_stats(history))
+
+
+@app.route('/hls/<stream_id>/<path:filename>', methods=['GET'])
+def serve_hls(stream_id, filename):
+    """Origin HLS: reload bloqueante e preload hint do LL-HLS e, se habilitado, o resto do /hls/"""
+    if stream_id not in manager.streams:
+        return jsonify({'error': 'Stream não encontrado'}), 404
+    packager = manager.ll_packager
+    low_latency = False
+
+    if filename.endswith('.m3u8'):
+        manager.record_view(stream_id)
+        failure = manager.lazy_failure(stream_id)
+        if failure:
+            # Disjuntor aberto: o stream não será iniciado, a tela preta ficaria para sempre
+            return Response(f'{failure}\n', status=503, mimetype='text/plain')
+        if manager.is_lazy_pending(stream_id):
+            # Stream sob demanda ainda iniciando: tela preta ou "tente de novo"
+            placeholder = manager.placeholder_playlist(stream_id)
+            if placeholder is None:
+                return Response('Stream iniciando\n', status=503, mimetype='text/plain',
+                                headers={'Retry-After': str(PLACEHOLDER_DURATION)})
+            return Response(placeholder, mimetype=HLS_MIMETYPES['.m3u8'],
+                            headers={'Cache-Control': 'no-cache'})
+    if filename == PLACEHOLDER_SEGMENT and manager.placeholder_path.exists():
+        # Cada ?seq= tem conteúdo fixo (os timestamps dependem só da sequência)
+        segment = manager.placeholder_segment(request.args.get('seq', 0, type=int))
+        return Response(segment, mimetype=HLS_MIMETYPES['.ts'],
+                        headers={'Cache-Control': 'public, max-age=86400'})
+
+    msn = request.args.get('_HLS_msn', type=int)
+    if filename == 'index.m3u8' and msn is not None:
+        # Reload bloqueante: segurar até a playlist conter o segmento/parte pedido
+        if not packager.is_active(stream_id):
+            return jsonify({'error': 'Stream não está em modo low_latency'}), 404
+        # Pedidos mais de dois segmentos à frente da playlist são recusados (RFC 8216bis)
+        if msn > packager.next_msn(stream_id) + 1:
+            return jsonify({'error': '_HLS_msn muito à frente da playlist'}), 400
+        part = request.args.get('_HLS_part', type=int)
+        target, _ = packager.timing(stream_id)
+        if not _wait_until_done(lambda: packager.has_part(stream_id, msn, part),
+                                3 * target, LL_POLL_INTERVAL):
+            return jsonify({'error': 'Parte não publicada a tempo'}), 503
+        low_latency = True
+
+    match = LL_PART_PATTERN.fullmatch(filename)
+    if match and packager.is_active(stream_id):
+        # Preload hint: a parte anunciada ainda pode estar em gravação
+        number = int(match.group(1))
+        _, part_target = packager.timing(stream_id)
+        if not _wait_until_done(lambda: packager.has_file(stream_id, number),
+                                3 * part_target, LL_POLL_INTERVAL):
+            return jsonify({'error': 'Parte não publicada a tempo'}), 404
+        low_latency = True
+
+    if not (manager.hls_origin.enabled or low_latency):
+        return jsonify({'error': 'Origin HLS desabilitado (servido pelo nginx)'}), 404
+    response = manager.hls_origin.serve(stream_id, filename)
+    if response is None:
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+    return response
+
+
+@app.route('/api/encoder-profiles', methods=['GET'])
+def get_encoder_profiles():
+    """Lista os perfis de encoder já resolvidos sobre os padrões"""
+    profiles = {}
+    for name in ['default', *manager.server_config.get('encoder_profiles', {})]:
+        try:
+            profiles[name] = manager.get_encoder_profile(name)
+        except ValueError as e:
+            profiles[name] = {'error': str(e)}
+    return jsonify(profiles)
 
 
 @app.route('/api/profiles', methods=['GET'])
@@ -493,8 +3567,7 @@ def get_logs(stream_id):
 # WebSocket events
 @socketio.on('connect')
 def handle_connect():
-    """Cliente conectou"""
-    emit('status_update', manager.get_all_status())
+    """Cliente conectou; o estado inicial é pedido pelo cliente via 'resync'"""
     logger.info("Cliente WebSocket conectado")
 
 
@@ -506,29 +3579,28 @@ def handle_disconnect():
 
 @socketio.on('request_status')
 def handle_request_status():
-    """Cliente solicitou atualização de status"""
-    emit('status_update', manager.get_all_status())
+    """Cliente solicitou o estado completo (equivale a um resync sem revisão)"""
+    event, payload = manager.get_status_since(0)
+    emit(event, payload)
+
+
+@socketio.on('resync')
+def handle_resync(data=None):
+    """Cliente pede as mudanças desde a revisão que conhece (0 = snapshot completo)"""
+    data = data or {}
+    try:
+        rev = int(data.get('rev', 0))
+    except (TypeError, ValueError):
+        rev = 0
+    event, payload = manager.get_status_since(rev, data.get('epoch'))
+    emit(event, payload)
 
 
 # Thread para atualizar status periodicamente
 def status_updater():
-    """Atualiza status dos streams periodicamente"""
+    """Publica mudanças periodicamente; quedas de processos são tratadas pelo ChildWatcher"""
     while True:
-        time.sleep(5)
-
-        # Verificar processos mortos
-        for stream_id in list(manager.processes.keys()):
-            procs = manager.processes[stream_id]
-            all_alive = all(
-                procs.get(p) and procs[p].poll() is None
-                for p in ['xvfb', 'browser', 'ffmpeg']
-            )
-            if not all_alive:
-                logger.warning(f"[{stream_id}] Processo morreu, reiniciando...")
-                manager.stop_stream(stream_id)
-                time.sleep(2)
-                manager.start_stream(stream_id)
-
+        time.sleep(METRICS_INTERVAL)
         manager.emit_status_update()
 
 
@@ -536,8 +3608,7 @@ def status_updater():
 def signal_handler(sig, frame):
     """Handle shutdown signals"""
     logger.info("Encerrando Stream Manager...")
-    for stream_id in list(manager.processes.keys()):
-        manager.stop_stream(stream_id)
+    manager.stop_all()
     sys.exit(0)
 
 
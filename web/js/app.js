@@ -5,6 +5,9 @@
 // Estado global
 const state = {
     streams: {},
+    resources: {},
+    epoch: null,
+    rev: 0,
     socket: null,
     editingStreamId: null,
     serverHost: window.location.hostname
@@ -40,6 +43,7 @@ document.addEventListener('DOMContentLoaded', () => {
     initSocket();
     initEventListeners();
     loadStreams();
+    loadEncoderProfiles();
     startStatsUpdater();
 });
 
@@ -51,17 +55,51 @@ function initSocket() {
 
     state.socket.on('connect', () => {
         console.log('WebSocket conectado');
+        requestResync();
     });
 
     state.socket.on('disconnect', () => {
         console.log('WebSocket desconectado');
     });
 
-    state.socket.on('status_update', (data) => {
-        state.streams = data;
+    state.socket.on('system_stats', renderSystemStats);
+
+    // Estado completo: primeira conexão ou revisão local inválida
+    state.socket.on('status_snapshot', (data) => {
+        state.epoch = data.epoch;
+        state.rev = data.rev;
+        state.streams = data.streams;
         renderStreams();
         updateStreamsStat();
     });
+
+    // Apenas os campos alterados desde base_rev
+    state.socket.on('status_patch', (patch) => {
+        if (patch.epoch !== state.epoch || patch.base_rev !== state.rev) {
+            if (patch.epoch !== state.epoch || patch.rev > state.rev) {
+                requestResync();
+            }
+            return;
+        }
+        applyStatusPatch(patch);
+    });
+}
+
+function requestResync() {
+    state.socket.emit('resync', { epoch: state.epoch, rev: state.rev });
+}
+
+function applyStatusPatch(patch) {
+    Object.entries(patch.streams).forEach(([id, fields]) => {
+        state.streams[id] = { ...(state.streams[id] || {}), ...fields };
+        updateStreamCard(id);
+    });
+    patch.removed.forEach(id => {
+        delete state.streams[id];
+        updateStreamCard(id);
+    });
+    state.rev = patch.rev;
+    updateStreamsStat();
 }
 
 // Event Listeners
@@ -70,7 +108,10 @@ function initEventListeners() {
     elements.btnAddStream.addEventListener('click', () => openStreamModal());
     elements.btnStartAll.addEventListener('click', startAllStreams);
     elements.btnStopAll.addEventListener('click', stopAllStreams);
-    elements.btnRefresh.addEventListener('click', loadStreams);
+    elements.btnRefresh.addEventListener('click', () => {
+        state.rev = 0;
+        requestResync();
+    });
 
     // Modal de stream
     elements.btnCloseModal.addEventListener('click', closeStreamModal);
@@ -127,6 +168,8 @@ async function apiCall(endpoint, method = 'GET', data = null) {
 async function loadStreams() {
     try {
         const streams = await apiCall('/streams');
+        // O snapshot do WebSocket, se já chegou, é mais recente
+        if (state.rev !== 0) return;
         state.streams = streams;
         renderStreams();
         updateStreamsStat();
@@ -135,19 +178,47 @@ async function loadStreams() {
     }
 }
 
+async function loadEncoderProfiles() {
+    try {
+        const profiles = await apiCall('/encoder-profiles');
+        const select = elements.formStream.elements['encoder_profile'];
+        select.innerHTML = Object.entries(profiles)
+            .filter(([, profile]) => !profile.error)
+            .map(([name, profile]) => `<option value="${escapeHtml(name)}">${escapeHtml(name)} (${profile.fps} fps, ${profile.preset})</option>`)
+            .join('');
+    } catch (error) {
+        console.error('Erro ao carregar perfis de encoder:', error);
+    }
+}
+
 async function loadSystemStats() {
     try {
-        const stats = await apiCall('/system/stats');
-        elements.cpuStat.textContent = `${stats.cpu_percent.toFixed(1)}%`;
-        elements.ramStat.textContent = `${stats.memory_percent.toFixed(1)}%`;
+        renderSystemStats(await apiCall('/system/stats'));
     } catch (error) {
         console.error('Erro ao carregar stats:', error);
     }
 }
 
+function renderSystemStats(stats) {
+    elements.cpuStat.textContent = `${stats.cpu_percent.toFixed(1)}%`;
+    elements.ramStat.textContent = `${stats.memory_percent.toFixed(1)}%`;
+
+    // Consumo por stream chega a cada amostra: atualiza só o selo, sem recriar os cards
+    state.resources = stats.stream_resources || {};
+    elements.streamsContainer.querySelectorAll('.stream-card').forEach(card => {
+        renderStreamResources(card.querySelector('.stream-resources'), state.resources[card.dataset.id]);
+    });
+}
+
+function renderStreamResources(element, usage) {
+    if (!element) return;
+    element.textContent = usage ? `💻 ${usage.cpu_percent.toFixed(0)}% · ${usage.rss_mb.toFixed(0)} MB` : '';
+    element.classList.toggle('hidden', !usage);
+}
+
 function startStatsUpdater() {
+    // Carga inicial; as próximas amostras chegam pelo evento system_stats
     loadSystemStats();
-    setInterval(loadSystemStats, 5000);
 }
 
 function updateStreamsStat() {
@@ -181,13 +252,39 @@ function renderStreams() {
     });
 }
 
+// Atualiza somente o card de um stream (patch incremental)
+function updateStreamCard(streamId) {
+    const stream = state.streams[streamId];
+    const existing = elements.streamsContainer.querySelector(`.stream-card[data-id="${CSS.escape(streamId)}"]`);
+
+    if (!stream) {
+        if (existing) existing.remove();
+    } else if (existing) {
+        existing.replaceWith(createStreamCard(stream));
+    } else {
+        elements.streamsContainer.appendChild(createStreamCard(stream));
+    }
+
+    elements.emptyState.classList.toggle('hidden', Object.keys(state.streams).length > 0);
+}
+
 function createStreamCard(stream) {
     const card = document.createElement('div');
     card.className = `stream-card ${stream.state || 'stopped'}`;
     card.dataset.id = stream.id;
 
-    const statusClass = stream.running ? 'running' : stream.state === 'starting' ? 'starting' : 'stopped';
-    const statusText = stream.running ? 'Rodando' : stream.state === 'starting' ? 'Iniciando...' : 'Parado';
+    const statusClass = {
+        starting: 'starting',
+        restarting: 'starting',
+        recovering: 'starting',
+        crash_loop: 'crash-loop'
+    }[stream.state] || (stream.running ? 'running' : 'stopped');
+    const statusText = {
+        starting: `Iniciando${stream.stage ? ` (${stream.stage})` : ''}...`,
+        restarting: `Reiniciando (${stream.restart_count}x)...`,
+        recovering: 'Recuperando componente...',
+        crash_loop: 'Falhando repetidamente'
+    }[stream.state] || (stream.running ? 'Rodando' : 'Parado');
 
     card.innerHTML = `
         <div class="stream-header">
@@ -204,9 +301,17 @@ function createStreamCard(stream) {
             <div class="stream-url">${escapeHtml(stream.url)}</div>
             <div class="stream-meta">
                 <span>📐 ${stream.resolution}</span>
+                <span title="Perfil de encoder">🎞️ ${escapeHtml(stream.encoder_profile || 'default')}</span>
                 <span>${stream.audio ? '🔊 Áudio' : '🔇 Sem áudio'}</span>
+                ${stream.lazy ? '<span title="Inicia no primeiro pedido de playlist e para quando ocioso">💤 Sob demanda</span>' : ''}
+                <span class="stream-resources hidden" title="CPU e memória de Xvfb + navegador + FFmpeg"></span>
+                ${stream.numa_node !== null && stream.numa_node !== undefined ? `<span title="Nó NUMA onde encoder e navegador estão fixados">🧩 NUMA ${stream.numa_node}</span>` : ''}
+                ${stream.hls_storage === 'ram' ? '<span title="Segmentos HLS em memória (tmpfs)">⚡ RAM</span>' : ''}
+                ${stream.start_latency_ms ? `<span title="Tempo de inicialização">⏱️ ${(stream.start_latency_ms / 1000).toFixed(1)}s</span>` : ''}
                 ${stream.vnc_active ? '<span class="vnc-badge">🖥️ VNC ativo</span>' : ''}
             </div>
+            ${stream.last_error ? `<div class="stream-error">⚠️ ${escapeHtml(stream.last_error)}</div>` : ''}
+            ${stream.playlist_errors && stream.playlist_errors.length ? `<div class="stream-error" title="${escapeHtml(stream.playlist_errors.join('\n'))}">📄 Playlist inconsistente: ${escapeHtml(stream.playlist_errors[0])}</div>` : ''}
             <div class="stream-actions">
                 ${stream.running ? `
                     <button class="btn btn-danger btn-sm" onclick="stopStream('${stream.id}')">
@@ -235,6 +340,7 @@ function createStreamCard(stream) {
             </div>
         </div>
     `;
+    renderStreamResources(card.querySelector('.stream-resources'), state.resources[stream.id]);
 
     return card;
 }
@@ -242,8 +348,8 @@ function createStreamCard(stream) {
 // Stream Actions
 async function startStream(streamId) {
     try {
-        await apiCall(`/streams/${streamId}/start`, 'POST');
-        showToast(`Stream "${streamId}" iniciando...`, 'success');
+        const result = await apiCall(`/streams/${streamId}/start`, 'POST');
+        showToast(`Stream "${streamId}" iniciando (job ${result.job_id})...`, 'success');
     } catch (error) {
         showToast(`Erro ao iniciar stream: ${error.message}`, 'error');
     }
@@ -259,20 +365,35 @@ async function stopStream(streamId) {
 }
 
 async function startAllStreams() {
-    const streams = Object.values(state.streams).filter(s => !s.running);
-    for (const stream of streams) {
-        await startStream(stream.id);
-        await new Promise(resolve => setTimeout(resolve, 2000)); // Delay entre starts
+    try {
+        const result = await apiCall('/streams/bulk/start', 'POST', { selector: 'stopped' });
+        showBulkResult(result, 'iniciando');
+    } catch (error) {
+        showToast(`Erro ao iniciar streams: ${error.message}`, 'error');
     }
 }
 
 async function stopAllStreams() {
-    const streams = Object.values(state.streams).filter(s => s.running);
-    for (const stream of streams) {
-        await stopStream(stream.id);
+    try {
+        const result = await apiCall('/streams/bulk/stop', 'POST', { selector: 'running' });
+        showBulkResult(result, 'parados');
+    } catch (error) {
+        showToast(`Erro ao parar streams: ${error.message}`, 'error');
     }
 }
 
+function showBulkResult(result, action) {
+    const entries = Object.entries(result.results);
+    const failed = entries.filter(([, r]) => !r.success);
+    if (entries.length === 0) {
+        showToast('Nenhum stream para processar', 'info');
+        return;
+    }
+    showToast(`${entries.length - failed.length}/${entries.length} streams ${action}`,
+        failed.length ? 'error' : 'success');
+    failed.forEach(([id, r]) => showToast(`${id}: ${r.message}`, 'error'));
+}
+
 async function deleteStream(streamId) {
     if (!confirm(`Tem certeza que deseja excluir o stream "${streamId}"?`)) {
         return;
@@ -317,7 +438,10 @@ function openStreamModal(streamId = null) {
         form.elements['url'].value = stream.url;
         form.elements['resolution'].value = stream.resolution;
         form.elements['profile'].value = stream.profile || '';
+        form.elements['encoder_profile'].value = stream.encoder_profile || 'default';
         form.elements['audio'].checked = stream.audio;
+        form.elements['lazy'].checked = !!stream.lazy;
+        form.elements['warm_start'].checked = !!stream.warm_start;
     } else {
         // Novo stream
         elements.modalStreamTitle.textContent = 'Novo Stream';
@@ -343,7 +467,10 @@ async function handleStreamSubmit(e) {
         url: form.elements['url'].value,
         resolution: form.elements['resolution'].value,
         profile: form.elements['profile'].value || form.elements['id'].value,
-        audio: form.elements['audio'].checked
+        encoder_profile: form.elements['encoder_profile'].value,
+        audio: form.elements['audio'].checked,
+        lazy: form.elements['lazy'].checked,
+        warm_start: form.elements['warm_start'].checked
     };
 
     try {
@@ -368,9 +495,12 @@ function showLinks(streamId) {
     const port = window.location.port || '8080';
     const host = state.serverHost;
 
-    document.getElementById('link-hls').value = `http://${host}:${port}/hls/${streamId}/index.m3u8`;
+    // No modo ABR o hls_url aponta para o master.m3u8
+    const hlsPath = stream.hls_url || `/hls/${streamId}/index.m3u8`;
+
+    document.getElementById('link-hls').value = `http://${host}:${port}${hlsPath}`;
     document.getElementById('link-rtmp').value = `rtmp://${host}:1935/live/${streamId}`;
-    document.getElementById('link-vlc').value = `vlc http://${host}:${port}/hls/${streamId}/index.m3u8`;
+    document.getElementById('link-vlc').value = `vlc http://${host}:${port}${hlsPath}`;
 
     elements.modalLinks.classList.add('active');
 }